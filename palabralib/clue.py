@@ -15,12 +15,18 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from collections import namedtuple
+from array import array
+from bisect import bisect_left
+from collections import Mapping, namedtuple
 import glib
 import gobject
 import gtk
+import heapq
+import mmap
 import operator
 import os
+import re
+import struct
 
 import constants
 from gui_common import (
@@ -37,11 +43,326 @@ from gui_common import (
 )
 import preferences
 import transform
+from word import WordPattern
 
 ClueFile = namedtuple('ClueFile', ['path', 'name', 'data'])
 
+CLUE_INDEX_EXTENSION = ".pcidx"
+CLUE_INDEX_MAGIC = "PALCLUE\0"
+CLUE_INDEX_VERSION = 3
+# detects a compiled clue index that was written with a different byte order
+CLUE_INDEX_BYTE_ORDER = 0x01020304
+# magic, version, byte order, mtime, size, number of words, clues,
+# tokens and postings, length of path
+CLUE_INDEX_HEADER = struct.Struct("=8siidqqqqqi")
+CLUE_INDEX_OFFSET = struct.Struct("=q")
+CLUE_INDEX_POSTING = "i"
+CLUE_INDEX_ENTRY = struct.Struct("=" + CLUE_INDEX_POSTING)
+
+def get_clue_index_path(path):
+    """Return the path of the compiled index of the given clue file."""
+    return path + CLUE_INDEX_EXTENSION
+
+def _clue_index_start(l_path):
+    """Return the offset of the offset tables, aligned to the size of an offset."""
+    offset = CLUE_INDEX_HEADER.size + l_path
+    return offset + (-offset % CLUE_INDEX_OFFSET.size)
+
+CLUE_TOKEN = re.compile("[a-z0-9]+")
+
+def tokenize_clue(clue):
+    """Return the distinct lower case words of letters and digits in a clue."""
+    return set(CLUE_TOKEN.findall(clue.lower()))
+
+def write_clue_index(path, clues):
+    """
+    Write a compiled index of the clues next to the clue file.
+    The words are stored in alphabetical order with tables of offsets
+    into the words and into the clues so a word can be looked up without
+    reading the clue file. For each token of the clues, the numbers of
+    the clues in which it occurs are stored twice: in increasing order
+    and with the shortest clues first. The rank of each clue among the
+    clues from short to long is stored as well.
+    The index is only valid for the current path, modification time and
+    size of the clue file.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    a_path = os.path.abspath(path)
+    words = sorted(clues.keys())
+    word_offsets = [0]
+    clue_starts = [0]
+    clue_offsets = [0]
+    s_clues = []
+    for word in words:
+        word_offsets.append(word_offsets[-1] + len(word))
+        for clue in clues[word]:
+            clue_offsets.append(clue_offsets[-1] + len(clue))
+            s_clues.append(clue)
+        clue_starts.append(len(clue_offsets) - 1)
+    # a stable sort ranks clues of the same length by word
+    lengths = map(len, s_clues)
+    ranks = array(CLUE_INDEX_POSTING, [0]) * len(s_clues)
+    for r, c in enumerate(sorted(xrange(len(s_clues)), key=lengths.__getitem__)):
+        ranks[c] = r
+    postings = {}
+    for c, clue in enumerate(s_clues):
+        for token in tokenize_clue(clue):
+            try:
+                postings[token].append(c)
+            except KeyError:
+                postings[token] = [c]
+    tokens = sorted(postings.keys())
+    token_offsets = [0]
+    posting_starts = [0]
+    a_postings = array(CLUE_INDEX_POSTING)
+    a_ranked = array(CLUE_INDEX_POSTING)
+    for token in tokens:
+        token_offsets.append(token_offsets[-1] + len(token))
+        a_postings.extend(postings[token])
+        a_ranked.extend(sorted(postings[token], key=ranks.__getitem__))
+        posting_starts.append(len(a_postings))
+    header = CLUE_INDEX_HEADER.pack(CLUE_INDEX_MAGIC, CLUE_INDEX_VERSION
+        , CLUE_INDEX_BYTE_ORDER, st.st_mtime, st.st_size
+        , len(words), len(s_clues), len(tokens), len(a_postings), len(a_path))
+    padding = _clue_index_start(len(a_path)) - len(header) - len(a_path)
+    offsets = word_offsets + clue_starts + clue_offsets + token_offsets + posting_starts
+    t_path = get_clue_index_path(path) + ".tmp"
+    try:
+        with open(t_path, "wb") as f:
+            f.write(header)
+            f.write(a_path)
+            f.write("\0" * padding)
+            f.write(struct.pack("=%iq" % len(offsets), *offsets))
+            f.write(a_postings.tostring())
+            f.write(a_ranked.tostring())
+            f.write(ranks.tostring())
+            f.write(''.join(words))
+            f.write(''.join(s_clues))
+            f.write(''.join(tokens))
+        os.rename(t_path, get_clue_index_path(path))
+    except (IOError, OSError):
+        return False
+    return True
+
+class ClueStore(Mapping):
+    """
+    Read-only mapping of words to their clues, backed by the
+    memory-mapped compiled index of a clue file.
+    """
+    def __init__(self, buf, n_words, n_clues, n_tokens, n_postings, l_path):
+        self.buf = buf
+        self.n_words = n_words
+        self.n_clues = n_clues
+        self.n_tokens = n_tokens
+        size = CLUE_INDEX_OFFSET.size
+        self.word_offsets = _clue_index_start(l_path)
+        self.clue_starts = self.word_offsets + (n_words + 1) * size
+        self.clue_offsets = self.clue_starts + (n_words + 1) * size
+        self.token_offsets = self.clue_offsets + (n_clues + 1) * size
+        self.posting_starts = self.token_offsets + (n_tokens + 1) * size
+        self.postings = self.posting_starts + (n_tokens + 1) * size
+        self.ranked = self.postings + n_postings * CLUE_INDEX_ENTRY.size
+        self.ranks = self.ranked + n_postings * CLUE_INDEX_ENTRY.size
+        self.words = self.ranks + n_clues * CLUE_INDEX_ENTRY.size
+        self.clues = self.words + self._offset(self.word_offsets, n_words)
+        self.tokens = self.clues + self._offset(self.clue_offsets, n_clues)
+        self.end = self.tokens + self._offset(self.token_offsets, n_tokens)
+
+    def _offset(self, table, i):
+        return CLUE_INDEX_OFFSET.unpack_from(self.buf, table + i * CLUE_INDEX_OFFSET.size)[0]
+
+    def _word(self, i):
+        start = self.words + self._offset(self.word_offsets, i)
+        end = self.words + self._offset(self.word_offsets, i + 1)
+        return self.buf[start:end]
+
+    def _clue(self, c):
+        start = self.clues + self._offset(self.clue_offsets, c)
+        end = self.clues + self._offset(self.clue_offsets, c + 1)
+        return self.buf[start:end]
+
+    def _token(self, t):
+        start = self.tokens + self._offset(self.token_offsets, t)
+        end = self.tokens + self._offset(self.token_offsets, t + 1)
+        return self.buf[start:end]
+
+    def _bisect(self, n, key, value):
+        """Return the first i in [0, n) for which key(i) >= value."""
+        lo, hi = 0, n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key(mid) < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _find(self, word):
+        """Return the position of the word in the index or -1 if it does not exist."""
+        i = self._bisect(self.n_words, self._word, word)
+        if i < self.n_words and self._word(i) == word:
+            return i
+        return -1
+
+    def _clue_word(self, c):
+        """Return the position of the word of the given clue."""
+        return self._bisect(self.n_words + 1
+            , lambda i: self._offset(self.clue_starts, i), c + 1) - 1
+
+    def _postings(self, start, end):
+        """Return the postings in [start, end), in increasing order, as an array."""
+        size = CLUE_INDEX_ENTRY.size
+        return array(CLUE_INDEX_POSTING, self.buf[self.postings + start * size:self.postings + end * size])
+
+    def _ranked_posting(self, i):
+        return CLUE_INDEX_ENTRY.unpack_from(self.buf, self.ranked + i * CLUE_INDEX_ENTRY.size)[0]
+
+    def _rank(self, c):
+        return CLUE_INDEX_ENTRY.unpack_from(self.buf, self.ranks + c * CLUE_INDEX_ENTRY.size)[0]
+
+    def _posting_range(self, token):
+        """Return the range of the postings of the token, empty if it does not exist."""
+        t = self._bisect(self.n_tokens, self._token, token)
+        if t == self.n_tokens or self._token(t) != token:
+            return 0, 0
+        return self._offset(self.posting_starts, t), self._offset(self.posting_starts, t + 1)
+
+    def _intersect(self, ranges, first, last):
+        """
+        Return the numbers of the clues in [first, last) that are in all
+        ranges of postings. The clues of the rarest postings are searched
+        in the other postings, each from the position of the previous clue.
+        """
+        rarest = self._postings(*ranges[0])
+        clues = rarest[bisect_left(rarest, first):bisect_left(rarest, last)]
+        for start, end in ranges[1:]:
+            if not clues:
+                break
+            postings = self._postings(start, end)
+            found = array(CLUE_INDEX_POSTING)
+            i = 0
+            for c in clues:
+                i = bisect_left(postings, c, i)
+                if i == len(postings):
+                    break
+                if postings[i] == c:
+                    found.append(c)
+            clues = found
+        return clues
+
+    def _walk_ranked(self, ranges):
+        """
+        Yield the numbers of the clues that are in all ranges of postings,
+        shortest clues first, by walking the rarest postings by rank.
+        """
+        others = [self._postings(*r) for r in ranges[1:]]
+        start, end = ranges[0]
+        for i in xrange(start, end):
+            c = self._ranked_posting(i)
+            for postings in others:
+                j = bisect_left(postings, c)
+                if j == len(postings) or postings[j] != c:
+                    break
+            else:
+                yield c
+
+    def _word_range(self, prefix):
+        """Return the positions of the words that start with the given prefix."""
+        first = self._bisect(self.n_words, self._word, prefix)
+        last = self._bisect(self.n_words, lambda i: self._word(i)[:len(prefix)], prefix + "\0")
+        return xrange(first, last)
+
+    def search(self, tokens, pattern=None, limit=None):
+        """
+        Return (word, clue) pairs of the clues that contain all tokens and
+        of which the word matches the pattern, shortest clues first.
+        """
+        if not tokens:
+            if pattern is None:
+                return []
+            result = []
+            for i in self._word_range(pattern.prefix.split("?")[0]):
+                word = self._word(i)
+                if pattern.match(word):
+                    result.extend([(word, clue) for clue in self[word]])
+            key = lambda item: len(item[1])
+            if limit is None:
+                return sorted(result, key=key)
+            return heapq.nsmallest(limit, result, key=key)
+        ranges = sorted([self._posting_range(t) for t in tokens], key=lambda r: r[1] - r[0])
+        # the clues of the words with the prefix of the pattern are consecutive
+        first, last = 0, self.n_clues
+        if pattern is not None:
+            words = self._word_range(pattern.prefix.split("?")[0])
+            first = self._offset(self.clue_starts, words[0]) if words else 0
+            last = self._offset(self.clue_starts, words[-1] + 1) if words else 0
+        if limit is not None and (first, last) == (0, self.n_clues):
+            # the first clues by rank are found without visiting the others
+            clues = self._walk_ranked(ranges)
+        else:
+            clues = sorted(self._intersect(ranges, first, last), key=self._rank)
+        result = []
+        for c in clues:
+            if limit is not None and len(result) >= limit:
+                break
+            word = self._word(self._clue_word(c))
+            if pattern is None or pattern.match(word):
+                result.append((word, self._clue(c)))
+        return result
+
+    def __getitem__(self, word):
+        i = self._find(word)
+        if i < 0:
+            raise KeyError(word)
+        first = self._offset(self.clue_starts, i)
+        last = self._offset(self.clue_starts, i + 1)
+        return [self._clue(c) for c in xrange(first, last)]
+
+    def __contains__(self, word):
+        return isinstance(word, str) and self._find(word) >= 0
+
+    def __iter__(self):
+        for i in xrange(self.n_words):
+            yield self._word(i)
+
+    def __len__(self):
+        return self.n_words
+
+def open_clue_index(path):
+    """
+    Return a ClueStore for the compiled index of the given clue file
+    or None when there is no valid index.
+    """
+    try:
+        st = os.stat(path)
+        with open(get_clue_index_path(path), "rb") as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError, mmap.error):
+        return None
+    try:
+        header = CLUE_INDEX_HEADER.unpack_from(buf)
+    except struct.error:
+        return None
+    magic, version, byte_order, mtime, size = header[:5]
+    n_words, n_clues, n_tokens, n_postings, l_path = header[5:]
+    if (magic, version, byte_order) != (CLUE_INDEX_MAGIC, CLUE_INDEX_VERSION, CLUE_INDEX_BYTE_ORDER):
+        return None
+    if (mtime, size) != (st.st_mtime, st.st_size):
+        return None
+    if buf[CLUE_INDEX_HEADER.size:CLUE_INDEX_HEADER.size + l_path] != os.path.abspath(path):
+        return None
+    store = ClueStore(buf, n_words, n_clues, n_tokens, n_postings, l_path)
+    if store.end != len(buf):
+        return None
+    return store
+
 def count_n_clues(clue_db):
     """Compute the number of clues in the clue database."""
+    if isinstance(clue_db.data, ClueStore):
+        return clue_db.data.n_clues
     n_clues = 0
     for word in clue_db.data.keys():
         n_clues += len(clue_db.data[word])
@@ -49,7 +370,7 @@ def count_n_clues(clue_db):
 
 def count_n_words(clue_db):
     """Compute the number of words in the clue database."""
-    return len(clue_db.data.keys())
+    return len(clue_db.data)
 
 def read_clues(path):
     if not os.path.exists(path):
@@ -77,22 +398,59 @@ def read_clues(path):
                 clues[l_word].append(clue)
     return clues
 
+def load_clues(path):
+    """
+    Return the clues of the clue file from its compiled index when it is
+    up-to-date, otherwise the file is read and the index is written.
+    """
+    store = open_clue_index(path)
+    if store is not None:
+        return store
+    clues = read_clues(path)
+    if write_clue_index(path, clues):
+        store = open_clue_index(path)
+        if store is not None:
+            return store
+    return clues
+
 def create_clues(prefs):
     files = []
     for data in prefs:
         path = data["path"]["value"]
         name = data["name"]["value"]
-        files.append(ClueFile(path, name, read_clues(path)))
+        files.append(ClueFile(path, name, load_clues(path)))
     return files
 
 def lookup_clues(files, word):
     l_word = word.lower()
     clues = []
     for c in files:
-        if l_word in c.data:
-            clues.extend(c.data[l_word])
+        clues.extend(c.data.get(l_word, []))
     return clues
 
+def search_clues(files, query="", pattern=None, limit=constants.MAX_CLUE_RESULTS):
+    """
+    Return up to limit (word, clue) pairs of the clue files of which the
+    clue contains all words of the query and the word matches the
+    pattern (e.g., r*r), shortest clues first.
+    """
+    tokens = list(tokenize_clue(query))
+    if pattern is not None:
+        pattern = WordPattern(pattern)
+    if not tokens and pattern is None:
+        return []
+    result = []
+    for c in files:
+        if isinstance(c.data, ClueStore):
+            result.extend(c.data.search(tokens, pattern, limit))
+            continue
+        for word, clues in c.data.items():
+            if pattern is None or pattern.match(word):
+                result.extend([(word, clue) for clue in clues
+                    if tokenize_clue(clue).issuperset(tokens)])
+    result.sort(key=lambda item: (len(item[1]), item[0]))
+    return result[:limit]
+
 class ClueFileDialog(NameFileDialog):
     def __init__(self, parent, path, name=None):
         self.p_title = u"New clue database" if name is None else u"Rename clue database"
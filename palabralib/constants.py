@@ -55,15 +55,43 @@ FILL_NICE_FALSE = 0
 FILL_NICE_TRUE = 1
 FILL_DUPLICATE_FALSE = 0
 FILL_DUPLICATE_TRUE = 1
+FILL_ENGINE_GREEDY = 0
+FILL_ENGINE_PROPAGATE = 1
+FILL_OBJECTIVE_NONE = 0
+FILL_OBJECTIVE_TOTAL = 1
+FILL_OBJECTIVE_MINIMUM = 2
 
 # fill options, also in .c (fill function)
 FILL_OPTION_START = "start"
 FILL_OPTION_NICE = "nice"
 FILL_OPTION_DUPLICATE = "duplicate"
 FILL_NICE_COUNT = "nice_count"
+FILL_OPTION_ENGINE = "engine"
+FILL_OPTION_STATS = "stats"
+FILL_OPTION_MAX_NODES = "max_nodes"
+FILL_OPTION_TIME_LIMIT = "time_limit"
+FILL_OPTION_GENERATION = "generation"
+FILL_OPTION_PROGRESS = "progress"
+FILL_OPTION_SEED = "seed"
+FILL_OPTION_WORKERS = "workers"
+FILL_OPTION_OBJECTIVE = "objective"
+FILL_STATUS_COMPLETE = "complete"
+FILL_STATUS_EXHAUSTED = "exhausted"
+FILL_STATUS_NODES = "nodes"
+FILL_STATUS_TIME = "time"
+FILL_STATUS_CANCELLED = "cancelled"
+FILL_STATUS_CHANGED = "changed"
+FILL_STATUS_ERROR = "error"
 
 # search options, also in .c (search function)
 SEARCH_OPTION_MIN_SCORE = "min_score"
+SEARCH_OPTION_ENGINE = "engine"
+SEARCH_OPTION_LIMIT = "limit"
+SEARCH_OPTION_ORDER_BY_SCORE = "order_by_score"
+SEARCH_OPTION_CURSOR = "cursor"
+SEARCH_OPTION_GENERATION = "generation"
+SEARCH_ENGINE_TREE = 0
+SEARCH_ENGINE_BITSET = 1
 
 # puzzle types
 PUZZLE_PALABRA = 'palabra'
@@ -186,6 +214,11 @@ INPUT_DELAY = 350
 INPUT_DELAY_SHORT = 250
 INPUT_DELAY_VERY_SHORT = 50
 
+# maximum number of words that are shown when finding contained words
+MAX_CONTAINED_WORDS = 1000
+# maximum number of clues that are returned when searching clue databases
+MAX_CLUE_RESULTS = 1000
+
 PREF_COPY_BEFORE_SAVE = "backup_copy_before_save"
 PREF_INITIAL_HEIGHT = "new_initial_height"
 PREF_INITIAL_WIDTH = "new_initial_width"
@@ -6,6 +6,33 @@
 // initialized in cPalabra_preprocess_all
 Tptr trees[MAX_WORD_LISTS + 1][MAX_WORD_LENGTH];
 
+// the memory of each tree
+ABptr arenas[MAX_WORD_LISTS + 1][MAX_WORD_LENGTH];
+
+// words of word lists that were loaded from a compiled index, these are
+// used instead of the trees until a word of that length is inserted
+WTptr tables[MAX_WORD_LISTS + 1][MAX_WORD_LENGTH];
+
+// positional bitsets of the words in the trees or tables, these are
+// built when first needed and cleared when the words change
+BIptr bitsets[MAX_WORD_LISTS + 1][MAX_WORD_LENGTH];
+
+// the words of all merged word lists, per word length, so that a search in
+// several lists needs a single traversal, lists that have changed since the
+// merged index was built are marked as stale and merged again when needed
+MIptr merged[MAX_WORD_LENGTH];
+ListMask merged_lists = 0;
+ListMask merged_stale[MAX_WORD_LENGTH];
+
+// automata of the words of each word list, built when first needed
+// and cleared when the words change
+WAptr automata[MAX_WORD_LISTS + 1];
+
+// analyses of intersecting slots per word list, the last cache is for
+// analyses of merged word lists
+AnalysisCache analysis_caches[MAX_WORD_LISTS + 2];
+#define MERGED_CACHE MAX_WORD_LISTS + 1
+
 // TODO return C object
 PyObject* find_matches(PyObject *list, Tptr p, char *s)
 {
@@ -29,80 +56,81 @@ PyObject* find_matches(PyObject *list, Tptr p, char *s)
     return list;
 }
 
-void update_score(Tptr p, char *s, int score)
+// change the score of the first occurrence of the word with the old score,
+// as remove_word the occurrence is chosen by its score and not its position
+void update_score(Tptr p, char *s, int old_score, int score)
+{
+    while (p && *s) {
+        if (*s < p->splitchar)
+            p = p->lokid;
+        else if (*s > p->splitchar)
+            p = p->hikid;
+        else {
+            p = p->eqkid;
+            s++;
+        }
+    }
+    // the occurrences of a word are chained by their eqkid
+    for (; p; p = p->eqkid) {
+        if (p->splitchar == 0 && p->score == old_score) {
+            p->score = score;
+            return;
+        }
+    }
+}
+
+// change the score of each word in the tree to value, or by value if by is set
+void change_scores(Tptr p, int by, int value)
 {
     if (!p) return;
-    if (*s < p->splitchar)
-        update_score(p->lokid, s, score);
-    if (*s == p->splitchar)
-        if (p->splitchar && *s)
-            update_score(p->eqkid, s + 1, score);
-    if (*s == 0 && p->splitchar == 0) {
-        p->score = score;
+    if (p->splitchar == 0) {
+        p->score = by ? p->score + value : value;
     }
-    if (*s > p->splitchar)
-        update_score(p->hikid, s, score);
+    change_scores(p->lokid, by, value);
+    change_scores(p->eqkid, by, value);
+    change_scores(p->hikid, by, value);
 }
 
-void read_counts_str(char *counts_c, int *counts_i, char *s) {
-    const int length = strlen(s);
-    int i;
-    for (i = 0; i < length; i++) {
-        char c = *(s + i);
-        int j = 0;
-        for (j = 0; j < length; j++) {
-            if (counts_c[j] == ' ') {
-                counts_c[j] = c;
-                counts_i[j] = 1;
-                break;
-            } else if (counts_c[j] == c) {
-                counts_i[j]++;
-                break;
-            }
+// set the score of each occurrence of the word in the tree
+void set_scores(Tptr p, char *s, int score)
+{
+    while (p && *s) {
+        if (*s < p->splitchar)
+            p = p->lokid;
+        else if (*s > p->splitchar)
+            p = p->hikid;
+        else {
+            p = p->eqkid;
+            s++;
         }
     }
+    for (; p; p = p->eqkid) {
+        p->score = score;
+    }
 }
 
-PyObject *find_matches_i(int index, char *s) {
-    const int length = strlen(s);
-    char counts_c[length];
-    int counts_i[length];
-    int k;
-    for (k = 0; k < length; k++) {
-        counts_c[k] = ' ';
-        counts_i[k] = 0;
-    }
-    read_counts_str(counts_c, counts_i, s);
-    char cons_str[length + 1];
-    int i;
-    for (i = 0; i < length; i++) {
-        cons_str[i] = '.';
-    }
-    cons_str[length] = '\0';
-    PyObject *result = PyList_New(0);
-    PyObject *mwords = PyList_New(0);
-    mwords = find_matches(mwords, trees[index][length], cons_str);
-    Py_ssize_t m;
-    for (m = 0; m < PyList_Size(mwords); m++) {
-        char *word = PyString_AS_STRING(PyList_GET_ITEM(mwords, m));
-        int ok = 0;
-        for (i = 0; i < length; i++) {
-            int count = 0;
-            int j;
-            for (j = 0; j < length; j++) {
-                if (word[j] == counts_c[i]) count++;
-            }
-            if (count == counts_i[i]) {
-                ok++;
-            }
+// unlink the first occurrence of the word with the given score from the tree,
+// the nodes remain in the arena of the tree, return 1 if it was removed
+int remove_word(Tptr *p, char *s, int score)
+{
+    while (*p && *s) {
+        if (*s < (*p)->splitchar)
+            p = &(*p)->lokid;
+        else if (*s > (*p)->splitchar)
+            p = &(*p)->hikid;
+        else {
+            p = &(*p)->eqkid;
+            s++;
         }
-        if (ok == length) {
-            PyObject *py_word = PyString_FromString(word);
-            PyList_Append(result, py_word);
-            Py_DECREF(py_word);
+    }
+    // the occurrences of a word are chained by their eqkid
+    for (; *p; p = &(*p)->eqkid) {
+        if ((*p)->splitchar == 0 && (*p)->score == score) {
+            *p = (*p)->eqkid;
+            return 1;
         }
     }
-    return result;
+    return 0;
 }
 
 // fills in is_char_ok with 1 = ok, 0 = not ok
@@ -129,11 +157,10 @@ void check_intersect(char *word, char **cs, int length, Sptr *results, int is_ch
 
 char* find_candidate(char **cs_i, Sptr *results, Slot *slot, char *cs, int option_nice, int offset) {
     //printf("Finding for %i %i %i from %i with %s\n", slot->x, slot->y, slot->dir, slot->offset, cs);
-    Py_ssize_t count = PyList_Size(slot->words);
     Py_ssize_t w;
     Py_ssize_t m_count = 0;
-    for (w = 0; w < count; w++) {
-        char *word = PyString_AsString(PyList_GetItem(slot->words, w));
+    for (w = 0; w < slot->n_candidates; w++) {
+        char *word = slot->candidates[w];
         if (check_constraints(word, cs)) {
             //printf("Considering %i %s %s\n", option_nice, word, cs);
             if (!option_nice) {
@@ -242,10 +269,33 @@ void print(Tptr p, int indent)
     if (p->hikid != NULL) print(p->hikid, indent + 2);
 }
 
-Tptr insert1(Tptr p, char *s, char *word, int score)
+#define ARENA_BLOCK_SIZE 65536
+#define ARENA_MAX_BLOCK_SIZE (1 << 24)
+
+void* arena_alloc(ABptr *arena, size_t n, size_t align)
+{
+    ABptr b = *arena;
+    size_t used = b ? (b->used + align - 1) / align * align : 0;
+    if (!b || used + n > b->size) {
+        size_t size = b ? b->size * 2 : ARENA_BLOCK_SIZE;
+        if (size > ARENA_MAX_BLOCK_SIZE) size = ARENA_MAX_BLOCK_SIZE;
+        if (size < n) size = n;
+        ABptr block = (ABptr) PyMem_Malloc(sizeof(ArenaBlock) + size);
+        if (!block) return NULL;
+        block->next = b;
+        block->size = size;
+        *arena = b = block;
+        used = 0;
+    }
+    b->used = used + n;
+    return (char *) (b + 1) + used;
+}
+
+Tptr insert1(ABptr *arena, Tptr p, char *s, char *word, int score)
 {
     if (p == NULL) {
-        p = (Tptr) PyMem_Malloc(sizeof(Tnode));
+        p = (Tptr) arena_alloc(arena, sizeof(Tnode), sizeof(void *));
+        if (!p) return NULL;
         p->splitchar = *s;
         p->word = word;
         p->score = score;
@@ -254,18 +304,85 @@ Tptr insert1(Tptr p, char *s, char *word, int score)
         p->hikid = NULL;
     } else if (*s == 0 && p != NULL) {
         // if we are inserting the same word more than once, continue recursion
-        p->eqkid = insert1(p->eqkid, s, word, score);
+        p->eqkid = insert1(arena, p->eqkid, s, word, score);
     }
     if (*s < p->splitchar)
-        p->lokid = insert1(p->lokid, s, word, score);
+        p->lokid = insert1(arena, p->lokid, s, word, score);
     else if (*s == p->splitchar) {
         if (*s != 0)
-            p->eqkid = insert1(p->eqkid, ++s, word, score);
+            p->eqkid = insert1(arena, p->eqkid, ++s, word, score);
     } else
-        p->hikid = insert1(p->hikid, s, word, score);
+        p->hikid = insert1(arena, p->hikid, s, word, score);
     return p;
 }
 
+static int compare_word_entries(const void *a, const void *b) {
+    const WordEntry *e1 = (const WordEntry *) a;
+    const WordEntry *e2 = (const WordEntry *) b;
+    int cmp = strcmp(e1->word, e2->word);
+    if (cmp != 0) return cmp;
+    return e1->seq - e2->seq;
+}
+
+// insert a copy of the word into the tree of the arena, 0 if there is no memory
+int insert_tree_word(ABptr *arena, Tptr *root, int length, char *word, int score)
+{
+    // we need to make a copy to prevent errors when we modify the
+    // list later on (see CWordList.update_score)
+    char *c_use_word = arena_alloc(arena, length + 1, 1);
+    if (!c_use_word) return 0;
+    memcpy(c_use_word, word, length);
+    c_use_word[length] = '\0';
+    Tptr p = insert1(arena, *root, c_use_word, c_use_word, score);
+    if (!p) return 0;
+    *root = p;
+    return 1;
+}
+
+// insert the words of groups lo up to hi, the median group first,
+// 0 if there is no memory for a word
+static int insert_groups(ABptr *arena, Tptr *root, int length, WordEntry *entries, int *groups, int lo, int hi) {
+    if (lo >= hi) return 1;
+    const int mid = lo + (hi - lo) / 2;
+    int e;
+    for (e = groups[mid]; e < groups[mid + 1]; e++) {
+        if (!insert_tree_word(arena, root, length, entries[e].word, entries[e].score))
+            return 0;
+    }
+    return insert_groups(arena, root, length, entries, groups, lo, mid)
+        && insert_groups(arena, root, length, entries, groups, mid + 1, hi);
+}
+
+// insert the words into the tree of the arena in an order that keeps the
+// tree balanced, the entries are sorted by word and input position unless
+// sorted is set, 0 if there is no memory to insert all words
+int insert_tree_words(ABptr *arena, Tptr *root, int length, WordEntry *entries, int n_entries, int sorted)
+{
+    if (n_entries <= 0) return 1;
+    if (!sorted) {
+        qsort(entries, n_entries, sizeof(WordEntry), compare_word_entries);
+    }
+    // the occurrences of a word form a group that is inserted in order
+    int *groups = PyMem_Malloc((n_entries + 1) * sizeof(int));
+    if (!groups) return 0;
+    int n_groups = 0;
+    int e;
+    for (e = 0; e < n_entries; e++) {
+        if (e == 0 || strcmp(entries[e - 1].word, entries[e].word) != 0)
+            groups[n_groups++] = e;
+    }
+    groups[n_groups] = n_entries;
+    const int inserted = insert_groups(arena, root, length, entries, groups, 0, n_groups);
+    PyMem_Free(groups);
+    return inserted;
+}
+
+// insert the words into the tree of the given index and length
+int insert_words(int index, int length, WordEntry *entries, int n_entries, int sorted)
+{
+    return insert_tree_words(&arenas[index][length], &trees[index][length], length, entries, n_entries, sorted);
+}
+
 int analyze(int offset, Sptr result, Tptr p, char *s, char *cs, int min_score)
 {
     if (!p) return 0;
@@ -299,29 +416,157 @@ int analyze(int offset, Sptr result, Tptr p, char *s, char *cs, int min_score)
     return n;
 }
 
-Sptr analyze_intersect_slot(int offset, char *cs, int index, int min_score) {
-    if (!trees[index][strlen(cs)]) {
-        return NULL;
-    }
+static Sptr new_search_result(void) {
     Sptr result;
     result = (Sptr) PyMem_Malloc(sizeof(SearchResult));
     if (!result) {
-        return NULL; //PyErr_NoMemory(); TODO fix
+        return NULL;
     }
     result->chars = PyMem_Malloc(MAX_ALPHABET_SIZE * sizeof(char));
     if (!result->chars) {
         PyMem_Free(result);
-        return NULL; //PyErr_NoMemory(); TODO fix
+        return NULL;
     }
     int c;
     for (c = 0; c < MAX_ALPHABET_SIZE; c++) {
         result->chars[c] = ' ';
     }
-    analyze(offset, result, trees[index][strlen(cs)], cs, cs, min_score);
+    result->n_matches = 0;
+    result->refs = 1;
+    return result;
+}
+
+void free_search_result(Sptr result) {
+    if (!result) return;
+    if (--result->refs > 0) return;
+    PyMem_Free(result->chars);
+    PyMem_Free(result);
+}
+
+static unsigned long analysis_hash(ListMask lists, int offset, char *cs, int min_score) {
+    unsigned long h = 2166136261UL;
+    for (; *cs; cs++) {
+        h = (h ^ (unsigned char) *cs) * 16777619UL;
+    }
+    h = (h ^ (unsigned long) offset) * 16777619UL;
+    h = (h ^ (unsigned long) min_score) * 16777619UL;
+    h = (h ^ (unsigned long) lists) * 16777619UL;
+    h = (h ^ (unsigned long) (lists >> 32)) * 16777619UL;
+    return h;
+}
+
+static void unlink_analysis(AnalysisCache *c, AEptr e) {
+    if (e->newer) e->newer->older = e->older; else c->newest = e->older;
+    if (e->older) e->older->newer = e->newer; else c->oldest = e->newer;
+    e->newer = NULL;
+    e->older = NULL;
+}
+
+static void push_analysis(AnalysisCache *c, AEptr e) {
+    e->newer = NULL;
+    e->older = c->newest;
+    if (c->newest) c->newest->newer = e;
+    c->newest = e;
+    if (!c->oldest) c->oldest = e;
+}
+
+static void drop_analysis(AnalysisCache *c, AEptr e) {
+    AEptr *p = &c->buckets[e->hash % ANALYSIS_CACHE_BUCKETS];
+    while (*p != e) p = &(*p)->next;
+    *p = e->next;
+    unlink_analysis(c, e);
+    free_search_result(e->result);
+    PyMem_Free(e->cs);
+    PyMem_Free(e);
+    c->n_entries--;
+}
+
+// a new reference to the cached analysis, NULL if it is not in the cache
+static Sptr find_analysis(AnalysisCache *c, ListMask lists, int offset, char *cs, int min_score) {
+    const unsigned long h = analysis_hash(lists, offset, cs, min_score);
+    AEptr e;
+    for (e = c->buckets[h % ANALYSIS_CACHE_BUCKETS]; e; e = e->next) {
+        if (e->hash == h && e->lists == lists && e->offset == offset
+            && e->min_score == min_score && strcmp(e->cs, cs) == 0) {
+            unlink_analysis(c, e);
+            push_analysis(c, e);
+            e->result->refs++;
+            return e->result;
+        }
+    }
+    return NULL;
+}
+
+static void store_analysis(AnalysisCache *c, ListMask lists, int offset, char *cs, int min_score, Sptr result) {
+    AEptr e = PyMem_Malloc(sizeof(AnalysisEntry));
+    char *e_cs = PyMem_Malloc(strlen(cs) + 1);
+    if (!e || !e_cs) {
+        PyMem_Free(e);
+        PyMem_Free(e_cs);
+        return;
+    }
+    strcpy(e_cs, cs);
+    e->hash = analysis_hash(lists, offset, cs, min_score);
+    e->lists = lists;
+    e->offset = offset;
+    e->min_score = min_score;
+    e->cs = e_cs;
+    e->result = result;
+    result->refs++;
+    AEptr *bucket = &c->buckets[e->hash % ANALYSIS_CACHE_BUCKETS];
+    e->next = *bucket;
+    *bucket = e;
+    push_analysis(c, e);
+    c->n_entries++;
+    if (c->n_entries > ANALYSIS_CACHE_SIZE) {
+        drop_analysis(c, c->oldest);
+    }
+}
+
+static void clear_cache(AnalysisCache *c) {
+    while (c->oldest) {
+        drop_analysis(c, c->oldest);
+    }
+}
+
+// drop the analyses of the word list, and those of merged lists
+void clear_analysis_cache(int index) {
+    if (index >= 0 && index <= MAX_WORD_LISTS) {
+        clear_cache(&analysis_caches[index]);
+    }
+    clear_cache(&analysis_caches[MERGED_CACHE]);
+}
+
+Sptr analyze_intersect_slot(int offset, char *cs, int index, int min_score, int engine) {
+    const int length = strlen(cs);
+    if (!trees[index][length] && !tables[index][length]) {
+        return NULL;
+    }
+    Sptr cached = find_analysis(&analysis_caches[index], 0, offset, cs, min_score);
+    if (cached) {
+        return cached;
+    }
+    BIptr b = NULL;
+    if (engine == SEARCH_ENGINE_BITSET) {
+        b = get_bitset_index(index, length);
+        if (!b) return NULL;
+    }
+    Sptr result = new_search_result();
+    if (!result) {
+        return NULL; //PyErr_NoMemory(); TODO fix
+    }
+    if (b) {
+        analyze_bitset(offset, result, b, cs, min_score);
+    } else if (tables[index][length]) {
+        analyze_table(offset, result, tables[index][length], cs, min_score);
+    } else {
+        analyze(offset, result, trees[index][length], cs, cs, min_score);
+    }
+    store_analysis(&analysis_caches[index], 0, offset, cs, min_score, result);
     return result;
 }
 
-void analyze_intersect_slot2(Sptr *results, int *skipped, int *offsets, char **cs, int length, int index, int min_score) {
+void analyze_intersect_slot2(Sptr *results, int *skipped, int *offsets, char **cs, int length, int index, int min_score, int engine) {
     int t;
     for (t = 0; t < length; t++) {
         int skip = -1;
@@ -335,7 +580,7 @@ void analyze_intersect_slot2(Sptr *results, int *skipped, int *offsets, char **c
             }
         }
         if (skip < 0) {
-            results[t] = analyze_intersect_slot(offsets[t], cs[t], index, min_score);
+            results[t] = analyze_intersect_slot(offsets[t], cs[t], index, min_score, engine);
         } else {
             skipped[t] = 1;
             results[t] = results[skip];
@@ -343,406 +588,2378 @@ void analyze_intersect_slot2(Sptr *results, int *skipped, int *offsets, char **c
     }
 }
 
-void free_tree(Tptr p) {
-    if (!p) return;
-    if (p->lokid != NULL) {
-        free_tree(p->lokid);
-        PyMem_Free(p->lokid);
-        p->lokid = NULL;
+void free_arena(ABptr b) {
+    while (b) {
+        ABptr next = b->next;
+        PyMem_Free(b);
+        b = next;
     }
-    if (p->eqkid != NULL) {
-        free_tree(p->eqkid);
-        PyMem_Free(p->eqkid);
-        p->eqkid = NULL;
+}
+
+void free_tree(int index, int length) {
+    free_arena(arenas[index][length]);
+    arenas[index][length] = NULL;
+    trees[index][length] = NULL;
+}
+
+// compute the range [start, end) of words in the table that start with
+// the fixed characters of s, return the number of fixed characters
+int table_range(WTptr t, char *s, int *start, int *end) {
+    int n_prefix = 0;
+    while (n_prefix < t->length && s[n_prefix] != CONSTRAINT_EMPTY) n_prefix++;
+    int lo = 0;
+    int hi = t->n_words;
+    while (lo < hi) {
+        int mid = lo + (hi - lo) / 2;
+        if (memcmp(t->words + mid * t->length, s, n_prefix) < 0)
+            lo = mid + 1;
+        else
+            hi = mid;
     }
-    if (p->hikid != NULL) {
-        free_tree(p->hikid);
-        PyMem_Free(p->hikid);
-        p->hikid = NULL;
+    *start = lo;
+    hi = t->n_words;
+    while (lo < hi) {
+        int mid = lo + (hi - lo) / 2;
+        if (memcmp(t->words + mid * t->length, s, n_prefix) <= 0)
+            lo = mid + 1;
+        else
+            hi = mid;
     }
+    *end = lo;
+    return n_prefix;
 }
 
-// 0 = false, 1 = true
-int calc_is_available(PyObject *grid, int x, int y) {
-    int width = (int) PyInt_AsLong(PyObject_GetAttrString(grid, "width"));
-    int height = (int) PyInt_AsLong(PyObject_GetAttrString(grid, "height"));
+PyObject* find_matches_table(PyObject *list, WTptr t, char *s)
+{
+    if (!t || strlen(s) != t->length) return list;
+    int start;
+    int end;
+    const int n_prefix = table_range(t, s, &start, &end);
+    int w;
+    for (w = start; w < end; w++) {
+        char *word = t->words + w * t->length;
+        int i;
+        for (i = n_prefix; i < t->length; i++) {
+            if (s[i] != CONSTRAINT_EMPTY && s[i] != word[i]) break;
+        }
+        if (i < t->length) continue;
+        PyObject *item = Py_BuildValue("(s#i)", word, t->length, t->scores[w]);
+        PyList_Append(list, item);
+        Py_DECREF(item);
+    }
+    return list;
+}
 
-    if (!(0 <= x && x < width && 0 <= y && y < height))
-        return 0;
+PyObject* find_matches_index(PyObject *list, int index, int length, char *s)
+{
+    if (tables[index][length])
+        return find_matches_table(list, tables[index][length], s);
+    return find_matches(list, trees[index][length], s);
+}
 
-    PyObject* data = PyObject_GetAttrString(grid, "data");
-    PyObject* col = PyObject_GetItem(data, PyInt_FromLong(y));
-    PyObject* cell = PyObject_GetItem(col, PyInt_FromLong(x));
+int analyze_table(int offset, Sptr result, WTptr t, char *cs, int min_score)
+{
+    int start;
+    int end;
+    const int n_prefix = table_range(t, cs, &start, &end);
+    const char intersect_char = *(cs + offset);
+    int n = 0;
+    int w;
+    for (w = start; w < end; w++) {
+        if (t->scores[w] < min_score) continue;
+        char *word = t->words + w * t->length;
+        int i;
+        for (i = n_prefix; i < t->length; i++) {
+            if (cs[i] != CONSTRAINT_EMPTY && cs[i] != word[i]) break;
+        }
+        if (i < t->length) continue;
+        n++;
+        if (intersect_char == CONSTRAINT_EMPTY) {
+            char c = word[offset];
+            int m;
+            for (m = 0; m < MAX_ALPHABET_SIZE; m++) {
+                if (result->chars[m] == c)
+                    break;
+                if (result->chars[m] == ' ') {
+                    result->chars[m] = c;
+                    break;
+                }
+            }
+        } else {
+            result->chars[0] = intersect_char;
+        }
+    }
+    result->n_matches = n;
+    return n;
+}
 
-    int is_block = PyObject_IsTrue(PyObject_GetItem(cell, PyString_FromString("block")));
-    if (is_block != 0)
+void update_score_table(WTptr t, char *s, int old_score, int score)
+{
+    if (!t || strlen(s) != t->length) return;
+    int start;
+    int end;
+    table_range(t, s, &start, &end);
+    int w;
+    for (w = start; w < end; w++) {
+        if (t->scores[w] == old_score) {
+            t->scores[w] = score;
+            return;
+        }
+    }
+}
+
+void change_scores_table(WTptr t, int by, int value)
+{
+    if (!t) return;
+    int w;
+    for (w = 0; w < t->n_words; w++) {
+        t->scores[w] = by ? t->scores[w] + value : value;
+    }
+}
+
+void set_scores_table(WTptr t, char *s, int score)
+{
+    if (!t || strlen(s) != t->length) return;
+    int start;
+    int end;
+    table_range(t, s, &start, &end);
+    for (; start < end; start++) {
+        t->scores[start] = score;
+    }
+}
+
+// move the words of the table into the tree so that it can be modified,
+// 0 if there is no memory, the table is then kept
+int thaw_table(int index, int length)
+{
+    WTptr t = tables[index][length];
+    if (!t) return 1;
+    char *words = PyMem_Malloc(t->n_words * (length + 1) + 1);
+    WordEntry *entries = PyMem_Malloc(t->n_words * sizeof(WordEntry) + 1);
+    if (!words || !entries) {
+        PyMem_Free(words);
+        PyMem_Free(entries);
         return 0;
-    int is_void = PyObject_IsTrue(PyObject_GetItem(cell, PyString_FromString("void")));
-    if (is_void != 0)
+    }
+    int w;
+    for (w = 0; w < t->n_words; w++) {
+        char *word = words + w * (length + 1);
+        memcpy(word, t->words + w * length, length);
+        word[length] = '\0';
+        entries[w].word = word;
+        entries[w].score = t->scores[w];
+        entries[w].seq = w;
+    }
+    const int inserted = insert_words(index, length, entries, t->n_words, 1);
+    PyMem_Free(words);
+    PyMem_Free(entries);
+    if (!inserted) {
+        free_tree(index, length);
         return 0;
+    }
+    tables[index][length] = NULL;
+    free_table(t);
     return 1;
 }
 
-// 0 = false, 1 = true
-int calc_is_start_word(PyObject *grid, int x, int y) {
-    int available = calc_is_available(grid, x, y);
-    if (available == 0)
-        return 0;
-
-    PyObject *bar_str = PyString_FromString("bar");
-    PyObject *side_left = PyString_FromString("left");
-    PyObject *side_top = PyString_FromString("top");
+void free_table(WTptr t) {
+    if (!t) return;
+    Py_XDECREF(t->owner);
+    PyMem_Free(t);
+}
 
-    // 0 = across, 1 = down
-    int e;
-    for (e = 0; e < 2; e++) {
-        int bdx = e == 0 ? -1 : 0;
-        int bdy = e == 0 ? 0 : -1;
-        int adx = e == 0 ? 1 : 0;
-        int ady = e == 0 ? 0 : 1;
-        PyObject *side = e == 0 ? side_left : side_top;
+// store the words of the tree in the order in which find_matches visits them,
+// words and scores may be NULL to only count the words
+static void collect_words(Tptr p, int length, char *words, int *scores, int *n) {
+    if (!p) return;
+    collect_words(p->lokid, length, words, scores, n);
+    if (p->splitchar) {
+        collect_words(p->eqkid, length, words, scores, n);
+    } else {
+        if (words) {
+            memcpy(words + *n * length, p->word, length);
+            scores[*n] = p->score;
+        }
+        (*n)++;
+        // the same word may have been inserted more than once
+        collect_words(p->eqkid, length, words, scores, n);
+    }
+    collect_words(p->hikid, length, words, scores, n);
+}
 
-        // both conditions of after
-        if (calc_is_available(grid, x + adx, y + ady) == 0)
-            continue;
-        PyObject* data = PyObject_GetAttrString(grid, "data");
-        PyObject* col = PyObject_GetItem(data, PyInt_FromLong(y + ady));
-        PyObject* cell = PyObject_GetItem(col, PyInt_FromLong(x + adx));
-        PyObject* bars = PyObject_GetItem(cell, bar_str);
-        if (PyObject_IsTrue(PyObject_GetItem(bars, side)) == 1)
-            continue;
+// return the number of words of the given length of a word list
+int count_list_words(int index, int length) {
+    WTptr t = tables[index][length];
+    if (t) return t->n_words;
+    int n_words = 0;
+    collect_words(trees[index][length], length, NULL, NULL, &n_words);
+    return n_words;
+}
 
-        // both conditions of before
-        if (calc_is_available(grid, x + bdx, y + bdy) == 0)
-            return 1;
-        col = PyObject_GetItem(data, PyInt_FromLong(y));
-        cell = PyObject_GetItem(col, PyInt_FromLong(x));
-        bars = PyObject_GetItem(cell, bar_str);
-        if (PyObject_IsTrue(PyObject_GetItem(bars, side)) == 1)
-            return 1;
+// copy the words of the given length of a word list into new arrays,
+// return the number of words or -1 in case of error
+static int copy_words(int index, int length, char **words, int **scores) {
+    WTptr t = tables[index][length];
+    const int n_words = count_list_words(index, length);
+    *words = PyMem_Malloc(n_words * length + 1);
+    *scores = PyMem_Malloc(n_words * sizeof(int) + 1);
+    if (!*words || !*scores) {
+        PyMem_Free(*words);
+        PyMem_Free(*scores);
+        return -1;
     }
-    return 0;
+    if (t) {
+        memcpy(*words, t->words, n_words * length);
+        memcpy(*scores, t->scores, n_words * sizeof(int));
+    } else {
+        int n = 0;
+        collect_words(trees[index][length], length, *words, *scores, &n);
+    }
+    return n_words;
 }
 
-int count_words(PyObject *words, int length, char *cs) {
-    int count = 0;
-    Py_ssize_t w;
-    PyObject* key = Py_BuildValue("i", length);
-    PyObject* words_m = PyDict_GetItem(words, key);
-    for (w = 0; w < PyList_Size(words_m); w++) {
-        PyObject* word_obj = PyList_GET_ITEM(words_m, w);
-        PyObject* word_str;
-        const int word_score;
-        if (!PyArg_ParseTuple(word_obj, "Oi", &word_str, &word_score))
-            return -1;
-        char *word = PyString_AsString(word_str);
-        if (!check_constraints(word, cs)) {
-            continue;
-        }
-        count++;
-    }
-    return count;
+static int compare_scores(const void *a, const void *b) {
+    const int s1 = *((const int *) a);
+    const int s2 = *((const int *) b);
+    return (s1 > s2) - (s1 < s2);
 }
 
-int get_slot_index(Slot *slots, int n_slots, int x, int y, int dir) {
-    int s;
-    for (s = 0; s < n_slots; s++) {
-        Slot slot = slots[s];
-        if (dir == slot.dir) {
-            int match_across = (dir == DIR_ACROSS && x>= slot.x
-                && x < slot.x + slot.length && slot.y == y);
-            int match_down = (dir == DIR_DOWN && y >= slot.y
-                && y < slot.y + slot.length && slot.x == x);
-            if (match_across || match_down) {
-                return s;
+// store the scores of the words of the given length of a word list in a new
+// array in increasing order, return the number of words or -1 in case of error
+int sorted_scores(int index, int length, int **scores) {
+    char *words;
+    const int n_words = copy_words(index, length, &words, scores);
+    if (n_words < 0) return -1;
+    PyMem_Free(words);
+    qsort(*scores, n_words, sizeof(int), compare_scores);
+    return n_words;
+}
+
+// create a bitset index that takes ownership of the words and scores
+static BIptr build_bitset_index(char *words, int *scores, int n_words, int length) {
+    BIptr b = (BIptr) PyMem_Malloc(sizeof(BitsetIndex));
+    Block **bits = PyMem_Malloc(length * 256 * sizeof(Block *));
+    if (!b || !bits) {
+        PyMem_Free(b);
+        PyMem_Free(bits);
+        PyMem_Free(words);
+        PyMem_Free(scores);
+        return NULL;
+    }
+    b->length = length;
+    b->n_words = n_words;
+    b->n_blocks = (n_words + BLOCK_BITS - 1) / BLOCK_BITS;
+    b->words = words;
+    b->scores = scores;
+    b->bits = bits;
+    b->mask = NULL;
+    b->mask_score = 0;
+    b->by_score = NULL;
+    b->letters = NULL;
+    b->n_buckets = 0;
+    b->anagrams = NULL;
+    b->next_anagram = NULL;
+    int i;
+    for (i = 0; i < length * 256; i++) {
+        b->bits[i] = NULL;
+    }
+    int w;
+    for (w = 0; w < n_words; w++) {
+        for (i = 0; i < length; i++) {
+            unsigned char c = words[w * length + i];
+            Block **bits = &b->bits[i * 256 + c];
+            if (*bits == NULL) {
+                *bits = PyMem_Malloc(b->n_blocks * sizeof(Block));
+                if (!*bits) {
+                    free_bitset_index(b);
+                    return NULL;
+                }
+                memset(*bits, 0, b->n_blocks * sizeof(Block));
             }
+            (*bits)[w / BLOCK_BITS] |= ((Block) 1) << (w % BLOCK_BITS);
         }
     }
-    return -1;
+    return b;
 }
 
-// 1 = yes, 0 = no
-int can_clear_char(Cell *cgrid, int width, int height, Slot slot) {
-    int j;
-    for (j = 0; j < slot.length; j++) {
-        int cx = slot.x + (slot.dir == DIR_ACROSS ? j : 0);
-        int cy = slot.y + (slot.dir == DIR_DOWN ? j : 0);
-        if (cgrid[cx + cy * width].c == CONSTRAINT_EMPTY)
-            return 1;
+static BIptr create_bitset_index(int index, int length) {
+    char *words;
+    int *scores;
+    const int n_words = copy_words(index, length, &words, &scores);
+    if (n_words < 0) return NULL;
+    return build_bitset_index(words, scores, n_words, length);
+}
+
+BIptr get_bitset_index(int index, int length) {
+    if (!bitsets[index][length]) {
+        bitsets[index][length] = create_bitset_index(index, length);
+    }
+    return bitsets[index][length];
+}
+
+void free_bitset_index(BIptr b) {
+    if (!b) return;
+    int i;
+    for (i = 0; i < b->length * 256; i++) {
+        PyMem_Free(b->bits[i]);
+    }
+    PyMem_Free(b->bits);
+    PyMem_Free(b->words);
+    PyMem_Free(b->scores);
+    PyMem_Free(b->mask);
+    PyMem_Free(b->by_score);
+    PyMem_Free(b->letters);
+    PyMem_Free(b->anagrams);
+    PyMem_Free(b->next_anagram);
+    PyMem_Free(b);
+}
+
+void clear_bitset_index(int index, int length) {
+    free_bitset_index(bitsets[index][length]);
+    bitsets[index][length] = NULL;
+}
+
+// compute the words that match the constraints and have score >= min_score,
+// return the number of these words or -1 in case of error
+int bitset_query(BIptr b, char *s, int min_score, Block *result) {
+    const int n_blocks = b->n_blocks;
+    int k;
+    for (k = 0; k < n_blocks; k++) {
+        result[k] = ~((Block) 0);
+    }
+    if (b->n_words % BLOCK_BITS != 0) {
+        result[n_blocks - 1] = (((Block) 1) << (b->n_words % BLOCK_BITS)) - 1;
+    }
+    int i;
+    for (i = 0; i < b->length; i++) {
+        if (s[i] == CONSTRAINT_EMPTY) continue;
+        Block *bits = b->bits[i * 256 + (unsigned char) s[i]];
+        if (!bits) return 0;
+        for (k = 0; k < n_blocks; k++) {
+            result[k] &= bits[k];
+        }
+    }
+    if (min_score > -9999) {
+        if (!b->mask || b->mask_score != min_score) {
+            if (!b->mask) {
+                b->mask = PyMem_Malloc(n_blocks * sizeof(Block) + 1);
+                if (!b->mask) return -1;
+            }
+            memset(b->mask, 0, n_blocks * sizeof(Block));
+            int w;
+            for (w = 0; w < b->n_words; w++) {
+                if (b->scores[w] >= min_score)
+                    b->mask[w / BLOCK_BITS] |= ((Block) 1) << (w % BLOCK_BITS);
+            }
+            b->mask_score = min_score;
+        }
+        for (k = 0; k < n_blocks; k++) {
+            result[k] &= b->mask[k];
+        }
+    }
+    int n = 0;
+    for (k = 0; k < n_blocks; k++) {
+        n += count_bits(result[k]);
+    }
+    return n;
+}
+
+PyObject* find_matches_bitset(PyObject *list, BIptr b, char *s)
+{
+    if (!b || b->n_words == 0 || strlen(s) != b->length) return list;
+    Block *result = PyMem_Malloc(b->n_blocks * sizeof(Block));
+    if (!result) return list;
+    if (bitset_query(b, s, -9999, result) > 0) {
+        int k;
+        for (k = 0; k < b->n_blocks; k++) {
+            Block x;
+            for (x = result[k]; x; x &= x - 1) {
+                const int w = k * BLOCK_BITS + lowest_bit(x);
+                PyObject *item = Py_BuildValue("(s#i)", b->words + w * b->length, b->length, b->scores[w]);
+                PyList_Append(list, item);
+                Py_DECREF(item);
+            }
+        }
+    }
+    PyMem_Free(result);
+    return list;
+}
+
+// scores of the words that are being sorted by compare_by_score
+static int *sort_scores;
+
+static int compare_by_score(const void *a, const void *b) {
+    const int p1 = *((const int *) a);
+    const int p2 = *((const int *) b);
+    if (sort_scores[p1] != sort_scores[p2])
+        return sort_scores[p1] > sort_scores[p2] ? -1 : 1;
+    return p1 - p2;
+}
+
+int* get_score_order(BIptr b) {
+    if (!b->by_score) {
+        b->by_score = PyMem_Malloc(b->n_words * sizeof(int) + 1);
+        if (!b->by_score) return NULL;
+        int w;
+        for (w = 0; w < b->n_words; w++) {
+            b->by_score[w] = w;
+        }
+        sort_scores = b->scores;
+        qsort(b->by_score, b->n_words, sizeof(int), compare_by_score);
+    }
+    return b->by_score;
+}
+
+// find the first limit words (all words if limit < 0) that match the
+// constraints and have score >= min_score, alphabetically or by decreasing
+// score, total is set to the number of matching words, return the number
+// of words in matches or -1 in case of error
+int find_top_matches(BIptr b, char *s, int min_score, int limit, int order_by_score, int list, Match **matches, int *total)
+{
+    *matches = NULL;
+    *total = 0;
+    if (b->n_words == 0) return 0;
+    Block *result = PyMem_Malloc(b->n_blocks * sizeof(Block));
+    if (!result) return -1;
+    const int n = bitset_query(b, s, min_score, result);
+    if (n < 0) {
+        PyMem_Free(result);
+        return -1;
+    }
+    *total = n;
+    const int n_matches = limit >= 0 && limit < n ? limit : n;
+    int *by_score = order_by_score ? get_score_order(b) : NULL;
+    *matches = PyMem_Malloc(n_matches * sizeof(Match) + 1);
+    if (!*matches || (order_by_score && !by_score)) {
+        PyMem_Free(result);
+        PyMem_Free(*matches);
+        *matches = NULL;
+        return -1;
+    }
+    int m = 0;
+    if (order_by_score) {
+        // stop at the first limit words that are in the result
+        int i;
+        for (i = 0; i < b->n_words && m < n_matches; i++) {
+            const int w = by_score[i];
+            if (!(result[w / BLOCK_BITS] & (((Block) 1) << (w % BLOCK_BITS)))) continue;
+            (*matches)[m].word = b->words + w * b->length;
+            (*matches)[m].length = b->length;
+            (*matches)[m].score = b->scores[w];
+            (*matches)[m].list = list;
+            (*matches)[m].pos = w;
+            m++;
+        }
+    } else {
+        int k;
+        for (k = 0; k < b->n_blocks && m < n_matches; k++) {
+            Block x;
+            for (x = result[k]; x && m < n_matches; x &= x - 1) {
+                const int w = k * BLOCK_BITS + lowest_bit(x);
+                (*matches)[m].word = b->words + w * b->length;
+                (*matches)[m].length = b->length;
+            (*matches)[m].length = b->length;
+                (*matches)[m].score = b->scores[w];
+                (*matches)[m].list = list;
+                (*matches)[m].pos = w;
+                m++;
+            }
+        }
+    }
+    PyMem_Free(result);
+    return m;
+}
+
+static int compare_matches(const void *a, const void *b) {
+    const Match *m1 = (const Match *) a;
+    const Match *m2 = (const Match *) b;
+    int cmp = memcmp(m1->word, m2->word, m1->length);
+    if (cmp != 0) return cmp;
+    if (m1->list != m2->list) return m1->list - m2->list;
+    return m1->pos - m2->pos;
+}
+
+static int compare_matches_by_score(const void *a, const void *b) {
+    const Match *m1 = (const Match *) a;
+    const Match *m2 = (const Match *) b;
+    if (m1->score != m2->score)
+        return m1->score > m2->score ? -1 : 1;
+    return compare_matches(a, b);
+}
+
+// sort the matches of several word lists alphabetically or by decreasing
+// score, the matches must have words of the same length
+void sort_matches(Match *matches, int n_matches, int order_by_score)
+{
+    qsort(matches, n_matches, sizeof(Match)
+        , order_by_score ? compare_matches_by_score : compare_matches);
+}
+
+int analyze_bitset(int offset, Sptr result, BIptr b, char *cs, int min_score)
+{
+    result->n_matches = 0;
+    if (b->n_words == 0) return 0;
+    Block *matches = PyMem_Malloc(b->n_blocks * sizeof(Block));
+    if (!matches) return 0;
+    const int n = bitset_query(b, cs, min_score, matches);
+    result->n_matches = n > 0 ? n : 0;
+    if (n > 0) {
+        const char intersect_char = *(cs + offset);
+        if (intersect_char != CONSTRAINT_EMPTY) {
+            result->chars[0] = intersect_char;
+        } else {
+            // a character is possible if any match has it at the offset
+            int m = 0;
+            int c;
+            for (c = 0; c < 256 && m < MAX_ALPHABET_SIZE; c++) {
+                Block *bits = b->bits[offset * 256 + c];
+                if (!bits) continue;
+                int k;
+                for (k = 0; k < b->n_blocks; k++) {
+                    if (matches[k] & bits[k]) {
+                        result->chars[m++] = (char) c;
+                        break;
+                    }
+                }
+            }
+        }
+    }
+    PyMem_Free(matches);
+    return result->n_matches;
+}
+
+// count the letters of the word, 0 if it has other characters than letters
+int count_letters(const char *word, int length, unsigned char *counts) {
+    memset(counts, 0, LETTER_SLOTS);
+    int i;
+    for (i = 0; i < length; i++) {
+        counts[letter_slot(word[i])]++;
+    }
+    return counts[0] == 0;
+}
+
+static unsigned long hash_letters(const unsigned char *counts) {
+    unsigned long h = 2166136261UL;
+    int c;
+    for (c = 0; c < LETTER_SLOTS; c++) {
+        h = (h ^ counts[c]) * 16777619UL;
+    }
+    return h;
+}
+
+// compute the letter counts of the words and a hash table of the words
+// by their letters, so that the anagrams of a word are found without
+// looking at the other words, return 0 in case of error
+int prepare_anagrams(BIptr b) {
+    if (b->letters) return 1;
+    int n_buckets = 1;
+    while (n_buckets < 2 * b->n_words) n_buckets *= 2;
+    unsigned char *letters = PyMem_Malloc(b->n_words * LETTER_SLOTS + 1);
+    int *anagrams = PyMem_Malloc(n_buckets * sizeof(int));
+    int *next = PyMem_Malloc(b->n_words * sizeof(int) + 1);
+    if (!letters || !anagrams || !next) {
+        PyMem_Free(letters);
+        PyMem_Free(anagrams);
+        PyMem_Free(next);
+        return 0;
+    }
+    int k;
+    for (k = 0; k < n_buckets; k++) {
+        anagrams[k] = -1;
+    }
+    // the words are inserted backwards so that each bucket is in word order
+    int w;
+    for (w = b->n_words - 1; w >= 0; w--) {
+        unsigned char *counts = letters + w * LETTER_SLOTS;
+        count_letters(b->words + w * b->length, b->length, counts);
+        const int bucket = hash_letters(counts) & (n_buckets - 1);
+        next[w] = anagrams[bucket];
+        anagrams[bucket] = w;
+    }
+    b->letters = letters;
+    b->n_buckets = n_buckets;
+    b->anagrams = anagrams;
+    b->next_anagram = next;
+    return 1;
+}
+
+// the position of the first word with the given letter counts, -1 if none
+int first_anagram(BIptr b, const unsigned char *counts) {
+    if (!prepare_anagrams(b)) return -1;
+    const int w = b->anagrams[hash_letters(counts) & (b->n_buckets - 1)];
+    if (w < 0 || memcmp(b->letters + w * LETTER_SLOTS, counts, LETTER_SLOTS) == 0)
+        return w;
+    return next_anagram(b, w, counts);
+}
+
+// the position of the next word after w with the given letter counts, -1 if none
+int next_anagram(BIptr b, int w, const unsigned char *counts) {
+    for (w = b->next_anagram[w]; w >= 0; w = b->next_anagram[w]) {
+        if (memcmp(b->letters + w * LETTER_SLOTS, counts, LETTER_SLOTS) == 0)
+            return w;
+    }
+    return -1;
+}
+
+// find the first limit words (all words if limit < 0) that contain
+// at least the letters of need, return the number of words or -1
+// in case of error, positions has room for the words that are found
+int find_containing_words(BIptr b, const unsigned char *need, int limit, int *positions) {
+    if (!prepare_anagrams(b)) return -1;
+    int n = 0;
+    int w;
+    for (w = 0; w < b->n_words && n != limit; w++) {
+        if (contains_letters(b->letters + w * LETTER_SLOTS, need)) {
+            positions[n++] = w;
+        }
+    }
+    return n;
+}
+
+void merge_wordlist(int index) {
+    if (index < 0 || index >= MAX_WORD_LISTS) return;
+    merged_lists |= LIST_BIT(index);
+    int m;
+    for (m = 0; m < MAX_WORD_LENGTH; m++) {
+        merged_stale[m] |= LIST_BIT(index);
+    }
+}
+
+void unmerge_wordlist(int index) {
+    if (index < 0 || index >= MAX_WORD_LISTS) return;
+    merged_lists &= ~LIST_BIT(index);
+    int m;
+    for (m = 0; m < MAX_WORD_LENGTH; m++) {
+        merged_stale[m] |= LIST_BIT(index);
+    }
+}
+
+void mark_merged_stale(int index, int length) {
+    if (index < 0 || index >= MAX_WORD_LISTS) return;
+    merged_stale[length] |= LIST_BIT(index);
+}
+
+typedef struct mentry {
+    char *word;
+    int list;
+    int seq;
+    int score;
+} MergeEntry;
+
+// length of the words that are being sorted by compare_entries
+static int merge_length;
+
+static int compare_entries(const void *a, const void *b) {
+    const MergeEntry *e1 = (const MergeEntry *) a;
+    const MergeEntry *e2 = (const MergeEntry *) b;
+    int cmp = memcmp(e1->word, e2->word, merge_length);
+    if (cmp != 0) return cmp;
+    if (e1->list != e2->list) return e1->list - e2->list;
+    return e1->seq - e2->seq;
+}
+
+// merge the current words of the given lists into the merged index, the
+// previous occurrences of these lists are removed, the old index is freed
+static MIptr refresh_merged_index(MIptr old, int length, ListMask replace) {
+    char *buffers[MAX_WORD_LISTS];
+    int *buffer_scores[MAX_WORD_LISTS];
+    int n_buffers = 0;
+    int n_entries = 0;
+    int counts[MAX_WORD_LISTS];
+    int i;
+    for (i = 0; i < MAX_WORD_LISTS; i++) {
+        counts[i] = -1;
+        if (!(replace & merged_lists & LIST_BIT(i))) continue;
+        if (!trees[i][length] && !tables[i][length]) continue;
+        counts[i] = copy_words(i, length, &buffers[n_buffers], &buffer_scores[n_buffers]);
+        if (counts[i] < 0) goto error;
+        n_entries += counts[i];
+        n_buffers++;
+    }
+    MergeEntry *entries = PyMem_Malloc(n_entries * sizeof(MergeEntry) + 1);
+    if (!entries) goto error;
+    int e = 0;
+    int b = 0;
+    for (i = 0; i < MAX_WORD_LISTS; i++) {
+        if (counts[i] < 0) continue;
+        int w;
+        for (w = 0; w < counts[i]; w++, e++) {
+            entries[e].word = buffers[b] + w * length;
+            entries[e].list = i;
+            entries[e].seq = w;
+            entries[e].score = buffer_scores[b][w];
+        }
+        b++;
+    }
+    merge_length = length;
+    qsort(entries, n_entries, sizeof(MergeEntry), compare_entries);
+
+    const int old_words = old ? old->table.n_words : 0;
+    const int old_occurrences = old ? old->starts[old_words] : 0;
+    const int max_words = old_words + n_entries;
+    const int max_occurrences = old_occurrences + n_entries;
+    MIptr m = PyMem_Malloc(sizeof(MergedIndex));
+    char *words = PyMem_Malloc(max_words * length + 1);
+    ListMask *masks = PyMem_Malloc(max_words * sizeof(ListMask) + 1);
+    int *starts = PyMem_Malloc((max_words + 1) * sizeof(int));
+    int *lists = PyMem_Malloc(max_occurrences * sizeof(int) + 1);
+    int *scores = PyMem_Malloc(max_occurrences * sizeof(int) + 1);
+    if (!m || !words || !masks || !starts || !lists || !scores) {
+        PyMem_Free(m);
+        PyMem_Free(words);
+        PyMem_Free(masks);
+        PyMem_Free(starts);
+        PyMem_Free(lists);
+        PyMem_Free(scores);
+        PyMem_Free(entries);
+        goto error;
+    }
+    int n_words = 0;
+    int n_occurrences = 0;
+    int w = 0;
+    e = 0;
+    while (w < old_words || e < n_entries) {
+        char *word;
+        int cmp;
+        if (w >= old_words) {
+            cmp = 1;
+        } else if (e >= n_entries) {
+            cmp = -1;
+        } else {
+            cmp = memcmp(old->table.words + w * length, entries[e].word, length);
+        }
+        word = cmp <= 0 ? old->table.words + w * length : entries[e].word;
+        ListMask mask = 0;
+        starts[n_words] = n_occurrences;
+        // merge the remaining occurrences of the word with the new ones
+        int o = cmp <= 0 ? old->starts[w] : 0;
+        const int o_end = cmp <= 0 ? old->starts[w + 1] : 0;
+        while (o < o_end || (cmp >= 0 && e < n_entries
+            && memcmp(entries[e].word, word, length) == 0)) {
+            const int take_old = o < o_end && (cmp < 0 || e >= n_entries
+                || memcmp(entries[e].word, word, length) != 0
+                || old->lists[o] < entries[e].list);
+            if (take_old) {
+                if (!(replace & LIST_BIT(old->lists[o]))) {
+                    lists[n_occurrences] = old->lists[o];
+                    scores[n_occurrences] = old->scores[o];
+                    mask |= LIST_BIT(old->lists[o]);
+                    n_occurrences++;
+                }
+                o++;
+            } else {
+                lists[n_occurrences] = entries[e].list;
+                scores[n_occurrences] = entries[e].score;
+                mask |= LIST_BIT(entries[e].list);
+                n_occurrences++;
+                e++;
+            }
+        }
+        if (cmp <= 0) w++;
+        if (mask) {
+            memcpy(words + n_words * length, word, length);
+            masks[n_words] = mask;
+            n_words++;
+        }
+    }
+    starts[n_words] = n_occurrences;
+    m->table.length = length;
+    m->table.n_words = n_words;
+    m->table.words = words;
+    m->table.scores = NULL;
+    m->table.owner = NULL;
+    m->masks = masks;
+    m->starts = starts;
+    m->lists = lists;
+    m->scores = scores;
+    m->bits = NULL;
+    PyMem_Free(entries);
+    for (b = 0; b < n_buffers; b++) {
+        PyMem_Free(buffers[b]);
+        PyMem_Free(buffer_scores[b]);
+    }
+    free_merged_index(old);
+    return m;
+error:
+    for (b = 0; b < n_buffers; b++) {
+        PyMem_Free(buffers[b]);
+        PyMem_Free(buffer_scores[b]);
+    }
+    return NULL;
+}
+
+MIptr get_merged_index(int length) {
+    if (!merged[length] || merged_stale[length]) {
+        ListMask replace = merged[length] ? merged_stale[length] : merged_lists;
+        MIptr m = refresh_merged_index(merged[length], length, replace);
+        if (!m) return NULL;
+        merged[length] = m;
+        merged_stale[length] = 0;
+    }
+    return merged[length];
+}
+
+void free_merged_index(MIptr m) {
+    if (!m) return;
+    PyMem_Free(m->table.words);
+    PyMem_Free(m->masks);
+    PyMem_Free(m->starts);
+    PyMem_Free(m->lists);
+    PyMem_Free(m->scores);
+    free_bitset_index(m->bits);
+    PyMem_Free(m);
+}
+
+// compute the distinct words that match the constraints, regardless of
+// the lists that contain them, return the number of these words
+int merged_query(MIptr m, char *s, int engine, Block *result) {
+    const int length = m->table.length;
+    const int n_blocks = (m->table.n_words + BLOCK_BITS - 1) / BLOCK_BITS;
+    if (engine == SEARCH_ENGINE_BITSET && !m->bits) {
+        char *words = PyMem_Malloc(m->table.n_words * length + 1);
+        int *scores = PyMem_Malloc(m->table.n_words * sizeof(int) + 1);
+        if (words && scores) {
+            memcpy(words, m->table.words, m->table.n_words * length);
+            memset(scores, 0, m->table.n_words * sizeof(int));
+            m->bits = build_bitset_index(words, scores, m->table.n_words, length);
+        } else {
+            PyMem_Free(words);
+            PyMem_Free(scores);
+        }
+    }
+    if (engine == SEARCH_ENGINE_BITSET && m->bits) {
+        const int n = bitset_query(m->bits, s, -9999, result);
+        return n > 0 ? n : 0;
+    }
+    memset(result, 0, n_blocks * sizeof(Block));
+    int start;
+    int end;
+    const int n_prefix = table_range(&m->table, s, &start, &end);
+    int n = 0;
+    int w;
+    for (w = start; w < end; w++) {
+        char *word = m->table.words + w * length;
+        int i;
+        for (i = n_prefix; i < length; i++) {
+            if (s[i] != CONSTRAINT_EMPTY && s[i] != word[i]) break;
+        }
+        if (i < length) continue;
+        result[w / BLOCK_BITS] |= ((Block) 1) << (w % BLOCK_BITS);
+        n++;
+    }
+    return n;
+}
+
+// 1 if one of the lists contains the word with score >= min_score, 0 otherwise
+int merged_has_word(MIptr m, int w, ListMask lists, int min_score) {
+    if (!(m->masks[w] & lists)) return 0;
+    int o;
+    for (o = m->starts[w]; o < m->starts[w + 1]; o++) {
+        if ((lists & LIST_BIT(m->lists[o])) && m->scores[o] >= min_score)
+            return 1;
     }
     return 0;
 }
 
-void clear_slot(Cell *cgrid, int width, int height, Slot *slots, int n_slots, int index) {
-    Slot slot = slots[index];
-    int l;
-    for (l = 0; l < slot.length; l++) {
-        if (cgrid[slot.x + slot.y * width].fixed == 1)
+Sptr analyze_merged(int offset, char *cs, ListMask lists, int min_score, int engine) {
+    const int length = strlen(cs);
+    Sptr cached = find_analysis(&analysis_caches[MERGED_CACHE], lists, offset, cs, min_score);
+    if (cached) return cached;
+    MIptr m = get_merged_index(length);
+    if (!m) return NULL;
+    Sptr result = new_search_result();
+    if (!result) return NULL;
+    if (m->table.n_words == 0) return result;
+    const int n_blocks = (m->table.n_words + BLOCK_BITS - 1) / BLOCK_BITS;
+    Block *matches = PyMem_Malloc(n_blocks * sizeof(Block));
+    if (!matches) return result;
+    int seen[256];
+    memset(seen, 0, sizeof(seen));
+    int n = 0;
+    if (merged_query(m, cs, engine, matches) > 0) {
+        int k;
+        for (k = 0; k < n_blocks; k++) {
+            Block x;
+            for (x = matches[k]; x; x &= x - 1) {
+                const int w = k * BLOCK_BITS + lowest_bit(x);
+                if (!merged_has_word(m, w, lists, min_score)) continue;
+                seen[(unsigned char) m->table.words[w * length + offset]] = 1;
+                n++;
+            }
+        }
+    }
+    PyMem_Free(matches);
+    result->n_matches = n;
+    if (n > 0) {
+        const char intersect_char = *(cs + offset);
+        if (intersect_char != CONSTRAINT_EMPTY) {
+            result->chars[0] = intersect_char;
+        } else {
+            int c;
+            int i = 0;
+            for (c = 0; c < 256 && i < MAX_ALPHABET_SIZE; c++) {
+                if (seen[c]) result->chars[i++] = (char) c;
+            }
+        }
+    }
+    store_analysis(&analysis_caches[MERGED_CACHE], lists, offset, cs, min_score, result);
+    return result;
+}
+
+// 0 = false, 1 = true
+int calc_is_available(PyObject *grid, int x, int y) {
+    int width = (int) PyInt_AsLong(PyObject_GetAttrString(grid, "width"));
+    int height = (int) PyInt_AsLong(PyObject_GetAttrString(grid, "height"));
+
+    if (!(0 <= x && x < width && 0 <= y && y < height))
+        return 0;
+
+    PyObject* data = PyObject_GetAttrString(grid, "data");
+    PyObject* col = PyObject_GetItem(data, PyInt_FromLong(y));
+    PyObject* cell = PyObject_GetItem(col, PyInt_FromLong(x));
+
+    int is_block = PyObject_IsTrue(PyObject_GetItem(cell, PyString_FromString("block")));
+    if (is_block != 0)
+        return 0;
+    int is_void = PyObject_IsTrue(PyObject_GetItem(cell, PyString_FromString("void")));
+    if (is_void != 0)
+        return 0;
+    return 1;
+}
+
+// 0 = false, 1 = true
+int calc_is_start_word(PyObject *grid, int x, int y) {
+    int available = calc_is_available(grid, x, y);
+    if (available == 0)
+        return 0;
+
+    PyObject *bar_str = PyString_FromString("bar");
+    PyObject *side_left = PyString_FromString("left");
+    PyObject *side_top = PyString_FromString("top");
+
+    // 0 = across, 1 = down
+    int e;
+    for (e = 0; e < 2; e++) {
+        int bdx = e == 0 ? -1 : 0;
+        int bdy = e == 0 ? 0 : -1;
+        int adx = e == 0 ? 1 : 0;
+        int ady = e == 0 ? 0 : 1;
+        PyObject *side = e == 0 ? side_left : side_top;
+
+        // both conditions of after
+        if (calc_is_available(grid, x + adx, y + ady) == 0)
             continue;
-        int cx = slot.x + (slot.dir == DIR_ACROSS ? l : 0);
-        int cy = slot.y + (slot.dir == DIR_DOWN ? l : 0);
-        int m = get_slot_index(slots, n_slots, cx, cy, slot.dir == DIR_ACROSS ? 1 : 0);
-        int is_inter_ok = 1;
-        if (m >= 0) {
-            // a char can be cleared if the intersecting slot is not done or
-            // when it has one or more missing characters (these are not mutually
-            // exclusive as a slot can be fully filled in but not yet marked as done:
-            // the content of the slot may not be a valid word)
-            is_inter_ok = !slots[m].done || can_clear_char(cgrid, width, height, slots[m]);
+        PyObject* data = PyObject_GetAttrString(grid, "data");
+        PyObject* col = PyObject_GetItem(data, PyInt_FromLong(y + ady));
+        PyObject* cell = PyObject_GetItem(col, PyInt_FromLong(x + adx));
+        PyObject* bars = PyObject_GetItem(cell, bar_str);
+        if (PyObject_IsTrue(PyObject_GetItem(bars, side)) == 1)
+            continue;
+
+        // both conditions of before
+        if (calc_is_available(grid, x + bdx, y + bdy) == 0)
+            return 1;
+        col = PyObject_GetItem(data, PyInt_FromLong(y));
+        cell = PyObject_GetItem(col, PyInt_FromLong(x));
+        bars = PyObject_GetItem(cell, bar_str);
+        if (PyObject_IsTrue(PyObject_GetItem(bars, side)) == 1)
+            return 1;
+    }
+    return 0;
+}
+
+int count_words(GreedyWords *words, int length, char *cs) {
+    int count = 0;
+    Py_ssize_t w;
+    for (w = 0; w < words->n_words[length]; w++) {
+        if (check_constraints(words->words[length][w], cs)) {
+            count++;
         }
-        Cell *cell = &cgrid[cx + cy * width];
-        if (is_inter_ok && cell->c != CONSTRAINT_EMPTY) {
-            cell->c = CONSTRAINT_EMPTY;
+    }
+    return count;
+}
+
+int get_slot_index(Slot *slots, int n_slots, int x, int y, int dir) {
+    int s;
+    for (s = 0; s < n_slots; s++) {
+        Slot slot = slots[s];
+        if (dir == slot.dir) {
+            int match_across = (dir == DIR_ACROSS && x>= slot.x
+                && x < slot.x + slot.length && slot.y == y);
+            int match_down = (dir == DIR_DOWN && y >= slot.y
+                && y < slot.y + slot.length && slot.x == x);
+            if (match_across || match_down) {
+                return s;
+            }
+        }
+    }
+    return -1;
+}
+
+// 1 = yes, 0 = no
+int can_clear_char(Cell *cgrid, int width, int height, Slot slot) {
+    int j;
+    for (j = 0; j < slot.length; j++) {
+        int cx = slot.x + (slot.dir == DIR_ACROSS ? j : 0);
+        int cy = slot.y + (slot.dir == DIR_DOWN ? j : 0);
+        if (cgrid[cx + cy * width].c == CONSTRAINT_EMPTY)
+            return 1;
+    }
+    return 0;
+}
+
+void clear_slot(Cell *cgrid, int width, int height, Slot *slots, int n_slots, int index) {
+    Slot slot = slots[index];
+    int l;
+    for (l = 0; l < slot.length; l++) {
+        if (cgrid[slot.x + slot.y * width].fixed == 1)
+            continue;
+        int cx = slot.x + (slot.dir == DIR_ACROSS ? l : 0);
+        int cy = slot.y + (slot.dir == DIR_DOWN ? l : 0);
+        int m = get_slot_index(slots, n_slots, cx, cy, slot.dir == DIR_ACROSS ? 1 : 0);
+        int is_inter_ok = 1;
+        if (m >= 0) {
+            // a char can be cleared if the intersecting slot is not done or
+            // when it has one or more missing characters (these are not mutually
+            // exclusive as a slot can be fully filled in but not yet marked as done:
+            // the content of the slot may not be a valid word)
+            is_inter_ok = !slots[m].done || can_clear_char(cgrid, width, height, slots[m]);
+        }
+        Cell *cell = &cgrid[cx + cy * width];
+        if (is_inter_ok && cell->c != CONSTRAINT_EMPTY) {
+            cell->c = CONSTRAINT_EMPTY;
+        }
+    }
+}
+
+// 0 = false, 1 = true
+int is_intersecting(Slot *slot1, Slot *slot2) {
+    if (slot1->dir == slot2->dir) return 0;
+    if (slot1->dir == DIR_ACROSS) {
+        return (slot2->x >= slot1->x && slot2->x < slot1->x + slot1->length
+            && slot1->y >= slot2->y && slot1->y < slot2->y + slot2->length);
+    } else if (slot1->dir == DIR_DOWN) {
+        return (slot1->x >= slot2->x && slot1->x < slot2->x + slot2->length
+            && slot2->y >= slot1->y && slot2->y < slot1->y + slot1->length);
+    }
+    return 0;
+}
+
+int is_valid(int x, int y, int width, int height) {
+    return x >= 0 && y >= 0 && x < width && y < height;
+}
+
+int is_available(Cell *cgrid, int width, int height, int x, int y) {
+    if (!is_valid(x, y, width, height)) return 0;
+    int a0 = cgrid[x + y * width].block == 0;
+    int a1 = cgrid[x + y * width].empty == 0;
+    return a0 && a1;
+}
+
+char* get_constraints(Cell *cgrid, int width, int height, Slot *slot) {
+    // TODO reduce these malloc calls
+    //printf("Constraint search\n");
+    char* cs = PyMem_Malloc(slot->length * sizeof(char) + 1);
+    if (!cs) {
+        return NULL;
+    }
+    get_constraints_i(cgrid, width, height, slot, cs);
+    return cs;
+}
+
+void get_constraints_i(Cell *cgrid, int width, int height, Slot *slot, char *cs) {
+    const int dx = slot->dir == DIR_ACROSS ? 1 : 0;
+    const int dy = slot->dir == DIR_DOWN ? 1 : 0;
+    int j;
+    for (j = 0; j < slot->length; j++) {
+        cs[j] = cgrid[(slot->x + j * dx) + (slot->y + j * dy) * width].c;
+    }
+    cs[slot->length] = '\0';
+}
+
+int determine_count(GreedyWords *words, Cell *cgrid, int width, int height, Slot *slot) {
+    int prev = slot->count;
+    // TODO reduce these malloc calls
+    //printf("Constraint search\n");
+    char* cs = PyMem_Malloc(slot->length * sizeof(char) + 1);
+    if (!cs) {
+        return -1;
+    }
+    get_constraints_i(cgrid, width, height, slot, cs);
+    int count = count_words(words, slot->length, cs);
+    if (DEBUG && count == 0) {
+        printf("WARNING: slot (%i, %i, %i): from %i to %i\n", slot->x, slot->y, slot->dir, prev, count);
+    }
+    PyMem_Free(cs);
+    return count;
+}
+
+// return = number of slots cleared
+int backtrack(GreedyWords *words, Cell *cgrid, int width, int height, Slot *slots, int n_slots, int* order, int n_done_slots, int index) {
+    //printf("Backtracking\n");
+    int cleared = 0;
+    int s;
+    int iindex = -1;
+    /*for (s = n_done_slots; s >= 0; s--) {
+        //printf("Checking: %i %i %i with %i %i %i\n", slots[order[s]].x, slots[order[s]].y, slots[order[s]].dir, slots[order[index]].x, slots[order[index]].y, slots[order[index]].dir);
+        if (is_intersecting(&slots[order[s]], &slots[index])) {
+            iindex = s;
+            break;
+        }
+    }*/
+    iindex = n_done_slots - 1;
+    if (iindex < 0) {
+        printf("No index found for %i %i %i !\n", slots[index].x, slots[index].y, slots[index].dir);
+        iindex = 0;
+    }
+    //printf("Backtracking %i %i\n", iindex, index);
+    if (iindex >= 0) {
+        if (0) {
+            printf("Blanking between (%i, %i, %s) and (%i, %i, %s)\n"
+                , (&slots[iindex])->x, (&slots[iindex])->y, (&slots[iindex])->dir == DIR_ACROSS ? "across" : "down"
+                , (&slots[index])->x, (&slots[index])->y, (&slots[index])->dir == DIR_ACROSS ? "across" : "down" );
+            printf("Indices: %i %i\n", iindex, index);
+        }
+        for (s = n_done_slots; s >= iindex; s--) {
+            int blank = order[s];
+            if (blank < 0) {
+                // no word was actually filled in so skip
+                continue;
+            }
+            Slot *bslot = &slots[blank];
+            //printf("About to clear: (%i, %i, %s)\n", bslot->x, bslot->y, bslot->dir == DIR_ACROSS ? "across" : "down");
+            cleared++;
+            clear_slot(cgrid, width, height, slots, n_slots, blank);
+            bslot->count = determine_count(words, cgrid, width, height, bslot);
+            bslot->done = 0;
+            if (s > iindex) bslot->offset = 0;
+            if (s == iindex) {
+                bslot->offset++;
+                if (bslot->offset == bslot->count && iindex > 0) {
+                    // if we exhaused all words, backtrack one more
+                    bslot->offset = 0;
+                    iindex -= 1;
+                }
+            }
+        }
+    }
+    return cleared;
+}
+
+PyObject* gather_fill(Cell *cgrid, int width, int height) {
+    int x;
+    int y;
+    PyObject *fill = PyList_New(0);
+    for (y = 0; y < height; y++) {
+        for (x = 0; x < width; x++) {
+            Cell *cell = &cgrid[x + y * width];
+            if (cell->fixed == 1 || cell->c == CONSTRAINT_EMPTY) continue;
+            char cell_c[2];
+            cell_c[0] = toupper(cell->c);
+            cell_c[1] = '\0';
+            PyList_Append(fill, Py_BuildValue("(iis)", x, y, cell_c));
+        }
+    }
+    return fill;
+}
+
+inline int find_initial_slot(Slot *slots, int n_slots, int option_start) {
+    int index = -1;
+    if (option_start == FILL_START_AT_ZERO) {
+        index = 0;
+    } else if (option_start == FILL_START_AT_SELECTION) {
+        // TODO
+    } else if (option_start == FILL_START_AT_AUTO) {
+        // find most-constrained slot that is not done and has at least one possible word
+        int m;
+        for (m = 0; m < n_slots; m++) {
+            if (!slots[m].done && slots[m].count > 0) {
+                index = m;
+                break;
+            }
+        }
+        for (m = 0; m < n_slots; m++) {
+            if (slots[m].count == 0) continue;
+            if (slots[m].count < slots[index].count && !slots[m].done) {
+                index = m;
+            }
+        }
+    }
+    return index;
+}
+
+inline int find_slot(Slot *slots, int n_slots, int* order) {
+    // find most-constrained slot that is connected to a previously filled in slot
+    int index = -1;
+    int o;
+    for (o = 0; o < n_slots; o++) {
+        if (order[o] < 0) break;
+        int l;
+        for (l = 0; l < slots[order[o]].length; l++) {
+            int m;
+            for (m = 0; m < n_slots; m++) {
+                if (order[o] == m) continue;
+                if (slots[m].done) continue;
+                if (is_intersecting(&slots[order[o]], &slots[m])) {
+                    if (slots[order[o]].dir == DIR_ACROSS && (slots[m].x - slots[order[o]].x == l)) {
+                        index = m;
+                        break;
+                    } else if (slots[order[o]].dir == DIR_DOWN && (slots[m].y - slots[order[o]].y == l)) {
+                        index = m;
+                        break;
+                    }
+                }
+            }
+            if (index >= 0) break;
+        }
+        if (index >= 0) break;
+    }
+    return index;
+}
+
+inline int find_nice_slot(GreedyWords *words, Slot *slots, int n_slots, int width, int height, int* order) {
+    // compute lengths of provided words and lengths of actually filled in words
+    int lengths[MAX_WORD_LENGTH];
+    int a_lengths[MAX_WORD_LENGTH];
+    int t;
+    for (t = 0; t < MAX_WORD_LENGTH; t++) {
+        lengths[t] = 0;
+        a_lengths[t] = 0;
+    }
+    for (t = 0; t < MAX_WORD_LENGTH; t++) {
+        lengths[t] += words->n_words[t];
+    }
+    for (t = 0; t < n_slots; t++) {
+        int i = order[t];
+        if (i < 0) break;
+        a_lengths[slots[i].length]++;
+    }
+    // find index of a possible symmetrical slot
+    for (t = 0; t < n_slots; t++) {
+        int i = order[t];
+        if (i < 0) break;
+        int x = slots[i].x;
+        int y = slots[i].y;
+        int dir = slots[i].dir;
+        int length = slots[i].length;
+        int s;
+        for (s = 0; s < n_slots; s++) {
+            if (s == t) continue;
+            int symm_x = width - x - (dir == DIR_ACROSS ? length : 0) - (dir == DIR_DOWN ? 1 : 0);
+            int symm_y = height - y - (dir == DIR_DOWN ? length : 0) - (dir == DIR_ACROSS ? 1 : 0);
+            if ((slots[s].x == symm_x)
+                && (slots[s].y == symm_y)
+                && slots[s].dir == dir
+                && slots[s].length == length
+                && !slots[s].done
+                //&& slots[s].count > 0
+                && a_lengths[length] < lengths[length]) {
+                return s;
+            }
+        }
+    }
+    // find "nicest" slot (= close to center and preferably across)
+    int c_x = width / 2;
+    int c_y = height / 2;
+    int index = -1;
+    int score = 1000 * (width + height);
+    for (t = 0; t < n_slots; t++) {
+        int l = slots[t].length;
+        //printf("%i %i %i | %i %i\n", slots[t].x, slots[t].y, slots[t].dir, slots[t].done, slots[t].count);
+        if (!slots[t].done && /*slots[t].count > 0 &&*/ a_lengths[l] < lengths[l]) {
+            int s_x = slots[t].x - c_x;
+            int s_y = slots[t].y - c_y;
+            int s_score = (s_x >= 0 ? s_x : -1 * s_x) + (s_y >= 0 ? s_y : -1 * s_y) + (slots[t].dir == DIR_DOWN ? 5 : 0);
+            if (s_score < score) {
+                //printf("Score: %i %i\n", s_score, score);
+                index = t;
+                score = s_score;
+            }
+        }
+    }
+    return index;
+}
+
+typedef struct aword {
+    char *word; // not NUL-terminated
+    int length;
+} AutomatonWord;
+
+static int compare_automaton_words(const void *a, const void *b) {
+    const AutomatonWord *w1 = (const AutomatonWord *) a;
+    const AutomatonWord *w2 = (const AutomatonWord *) b;
+    const int n = w1->length < w2->length ? w1->length : w2->length;
+    int cmp = memcmp(w1->word, w2->word, n);
+    if (cmp != 0) return cmp;
+    return w1->length - w2->length;
+}
+
+// the child of state s with the given character, -1 if there is none
+static inline int automaton_child(WAptr a, int s, unsigned char c) {
+    int lo = a->first_child[s];
+    int hi = a->first_child[s + 1];
+    const int end = hi;
+    while (lo < hi) {
+        const int mid = lo + (hi - lo) / 2;
+        if (a->chars[mid] < c)
+            lo = mid + 1;
+        else
+            hi = mid;
+    }
+    return lo < end && a->chars[lo] == c ? lo : -1;
+}
+
+static void free_word_automaton(WAptr a) {
+    if (!a) return;
+    PyMem_Free(a->first_child);
+    PyMem_Free(a->chars);
+    PyMem_Free(a->depth);
+    PyMem_Free(a->is_word);
+    PyMem_Free(a->fail);
+    PyMem_Free(a->output);
+    PyMem_Free(a);
+}
+
+// build the trie of the sorted words breadth first, each state covers the
+// range lo..hi of words that start with its prefix
+static WAptr build_word_automaton(AutomatonWord *words, int n_words, size_t n_chars) {
+    const size_t max_states = n_chars + 1;
+    WAptr a = PyMem_Malloc(sizeof(WordAutomaton));
+    int *lo = PyMem_Malloc(max_states * sizeof(int));
+    int *hi = PyMem_Malloc(max_states * sizeof(int));
+    if (a) {
+        a->first_child = PyMem_Malloc((max_states + 1) * sizeof(int));
+        a->chars = PyMem_Malloc(max_states);
+        a->depth = PyMem_Malloc(max_states);
+        a->is_word = PyMem_Malloc(max_states);
+        a->fail = PyMem_Malloc(max_states * sizeof(int));
+        a->output = PyMem_Malloc(max_states * sizeof(int));
+    }
+    if (!a || !lo || !hi || !a->first_child || !a->chars || !a->depth
+        || !a->is_word || !a->fail || !a->output) {
+        free_word_automaton(a);
+        PyMem_Free(lo);
+        PyMem_Free(hi);
+        return NULL;
+    }
+    int n_states = 1;
+    lo[0] = 0;
+    hi[0] = n_words;
+    a->chars[0] = 0;
+    a->depth[0] = 0;
+    int s;
+    for (s = 0; s < n_states; s++) {
+        const int d = a->depth[s];
+        int w = lo[s];
+        // the words that end in this state come first
+        while (w < hi[s] && words[w].length == d) w++;
+        a->is_word[s] = w > lo[s];
+        a->first_child[s] = n_states;
+        while (w < hi[s]) {
+            const char c = words[w].word[d];
+            int e = w;
+            while (e < hi[s] && words[e].word[d] == c) e++;
+            a->chars[n_states] = (unsigned char) c;
+            a->depth[n_states] = d + 1;
+            lo[n_states] = w;
+            hi[n_states] = e;
+            n_states++;
+            w = e;
+        }
+    }
+    a->first_child[n_states] = n_states;
+    a->n_states = n_states;
+    PyMem_Free(lo);
+    PyMem_Free(hi);
+    // the states are visited breadth first so the fail state of a parent
+    // is known before those of its children
+    a->fail[0] = 0;
+    a->output[0] = -1;
+    for (s = 0; s < n_states; s++) {
+        int c;
+        for (c = a->first_child[s]; c < a->first_child[s + 1]; c++) {
+            int t = -1;
+            if (s > 0) {
+                int f = a->fail[s];
+                while ((t = automaton_child(a, f, a->chars[c])) < 0 && f > 0) {
+                    f = a->fail[f];
+                }
+            }
+            a->fail[c] = t >= 0 ? t : 0;
+            a->output[c] = a->is_word[a->fail[c]] ? a->fail[c] : a->output[a->fail[c]];
+        }
+    }
+    return a;
+}
+
+static WAptr create_word_automaton(int index) {
+    char *words[MAX_WORD_LENGTH];
+    int n_words[MAX_WORD_LENGTH];
+    int total = 0;
+    size_t n_chars = 0;
+    int failed = 0;
+    int m;
+    for (m = 0; m < MAX_WORD_LENGTH; m++) {
+        words[m] = NULL;
+        n_words[m] = 0;
+        if (m == 0 || failed || (!trees[index][m] && !tables[index][m]))
+            continue;
+        int *scores;
+        const int n = copy_words(index, m, &words[m], &scores);
+        if (n < 0) {
+            failed = 1;
+            continue;
+        }
+        PyMem_Free(scores);
+        n_words[m] = n;
+        total += n;
+        n_chars += (size_t) n * m;
+    }
+    WAptr a = NULL;
+    AutomatonWord *all = failed ? NULL : PyMem_Malloc(total * sizeof(AutomatonWord) + 1);
+    if (all) {
+        int n = 0;
+        for (m = 0; m < MAX_WORD_LENGTH; m++) {
+            int w;
+            for (w = 0; w < n_words[m]; w++) {
+                all[n].word = words[m] + w * m;
+                all[n].length = m;
+                n++;
+            }
+        }
+        qsort(all, total, sizeof(AutomatonWord), compare_automaton_words);
+        a = build_word_automaton(all, total, n_chars);
+    }
+    PyMem_Free(all);
+    for (m = 0; m < MAX_WORD_LENGTH; m++) {
+        PyMem_Free(words[m]);
+    }
+    return a;
+}
+
+WAptr get_word_automaton(int index) {
+    if (!automata[index]) {
+        automata[index] = create_word_automaton(index);
+    }
+    return automata[index];
+}
+
+void clear_word_automaton(int index) {
+    free_word_automaton(automata[index]);
+    automata[index] = NULL;
+}
+
+// find the words of the automaton that occur in s, as pairs of the position
+// and the length of the word in found, which has room for length *
+// (length + 1) / 2 pairs (when each substring is a word),
+// return the number of words that were found
+int scan_words(WAptr a, const char *s, int length, int *found)
+{
+    int n = 0;
+    int state = 0;
+    int k;
+    for (k = 0; k < length; k++) {
+        const unsigned char c = (unsigned char) s[k];
+        int t;
+        while ((t = automaton_child(a, state, c)) < 0 && state > 0) {
+            state = a->fail[state];
+        }
+        state = t >= 0 ? t : 0;
+        int w = a->is_word[state] ? state : a->output[state];
+        for (; w >= 0; w = a->output[w]) {
+            found[2 * n] = k + 1 - a->depth[w];
+            found[2 * n + 1] = a->depth[w];
+            n++;
+        }
+    }
+    return n;
+}
+
+static int add_loaded_word(LoadedWords *loaded, const char *word, int length, int score) {
+    if (loaded->n_words == loaded->size) {
+        const int size = 2 * loaded->size + 256;
+        char *words = PyMem_Realloc(loaded->words, size * (length + 1));
+        if (!words) return 0;
+        loaded->words = words;
+        int *scores = PyMem_Realloc(loaded->scores, size * sizeof(int));
+        if (!scores) return 0;
+        loaded->scores = scores;
+        loaded->size = size;
+    }
+    char *dst = loaded->words + loaded->n_words * (length + 1);
+    memcpy(dst, word, length);
+    dst[length] = '\0';
+    loaded->scores[loaded->n_words++] = score;
+    return 1;
+}
+
+static int is_int_space(char c) {
+    return c == ' ' || c == '\t' || c == '\n' || c == '\r' || c == '\v' || c == '\f';
+}
+
+// parse a score in the same way as int() does, return 0 if it is not valid
+static int parse_score(const char *s, const char *end, int *score) {
+    while (s < end && is_int_space(*s)) s++;
+    while (end > s && is_int_space(*(end - 1))) end--;
+    int negative = 0;
+    if (s < end && (*s == '-' || *s == '+')) {
+        negative = *s == '-';
+        s++;
+    }
+    if (s == end) return 0;
+    long long value = 0;
+    for (; s < end; s++) {
+        if (*s < '0' || *s > '9') return 0;
+        value = 10 * value + (*s - '0');
+        if (value > INT_MAX) return 0;
+    }
+    *score = (int) (negative ? -value : value);
+    return 1;
+}
+
+// parse the lines of a word list file between start and end into the
+// loaded words of each length, a line is a word or a word and a score
+// separated by a comma, spaces in a word are ignored and words with other
+// characters than a-z and A-Z are rejected, return 0 if out of memory
+int parse_wordlist(const char *start, const char *end, int default_score, LoadedWords *loaded) {
+    const char *line = start;
+    while (line < end) {
+        const char *eol = memchr(line, '\n', end - line);
+        if (!eol) eol = end;
+        const char *comma = memchr(line, ',', eol - line);
+        const char *word_end = comma ? comma : eol;
+        int score = default_score;
+        int valid = !comma || (!memchr(comma + 1, ',', eol - comma - 1)
+            && parse_score(comma + 1, eol, &score));
+        char word[MAX_WORD_LENGTH];
+        int length = 0;
+        const char *c;
+        for (c = line; valid && c < word_end; c++) {
+            if (*c == ' ') continue;
+            if (length == MAX_WORD_LENGTH - 1) {
+                valid = 0;
+            } else if (*c >= 'a' && *c <= 'z') {
+                word[length++] = *c;
+            } else if (*c >= 'A' && *c <= 'Z') {
+                word[length++] = *c + ('a' - 'A');
+            } else {
+                valid = 0;
+            }
+        }
+        if (valid && length > 0) {
+            if (!add_loaded_word(&loaded[length], word, length, score)) return 0;
+        }
+        line = eol + 1;
+    }
+    return 1;
+}
+
+// append the loaded words of the given length of other to loaded
+int append_loaded_words(LoadedWords *loaded, LoadedWords *other, int length) {
+    if (other->n_words == 0) return 1;
+    if (loaded->n_words + other->n_words > loaded->size) {
+        const int size = loaded->n_words + other->n_words + loaded->size;
+        char *words = PyMem_Realloc(loaded->words, size * (length + 1));
+        if (!words) return 0;
+        loaded->words = words;
+        int *scores = PyMem_Realloc(loaded->scores, size * sizeof(int));
+        if (!scores) return 0;
+        loaded->scores = scores;
+        loaded->size = size;
+    }
+    memcpy(loaded->words + loaded->n_words * (length + 1), other->words
+        , other->n_words * (length + 1));
+    memcpy(loaded->scores + loaded->n_words, other->scores, other->n_words * sizeof(int));
+    loaded->n_words += other->n_words;
+    other->n_words = 0;
+    return 1;
+}
+
+void free_loaded_words(LoadedWords *loaded) {
+    PyMem_Free(loaded->words);
+    PyMem_Free(loaded->scores);
+    loaded->words = NULL;
+    loaded->scores = NULL;
+    loaded->n_words = 0;
+    loaded->size = 0;
+}
+
+static int compare_fill_entries(const void *a, const void *b) {
+    const WordEntry *e1 = (const WordEntry *) a;
+    const WordEntry *e2 = (const WordEntry *) b;
+    int cmp = strcmp(e1->word, e2->word);
+    if (cmp != 0) return cmp;
+    return e2->score - e1->score;
+}
+
+static const FillWords *fill_order_words;
+
+static int compare_fill_order(const void *a, const void *b) {
+    const int w1 = *(const int *) a;
+    const int w2 = *(const int *) b;
+    const int s1 = fill_order_words->scores[w1];
+    const int s2 = fill_order_words->scores[w2];
+    if (s1 != s2) return s1 > s2 ? -1 : 1;
+    return w1 - w2;
+}
+
+static void free_fill_words(FWptr f) {
+    if (!f) return;
+    PyMem_Free(f->words);
+    PyMem_Free(f->scores);
+    PyMem_Free(f->order);
+    PyMem_Free(f->bits);
+    PyMem_Free(f);
+}
+
+static inline Block* fill_bits(FWptr f, int pos, int c) {
+    return f->bits + (pos * FILL_LETTERS + c) * f->n_blocks;
+}
+
+// the distinct words of the given length of words, a dict with for each
+// length a list of (word, score), that consist of the letters a to z
+static FWptr new_fill_words(PyObject *words, int length) {
+    FWptr f = PyMem_Malloc(sizeof(FillWords));
+    if (!f) return NULL;
+    memset(f, 0, sizeof(FillWords));
+    f->length = length;
+    PyObject *key = PyInt_FromLong(length);
+    PyObject *list = key ? PyDict_GetItem(words, key) : NULL;
+    Py_XDECREF(key);
+    const Py_ssize_t n = list && PyList_Check(list) ? PyList_GET_SIZE(list) : 0;
+    WordEntry *entries = PyMem_Malloc(n * sizeof(WordEntry) + 1);
+    if (!entries) {
+        PyMem_Free(f);
+        return NULL;
+    }
+    int n_entries = 0;
+    Py_ssize_t w;
+    for (w = 0; w < n; w++) {
+        PyObject *item = PyList_GET_ITEM(list, w);
+        if (!PyTuple_Check(item) || PyTuple_GET_SIZE(item) < 2) continue;
+        PyObject *word = PyTuple_GET_ITEM(item, 0);
+        if (!PyString_Check(word) || PyString_GET_SIZE(word) != length) continue;
+        char *s = PyString_AS_STRING(word);
+        int j;
+        for (j = 0; j < length; j++) {
+            if (s[j] < 'a' || s[j] > 'z') break;
+        }
+        if (j < length) continue;
+        entries[n_entries].word = s;
+        entries[n_entries].score = (int) PyInt_AsLong(PyTuple_GET_ITEM(item, 1));
+        entries[n_entries].seq = n_entries;
+        n_entries++;
+    }
+    PyErr_Clear();
+    qsort(entries, n_entries, sizeof(WordEntry), compare_fill_entries);
+    int n_words = 0;
+    int e;
+    for (e = 0; e < n_entries; e++) {
+        if (n_words > 0 && strcmp(entries[n_words - 1].word, entries[e].word) == 0)
+            continue;
+        entries[n_words++] = entries[e];
+    }
+    f->n_words = n_words;
+    f->n_blocks = (n_words + BLOCK_BITS - 1) / BLOCK_BITS;
+    f->words = PyMem_Malloc(n_words * length + 1);
+    f->scores = PyMem_Malloc(n_words * sizeof(int) + 1);
+    f->order = PyMem_Malloc(n_words * sizeof(int) + 1);
+    f->bits = PyMem_Malloc(length * FILL_LETTERS * f->n_blocks * sizeof(Block) + 1);
+    if (!f->words || !f->scores || !f->order || !f->bits) {
+        PyMem_Free(entries);
+        free_fill_words(f);
+        return NULL;
+    }
+    memset(f->bits, 0, length * FILL_LETTERS * f->n_blocks * sizeof(Block));
+    for (w = 0; w < n_words; w++) {
+        memcpy(f->words + w * length, entries[w].word, length);
+        f->scores[w] = entries[w].score;
+        f->order[w] = (int) w;
+        int j;
+        for (j = 0; j < length; j++) {
+            fill_bits(f, j, entries[w].word[j] - 'a')[w / BLOCK_BITS] |= ((Block) 1) << (w % BLOCK_BITS);
+        }
+    }
+    PyMem_Free(entries);
+    fill_order_words = f;
+    qsort(f->order, n_words, sizeof(int), compare_fill_order);
+    return f;
+}
+
+// the position of the word in f, -1 if it is not there
+static int find_fill_word(FWptr f, const char *word) {
+    int lo = 0;
+    int hi = f->n_words - 1;
+    while (lo <= hi) {
+        const int mid = (lo + hi) / 2;
+        const int cmp = memcmp(f->words + mid * f->length, word, f->length);
+        if (cmp == 0) return mid;
+        if (cmp < 0) lo = mid + 1; else hi = mid - 1;
+    }
+    return -1;
+}
+
+void free_fill_problem(FPptr p) {
+    if (!p) return;
+    int s;
+    for (s = 0; s < p->n_slots; s++) {
+        PyMem_Free(p->slots[s].domain);
+        PyMem_Free(p->slots[s].conflicts);
+        PyMem_Free(p->slots[s].arcs);
+    }
+    int m;
+    for (m = 0; m < MAX_WORD_LENGTH; m++) {
+        free_fill_words(p->lengths[m]);
+    }
+    int t;
+    for (t = 0; t < p->n_trail; t++) {
+        PyMem_Free(p->trail[t].domain);
+    }
+    PyMem_Free(p->trail);
+    PyMem_Free(p->decisions);
+    PyMem_Free(p->queue);
+    PyMem_Free(p->work);
+    PyMem_Free(p->conflict);
+    PyMem_Free(p->cause);
+    PyMem_Free(p->best);
+    PyMem_Free(p->slots);
+    PyMem_Free(p);
+}
+
+static inline void add_level(Block *set, int level) {
+    set[level / BLOCK_BITS] |= ((Block) 1) << (level % BLOCK_BITS);
+}
+
+// the decisions because of which the slot has its words: the decisions
+// that removed words and the decision that placed a word in it
+static void explain_slot(FPptr p, int s, Block *set) {
+    FillSlot *slot = &p->slots[s];
+    int b;
+    for (b = 0; b < p->n_level_blocks; b++) {
+        set[b] |= slot->conflicts[b];
+    }
+    if (slot->level > 0) add_level(set, slot->level);
+}
+
+// save the domain of the slot on the trail, once for each decision
+static int save_domain(FPptr p, int s) {
+    FillSlot *slot = &p->slots[s];
+    if (slot->stamp == p->stamp) return 1;
+    if (p->n_trail == p->trail_size) {
+        const int size = 2 * p->trail_size + 16;
+        FillTrailEntry *trail = PyMem_Realloc(p->trail, size * sizeof(FillTrailEntry));
+        if (!trail) return 0;
+        p->trail = trail;
+        p->trail_size = size;
+    }
+    const int n_blocks = slot->words->n_blocks;
+    Block *domain = PyMem_Malloc((n_blocks + p->n_level_blocks) * sizeof(Block));
+    if (!domain) return 0;
+    memcpy(domain, slot->domain, n_blocks * sizeof(Block));
+    memcpy(domain + n_blocks, slot->conflicts, p->n_level_blocks * sizeof(Block));
+    FillTrailEntry *entry = &p->trail[p->n_trail++];
+    entry->slot = s;
+    entry->count = slot->count;
+    entry->cursor = slot->cursor;
+    entry->stamp = slot->stamp;
+    entry->domain = domain;
+    slot->stamp = p->stamp;
+    return 1;
+}
+
+// restore the domains that were saved after the trail had the given size
+static void undo_trail(FPptr p, int mark) {
+    while (p->n_trail > mark) {
+        FillTrailEntry *entry = &p->trail[--p->n_trail];
+        FillSlot *slot = &p->slots[entry->slot];
+        const int n_blocks = slot->words->n_blocks;
+        memcpy(slot->domain, entry->domain, n_blocks * sizeof(Block));
+        memcpy(slot->conflicts, entry->domain + n_blocks, p->n_level_blocks * sizeof(Block));
+        slot->count = entry->count;
+        slot->cursor = entry->cursor;
+        slot->stamp = entry->stamp;
+        PyMem_Free(entry->domain);
+    }
+}
+
+static void enqueue_slot(FPptr p, int s) {
+    if (p->slots[s].queued) return;
+    p->slots[s].queued = 1;
+    p->queue[p->n_queued++] = s;
+}
+
+static void clear_queue(FPptr p) {
+    while (p->n_queued > 0) {
+        p->slots[p->queue[--p->n_queued]].queued = 0;
+    }
+}
+
+// remove the word from the domain of the slot because of the decisions in
+// cause, 0 if the domain becomes empty or if there is no memory to save it
+static int remove_fill_word(FPptr p, int s, int w, const Block *cause) {
+    FillSlot *slot = &p->slots[s];
+    const Block bit = ((Block) 1) << (w % BLOCK_BITS);
+    if (!(slot->domain[w / BLOCK_BITS] & bit)) return 1;
+    if (!save_domain(p, s)) {
+        p->failed = -1;
+        return 0;
+    }
+    slot->domain[w / BLOCK_BITS] &= ~bit;
+    slot->count--;
+    int b;
+    for (b = 0; b < p->n_level_blocks; b++) {
+        slot->conflicts[b] |= cause[b];
+    }
+    enqueue_slot(p, s);
+    p->failed = s;
+    return slot->count > 0;
+}
+
+// remove the words of the slot of the arc that have a letter at the
+// shared cell that no word of the crossing slot has there,
+// 0 if no word remains or if there is no memory to save the domain
+static int revise_arc(FPptr p, int s, FillArc *arc) {
+    FillSlot *slot = &p->slots[s];
+    FillSlot *other = &p->slots[arc->slot];
+    FWptr f = slot->words;
+    FWptr g = other->words;
+    const int n_blocks = f->n_blocks;
+    int b;
+    int c;
+    // the letters that the crossing slot can have at the shared cell,
+    // a small domain is read word by word
+    int supported[FILL_LETTERS];
+    int n_supported = 0;
+    memset(supported, 0, sizeof(supported));
+    if (other->count < g->n_blocks) {
+        for (b = 0; b < g->n_blocks; b++) {
+            Block x = other->domain[b];
+            while (x) {
+                const int w = b * BLOCK_BITS + lowest_bit(x);
+                x &= x - 1;
+                c = g->words[w * g->length + arc->other_pos] - 'a';
+                n_supported += !supported[c];
+                supported[c] = 1;
+            }
+        }
+    } else {
+        for (c = 0; c < FILL_LETTERS; c++) {
+            Block *theirs = fill_bits(g, arc->other_pos, c);
+            for (b = 0; b < g->n_blocks; b++) {
+                if (other->domain[b] & theirs[b]) break;
+            }
+            supported[c] = b < g->n_blocks;
+            n_supported += supported[c];
+        }
+    }
+    if (n_supported == FILL_LETTERS) return 1;
+    int count = 0;
+    int changed = 0;
+    if (slot->count < n_blocks) {
+        // remove the words of a small domain one by one
+        for (b = 0; b < n_blocks; b++) {
+            Block kept = slot->domain[b];
+            Block x = kept;
+            while (x) {
+                const int w = b * BLOCK_BITS + lowest_bit(x);
+                const Block bit = x & -x;
+                x &= x - 1;
+                if (!supported[f->words[w * f->length + arc->pos] - 'a']) kept &= ~bit;
+            }
+            p->work[b] = kept;
+            changed |= kept != slot->domain[b];
+            count += count_bits(kept);
+        }
+    } else {
+        // keep the words with a supported letter or remove those without
+        // one, whichever needs the fewest letters
+        const int keep = n_supported <= FILL_LETTERS / 2;
+        memset(p->work, keep ? 0 : 0xff, n_blocks * sizeof(Block));
+        for (c = 0; c < FILL_LETTERS; c++) {
+            if (supported[c] != keep) continue;
+            Block *own = fill_bits(f, arc->pos, c);
+            if (keep) {
+                for (b = 0; b < n_blocks; b++) {
+                    p->work[b] |= own[b];
+                }
+            } else {
+                for (b = 0; b < n_blocks; b++) {
+                    p->work[b] &= ~own[b];
+                }
+            }
+        }
+        for (b = 0; b < n_blocks; b++) {
+            p->work[b] &= slot->domain[b];
+            changed |= p->work[b] != slot->domain[b];
+            count += count_bits(p->work[b]);
+        }
+    }
+    if (!changed) return 1;
+    if (!save_domain(p, s)) {
+        p->failed = -1;
+        return 0;
+    }
+    memcpy(slot->domain, p->work, n_blocks * sizeof(Block));
+    slot->count = count;
+    // the words were removed because of the words of the crossing slot
+    explain_slot(p, arc->slot, slot->conflicts);
+    enqueue_slot(p, s);
+    p->failed = s;
+    return count > 0;
+}
+
+// make the domains of the queued slots and of the slots that they cross
+// arc consistent (AC-3), 0 if a slot has no words left
+static int propagate(FPptr p) {
+    int q = 0;
+    while (q < p->n_queued) {
+        const int s = p->queue[q++];
+        p->slots[s].queued = 0;
+        FillSlot *slot = &p->slots[s];
+        int a;
+        for (a = 0; a < slot->n_arcs; a++) {
+            FillArc *arc = &slot->arcs[a];
+            FillArc back;
+            back.slot = s;
+            back.pos = arc->other_pos;
+            back.other_pos = arc->pos;
+            if (!revise_arc(p, arc->slot, &back)) {
+                clear_queue(p);
+                return 0;
+            }
+        }
+        if (q > p->n_slots) {
+            // keep the queue compact, slots are only queued once
+            memmove(p->queue, p->queue + q, (p->n_queued - q) * sizeof(int));
+            p->n_queued -= q;
+            q = 0;
+        }
+    }
+    p->n_queued = 0;
+    return 1;
+}
+
+// place the word in the slot, 0 if that leaves a slot without words
+static int place_fill_word(FPptr p, int s, int w) {
+    FillSlot *slot = &p->slots[s];
+    if (!save_domain(p, s)) {
+        p->failed = -1;
+        return 0;
+    }
+    memset(slot->domain, 0, slot->words->n_blocks * sizeof(Block));
+    slot->domain[w / BLOCK_BITS] = ((Block) 1) << (w % BLOCK_BITS);
+    slot->count = 1;
+    slot->assigned = w;
+    slot->level = p->depth;
+    enqueue_slot(p, s);
+    if (p->no_duplicates) {
+        memset(p->cause, 0, p->n_level_blocks * sizeof(Block));
+        add_level(p->cause, p->depth);
+        int t;
+        for (t = 0; t < p->n_slots; t++) {
+            if (t == s || p->slots[t].assigned != FILL_OPEN) continue;
+            if (p->slots[t].words != slot->words) continue;
+            if (!remove_fill_word(p, t, w, p->cause)) {
+                clear_queue(p);
+                return 0;
+            }
         }
     }
+    return propagate(p);
 }
 
-// 0 = false, 1 = true
-int is_intersecting(Slot *slot1, Slot *slot2) {
-    if (slot1->dir == slot2->dir) return 0;
-    if (slot1->dir == DIR_ACROSS) {
-        return (slot2->x >= slot1->x && slot2->x < slot1->x + slot1->length
-            && slot1->y >= slot2->y && slot1->y < slot2->y + slot2->length);
-    } else if (slot1->dir == DIR_DOWN) {
-        return (slot1->x >= slot2->x && slot1->x < slot2->x + slot2->length
-            && slot2->y >= slot1->y && slot2->y < slot1->y + slot1->length);
+// undo decisions after a slot has no words left, the words of the slot were
+// removed because of the decisions in its conflict set so the latest of
+// these decisions is changed and the decisions after it are skipped
+// (conflict-directed backjumping), 0 if there is no decision to change
+static int backjump(FPptr p) {
+    Block *conflict = p->conflict;
+    int from_slot = p->failed;
+    while (1) {
+        memset(conflict, 0, p->n_level_blocks * sizeof(Block));
+        int h;
+        if (from_slot >= 0) {
+            explain_slot(p, from_slot, conflict);
+        } else {
+            // without the cause the latest decision is changed
+            for (h = 1; h <= p->depth; h++) {
+                add_level(conflict, h);
+            }
+        }
+        for (h = p->depth; h > 0; h--) {
+            if (conflict[h / BLOCK_BITS] & (((Block) 1) << (h % BLOCK_BITS))) break;
+        }
+        if (h < p->depth) {
+            p->backjumps++;
+            p->skipped += p->depth - h;
+        }
+        if (h == 0) return 0;
+        FillDecision *d = &p->decisions[h - 1];
+        int i;
+        for (i = h - 1; i < p->depth; i++) {
+            p->slots[p->decisions[i].slot].assigned = FILL_OPEN;
+            p->slots[p->decisions[i].slot].level = 0;
+        }
+        undo_trail(p, d->mark);
+        p->stamp = d->stamp;
+        p->depth = h - 1;
+        // the word does not fit because of the other decisions of the conflict
+        conflict[h / BLOCK_BITS] &= ~(((Block) 1) << (h % BLOCK_BITS));
+        if (remove_fill_word(p, d->slot, d->word, conflict) && propagate(p)) return 1;
+        clear_queue(p);
+        from_slot = p->failed;
     }
-    return 0;
 }
 
-int is_valid(int x, int y, int width, int height) {
-    return x >= 0 && y >= 0 && x < width && y < height;
+// the open slot with the fewest words, ties are broken by the most open
+// crossing slots and then by the tie of the slot, which is its length
+// unless the problem is shuffled, -1 if all slots are filled
+static int select_fill_slot(FPptr p) {
+    int best = -1;
+    int best_count = 0;
+    int best_degree = 0;
+    int s;
+    for (s = 0; s < p->n_slots; s++) {
+        FillSlot *slot = &p->slots[s];
+        if (slot->assigned != FILL_OPEN) continue;
+        if (best >= 0 && slot->count > best_count) continue;
+        int degree = 0;
+        int a;
+        for (a = 0; a < slot->n_arcs; a++) {
+            if (p->slots[slot->arcs[a].slot].assigned == FILL_OPEN) degree++;
+        }
+        if (best >= 0 && slot->count == best_count) {
+            if (degree < best_degree) continue;
+            if (degree == best_degree && slot->tie <= p->slots[best].tie) continue;
+        }
+        best = s;
+        best_count = slot->count;
+        best_degree = degree;
+    }
+    return best;
 }
 
-int is_available(Cell *cgrid, int width, int height, int x, int y) {
-    if (!is_valid(x, y, width, height)) return 0;
-    int a0 = cgrid[x + y * width].block == 0;
-    int a1 = cgrid[x + y * width].empty == 0;
-    return a0 && a1;
+// the next number of a xorshift generator, the state must not be 0
+static unsigned int next_fill_random(unsigned int *state) {
+    unsigned int x = *state;
+    x ^= x << 13;
+    x ^= x >> 17;
+    x ^= x << 5;
+    *state = x;
+    return x;
 }
 
-char* get_constraints(Cell *cgrid, int width, int height, Slot *slot) {
-    // TODO reduce these malloc calls
-    //printf("Constraint search\n");
-    char* cs = PyMem_Malloc(slot->length * sizeof(char) + 1);
-    if (!cs) {
-        return NULL;
+// put the words of equal score in a random order and break the ties
+// between slots at random, a different seed gives a different search
+void shuffle_fill_problem(FPptr p, unsigned int seed) {
+    unsigned int state = seed * 2654435761u + 1;
+    if (!state) state = 1;
+    int length;
+    for (length = 0; length < MAX_WORD_LENGTH; length++) {
+        FWptr f = p->lengths[length];
+        if (!f) continue;
+        int start = 0;
+        while (start < f->n_words) {
+            int end = start + 1;
+            while (end < f->n_words && f->scores[f->order[end]] == f->scores[f->order[start]])
+                end++;
+            int w;
+            for (w = end - 1; w > start; w--) {
+                const int other = start + next_fill_random(&state) % (w - start + 1);
+                const int t = f->order[w];
+                f->order[w] = f->order[other];
+                f->order[other] = t;
+            }
+            start = end;
+        }
+    }
+    int s;
+    for (s = 0; s < p->n_slots; s++) {
+        p->slots[s].tie = next_fill_random(&state);
     }
-    get_constraints_i(cgrid, width, height, slot, cs);
-    return cs;
 }
 
-void get_constraints_i(Cell *cgrid, int width, int height, Slot *slot, char *cs) {
-    const int dx = slot->dir == DIR_ACROSS ? 1 : 0;
-    const int dy = slot->dir == DIR_DOWN ? 1 : 0;
-    int j;
-    for (j = 0; j < slot->length; j++) {
-        cs[j] = cgrid[(slot->x + j * dx) + (slot->y + j * dy) * width].c;
+// the word with the highest score that is still in the domain of the slot
+static int next_fill_word(FillSlot *slot) {
+    FWptr f = slot->words;
+    while (slot->cursor < f->n_words) {
+        const int w = f->order[slot->cursor];
+        if (slot->domain[w / BLOCK_BITS] & (((Block) 1) << (w % BLOCK_BITS)))
+            return w;
+        slot->cursor++;
     }
-    cs[slot->length] = '\0';
+    return -1;
 }
 
-int determine_count(PyObject *words, Cell *cgrid, int width, int height, Slot *slot) {
-    int prev = slot->count;
-    // TODO reduce these malloc calls
-    //printf("Constraint search\n");
-    char* cs = PyMem_Malloc(slot->length * sizeof(char) + 1);
-    if (!cs) {
-        return -1;
-    }
-    get_constraints_i(cgrid, width, height, slot, cs);
-    int count = count_words(words, slot->length, cs);
-    if (DEBUG && count == 0) {
-        printf("WARNING: slot (%i, %i, %i): from %i to %i\n", slot->x, slot->y, slot->dir, prev, count);
+// the value of the objective for the placed words, where each open slot
+// counts with the highest score that is still in its domain, which is an
+// upper bound of the value of every fill that extends the placed words
+static long fill_bound(FPptr p) {
+    long total = 0;
+    long minimum = LONG_MAX;
+    int s;
+    for (s = 0; s < p->n_slots; s++) {
+        FillSlot *slot = &p->slots[s];
+        int w = slot->assigned;
+        if (w == FILL_FIXED) continue;
+        if (w == FILL_OPEN) {
+            w = next_fill_word(slot);
+            if (w < 0) continue;
+        }
+        const int score = slot->words->scores[w];
+        total += score;
+        if (score < minimum) minimum = score;
     }
-    PyMem_Free(cs);
-    return count;
+    if (p->objective == FILL_OBJECTIVE_MINIMUM)
+        return minimum == LONG_MAX ? 0 : minimum;
+    return total;
 }
 
-// return = number of slots cleared
-int backtrack(PyObject *words, Cell *cgrid, int width, int height, Slot *slots, int n_slots, int* order, int n_done_slots, int index) {
-    //printf("Backtracking\n");
-    int cleared = 0;
+// the slots of the grid with the letters that are already in the cells,
+// the slots without empty cells are fixed, NULL if there is no memory
+FPptr new_fill_problem(PyObject *words, int width, int height, Slot *slots, int n_slots, int no_duplicates) {
+    FPptr p = PyMem_Malloc(sizeof(FillProblem));
+    if (!p) return NULL;
+    memset(p, 0, sizeof(FillProblem));
+    p->n_slots = n_slots;
+    p->no_duplicates = no_duplicates;
+    p->slots = PyMem_Malloc(n_slots * sizeof(FillSlot) + 1);
+    p->queue = PyMem_Malloc(2 * n_slots * sizeof(int) + 1);
+    p->decisions = PyMem_Malloc(n_slots * sizeof(FillDecision) + 1);
+    p->best = PyMem_Malloc(n_slots * sizeof(int) + 1);
+    if (!p->slots || !p->queue || !p->decisions || !p->best) {
+        free_fill_problem(p);
+        return NULL;
+    }
+    memset(p->slots, 0, n_slots * sizeof(FillSlot));
+    p->n_level_blocks = n_slots / BLOCK_BITS + 1;
+    p->conflict = PyMem_Malloc(p->n_level_blocks * sizeof(Block));
+    p->cause = PyMem_Malloc(p->n_level_blocks * sizeof(Block));
+    if (!p->conflict || !p->cause) {
+        free_fill_problem(p);
+        return NULL;
+    }
+    int max_blocks = 1;
     int s;
-    int iindex = -1;
-    /*for (s = n_done_slots; s >= 0; s--) {
-        //printf("Checking: %i %i %i with %i %i %i\n", slots[order[s]].x, slots[order[s]].y, slots[order[s]].dir, slots[order[index]].x, slots[order[index]].y, slots[order[index]].dir);
-        if (is_intersecting(&slots[order[s]], &slots[index])) {
-            iindex = s;
-            break;
+    for (s = 0; s < n_slots; s++) {
+        const int length = slots[s].length;
+        if (length <= 0 || length >= MAX_WORD_LENGTH) {
+            p->n_slots = s;
+            free_fill_problem(p);
+            return NULL;
         }
-    }*/
-    iindex = n_done_slots - 1;
-    if (iindex < 0) {
-        printf("No index found for %i %i %i !\n", slots[index].x, slots[index].y, slots[index].dir);
-        iindex = 0;
-    }
-    //printf("Backtracking %i %i\n", iindex, index);
-    if (iindex >= 0) {
-        if (0) {
-            printf("Blanking between (%i, %i, %s) and (%i, %i, %s)\n"
-                , (&slots[iindex])->x, (&slots[iindex])->y, (&slots[iindex])->dir == DIR_ACROSS ? "across" : "down"
-                , (&slots[index])->x, (&slots[index])->y, (&slots[index])->dir == DIR_ACROSS ? "across" : "down" );
-            printf("Indices: %i %i\n", iindex, index);
+        if (!p->lengths[length]) {
+            p->lengths[length] = new_fill_words(words, length);
+            if (!p->lengths[length]) {
+                p->n_slots = s;
+                free_fill_problem(p);
+                return NULL;
+            }
         }
-        for (s = n_done_slots; s >= iindex; s--) {
-            int blank = order[s];
-            if (blank < 0) {
-                // no word was actually filled in so skip
+        FWptr f = p->lengths[length];
+        FillSlot *slot = &p->slots[s];
+        slot->words = f;
+        slot->assigned = FILL_FIXED;
+        slot->stamp = -1;
+        slot->tie = length;
+        slot->domain = PyMem_Malloc(f->n_blocks * sizeof(Block) + 1);
+        slot->arcs = PyMem_Malloc(length * sizeof(FillArc) + 1);
+        slot->conflicts = PyMem_Malloc(p->n_level_blocks * sizeof(Block));
+        if (!slot->domain || !slot->arcs || !slot->conflicts) {
+            p->n_slots = s + 1;
+            free_fill_problem(p);
+            return NULL;
+        }
+        memset(slot->conflicts, 0, p->n_level_blocks * sizeof(Block));
+        if (f->n_blocks > max_blocks) max_blocks = f->n_blocks;
+        // all words, then only those with the letters in the cells
+        memset(slot->domain, 0xff, f->n_blocks * sizeof(Block));
+        if (f->n_words % BLOCK_BITS != 0) {
+            slot->domain[f->n_blocks - 1] = (((Block) 1) << (f->n_words % BLOCK_BITS)) - 1;
+        }
+        int j;
+        for (j = 0; j < length; j++) {
+            const char c = tolower(slots[s].cs[j]);
+            if (c == CONSTRAINT_EMPTY) {
+                slot->assigned = FILL_OPEN;
                 continue;
             }
-            Slot *bslot = &slots[blank];
-            //printf("About to clear: (%i, %i, %s)\n", bslot->x, bslot->y, bslot->dir == DIR_ACROSS ? "across" : "down");
-            cleared++;
-            clear_slot(cgrid, width, height, slots, n_slots, blank);
-            bslot->count = determine_count(words, cgrid, width, height, bslot);
-            bslot->done = 0;
-            if (s > iindex) bslot->offset = 0;
-            if (s == iindex) {
-                bslot->offset++;
-                if (bslot->offset == bslot->count && iindex > 0) {
-                    // if we exhaused all words, backtrack one more
-                    bslot->offset = 0;
-                    iindex -= 1;
+            int b;
+            if (c < 'a' || c > 'z') {
+                memset(slot->domain, 0, f->n_blocks * sizeof(Block));
+            } else {
+                Block *bits = fill_bits(f, j, c - 'a');
+                for (b = 0; b < f->n_blocks; b++) {
+                    slot->domain[b] &= bits[b];
                 }
             }
         }
+        int b;
+        for (b = 0; b < f->n_blocks; b++) {
+            slot->count += count_bits(slot->domain[b]);
+        }
     }
-    return cleared;
-}
-
-PyObject* gather_fill(Cell *cgrid, int width, int height) {
-    int x;
-    int y;
-    PyObject *fill = PyList_New(0);
-    for (y = 0; y < height; y++) {
-        for (x = 0; x < width; x++) {
-            Cell *cell = &cgrid[x + y * width];
-            if (cell->fixed == 1 || cell->c == CONSTRAINT_EMPTY) continue;
-            char cell_c[2];
-            cell_c[0] = toupper(cell->c);
-            cell_c[1] = '\0';
-            PyList_Append(fill, Py_BuildValue("(iis)", x, y, cell_c));
+    // the open slot of each direction that contains each cell
+    p->work = PyMem_Malloc(max_blocks * sizeof(Block));
+    int *cells = PyMem_Malloc(2 * width * height * sizeof(int) + 1);
+    if (!p->work || !cells) {
+        PyMem_Free(cells);
+        free_fill_problem(p);
+        return NULL;
+    }
+    int i;
+    for (i = 0; i < 2 * width * height; i++) {
+        cells[i] = -1;
+    }
+    for (s = 0; s < n_slots; s++) {
+        if (p->slots[s].assigned != FILL_OPEN) continue;
+        const int dx = slots[s].dir == DIR_ACROSS ? 1 : 0;
+        const int dy = slots[s].dir == DIR_DOWN ? 1 : 0;
+        int j;
+        for (j = 0; j < slots[s].length; j++) {
+            const int cx = slots[s].x + j * dx;
+            const int cy = slots[s].y + j * dy;
+            if (!is_valid(cx, cy, width, height)) continue;
+            cells[2 * (cx + cy * width) + slots[s].dir] = s;
         }
     }
-    return fill;
-}
-
-inline int find_initial_slot(Slot *slots, int n_slots, int option_start) {
-    int index = -1;
-    if (option_start == FILL_START_AT_ZERO) {
-        index = 0;
-    } else if (option_start == FILL_START_AT_SELECTION) {
-        // TODO
-    } else if (option_start == FILL_START_AT_AUTO) {
-        // find most-constrained slot that is not done and has at least one possible word
-        int m;
-        for (m = 0; m < n_slots; m++) {
-            if (!slots[m].done && slots[m].count > 0) {
-                index = m;
-                break;
-            }
+    for (s = 0; s < n_slots; s++) {
+        if (p->slots[s].assigned != FILL_OPEN) continue;
+        const int dx = slots[s].dir == DIR_ACROSS ? 1 : 0;
+        const int dy = slots[s].dir == DIR_DOWN ? 1 : 0;
+        int j;
+        for (j = 0; j < slots[s].length; j++) {
+            const int cx = slots[s].x + j * dx;
+            const int cy = slots[s].y + j * dy;
+            if (!is_valid(cx, cy, width, height)) continue;
+            const int t = cells[2 * (cx + cy * width) + 1 - slots[s].dir];
+            if (t < 0 || t == s) continue;
+            FillArc *arc = &p->slots[s].arcs[p->slots[s].n_arcs++];
+            arc->slot = t;
+            arc->pos = j;
+            arc->other_pos = slots[t].dir == DIR_ACROSS ? cx - slots[t].x : cy - slots[t].y;
         }
-        for (m = 0; m < n_slots; m++) {
-            if (slots[m].count == 0) continue;
-            if (slots[m].count < slots[index].count && !slots[m].done) {
-                index = m;
+    }
+    PyMem_Free(cells);
+    if (no_duplicates) {
+        // the words of the fixed slots can not be placed again
+        for (s = 0; s < n_slots; s++) {
+            if (p->slots[s].assigned != FILL_FIXED) continue;
+            char word[MAX_WORD_LENGTH];
+            int j;
+            for (j = 0; j < slots[s].length; j++) {
+                word[j] = tolower(slots[s].cs[j]);
+            }
+            const int w = find_fill_word(p->slots[s].words, word);
+            if (w < 0) continue;
+            int t;
+            for (t = 0; t < n_slots; t++) {
+                FillSlot *slot = &p->slots[t];
+                if (slot->assigned != FILL_OPEN || slot->words != p->slots[s].words) continue;
+                const Block bit = ((Block) 1) << (w % BLOCK_BITS);
+                if (slot->domain[w / BLOCK_BITS] & bit) {
+                    slot->domain[w / BLOCK_BITS] &= ~bit;
+                    slot->count--;
+                }
             }
         }
     }
-    return index;
+    return p;
 }
 
-inline int find_slot(Slot *slots, int n_slots, int* order) {
-    // find most-constrained slot that is connected to a previously filled in slot
-    int index = -1;
-    int o;
-    for (o = 0; o < n_slots; o++) {
-        if (order[o] < 0) break;
-        int l;
-        for (l = 0; l < slots[order[o]].length; l++) {
-            int m;
-            for (m = 0; m < n_slots; m++) {
-                if (order[o] == m) continue;
-                if (slots[m].done) continue;
-                if (is_intersecting(&slots[order[o]], &slots[m])) {
-                    if (slots[order[o]].dir == DIR_ACROSS && (slots[m].x - slots[order[o]].x == l)) {
-                        index = m;
-                        break;
-                    } else if (slots[order[o]].dir == DIR_DOWN && (slots[m].y - slots[order[o]].y == l)) {
-                        index = m;
-                        break;
-                    }
+// search a word for each open slot, FILL_RESULT_FOUND if all slots are
+// filled and FILL_RESULT_EXHAUSTED if there is no such fill, the search
+// is paused with FILL_RESULT_PAUSED after trying the given number of
+// words and it continues where it was paused when this is called again,
+// the best partial fill is kept in p->best, the GIL is not needed
+//
+// with an objective, a complete fill becomes the incumbent in p->best if
+// it is better than the previous one and the search goes on until it is
+// exhausted, which proves that the incumbent is optimal, the placed words
+// are abandoned as soon as their bound is no better than the incumbent
+// (branch and bound)
+int fill_search(FPptr p, long steps) {
+    int s;
+    if (!p->started) {
+        p->started = 1;
+        for (s = 0; s < p->n_slots; s++) {
+            p->best[s] = p->slots[s].assigned;
+        }
+        for (s = 0; s < p->n_slots; s++) {
+            if (p->slots[s].assigned == FILL_OPEN) {
+                enqueue_slot(p, s);
+                if (p->slots[s].count == 0) {
+                    clear_queue(p);
+                    return FILL_RESULT_EXHAUSTED;
                 }
             }
-            if (index >= 0) break;
         }
-        if (index >= 0) break;
-    }
-    return index;
-}
-
-inline int find_nice_slot(PyObject *words, Slot *slots, int n_slots, int width, int height, int* order) {
-    // compute lengths of provided words and lengths of actually filled in words
-    int lengths[MAX_WORD_LENGTH];
-    int a_lengths[MAX_WORD_LENGTH];
-    int t;
-    for (t = 0; t < MAX_WORD_LENGTH; t++) {
-        lengths[t] = 0;
-        a_lengths[t] = 0;
-    }
-    for (t = 0; t < MAX_WORD_LENGTH; t++) {
-        PyObject *key = Py_BuildValue("i", t);
-        PyObject *l_words = PyDict_GetItem(words, key);
-        lengths[t] += PyList_Size(l_words);
-    }
-    for (t = 0; t < n_slots; t++) {
-        int i = order[t];
-        if (i < 0) break;
-        a_lengths[slots[i].length]++;
+        if (!propagate(p)) return FILL_RESULT_EXHAUSTED;
     }
-    // find index of a possible symmetrical slot
-    for (t = 0; t < n_slots; t++) {
-        int i = order[t];
-        if (i < 0) break;
-        int x = slots[i].x;
-        int y = slots[i].y;
-        int dir = slots[i].dir;
-        int length = slots[i].length;
-        int s;
-        for (s = 0; s < n_slots; s++) {
-            if (s == t) continue;
-            int symm_x = width - x - (dir == DIR_ACROSS ? length : 0) - (dir == DIR_DOWN ? 1 : 0);
-            int symm_y = height - y - (dir == DIR_DOWN ? length : 0) - (dir == DIR_ACROSS ? 1 : 0);
-            if ((slots[s].x == symm_x)
-                && (slots[s].y == symm_y)
-                && slots[s].dir == dir
-                && slots[s].length == length
-                && !slots[s].done
-                //&& slots[s].count > 0
-                && a_lengths[length] < lengths[length]) {
-                return s;
+    while (1) {
+        const int s = select_fill_slot(p);
+        if (s < 0 && p->objective == FILL_OBJECTIVE_NONE) return FILL_RESULT_FOUND;
+        if (s < 0) {
+            const long value = fill_bound(p);
+            if (!p->has_incumbent || value > p->incumbent) {
+                p->has_incumbent = 1;
+                p->incumbent = value;
+                int t;
+                for (t = 0; t < p->n_slots; t++) {
+                    p->best[t] = p->slots[t].assigned;
+                }
             }
+            p->failed = -1;
+            if (!backjump(p)) return FILL_RESULT_EXHAUSTED;
+            continue;
         }
-    }
-    // find "nicest" slot (= close to center and preferably across)
-    int c_x = width / 2;
-    int c_y = height / 2;
-    int index = -1;
-    int score = 1000 * (width + height);
-    for (t = 0; t < n_slots; t++) {
-        int l = slots[t].length;
-        //printf("%i %i %i | %i %i\n", slots[t].x, slots[t].y, slots[t].dir, slots[t].done, slots[t].count);
-        if (!slots[t].done && /*slots[t].count > 0 &&*/ a_lengths[l] < lengths[l]) {
-            int s_x = slots[t].x - c_x;
-            int s_y = slots[t].y - c_y;
-            int s_score = (s_x >= 0 ? s_x : -1 * s_x) + (s_y >= 0 ? s_y : -1 * s_y) + (slots[t].dir == DIR_DOWN ? 5 : 0);
-            if (s_score < score) {
-                //printf("Score: %i %i\n", s_score, score);
-                index = t;
-                score = s_score;
+        if (steps-- <= 0) return FILL_RESULT_PAUSED;
+        if (p->has_incumbent && fill_bound(p) <= p->incumbent) {
+            p->failed = -1;
+            if (!backjump(p)) return FILL_RESULT_EXHAUSTED;
+            continue;
+        }
+        FillSlot *slot = &p->slots[s];
+        const int w = next_fill_word(slot);
+        if (w < 0) {
+            p->failed = s;
+            if (!backjump(p)) return FILL_RESULT_EXHAUSTED;
+            continue;
+        }
+        FillDecision *d = &p->decisions[p->depth++];
+        d->slot = s;
+        d->word = w;
+        d->mark = p->n_trail;
+        d->stamp = p->stamp;
+        p->stamp = ++p->n_stamps;
+        p->nodes++;
+        int ok = place_fill_word(p, s, w);
+        // the placed words agree with each other, even if an open slot
+        // has no words left, so they form the best partial fill so far
+        if (!p->has_incumbent && p->depth > p->best_depth) {
+            p->best_depth = p->depth;
+            int t;
+            for (t = 0; t < p->n_slots; t++) {
+                p->best[t] = p->slots[t].assigned;
             }
         }
+        if (!ok && !backjump(p)) return FILL_RESULT_EXHAUSTED;
+    }
+}
+
+// write the placed words of assigned, one word position per slot,
+// into the cells of the grid
+void apply_fill(FPptr p, int *assigned, Cell *cgrid, int width, Slot *slots) {
+    int s;
+    for (s = 0; s < p->n_slots; s++) {
+        if (assigned[s] < 0) continue;
+        FWptr f = p->slots[s].words;
+        const char *word = f->words + assigned[s] * f->length;
+        const int dx = slots[s].dir == DIR_ACROSS ? 1 : 0;
+        const int dy = slots[s].dir == DIR_DOWN ? 1 : 0;
+        int j;
+        for (j = 0; j < f->length; j++) {
+            cgrid[(slots[s].x + j * dx) + (slots[s].y + j * dy) * width].c = word[j];
+        }
     }
-    return index;
 }
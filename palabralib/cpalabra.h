@@ -17,9 +17,31 @@
 #define FILL_NICE_FALSE 0
 #define FILL_NICE_TRUE 1
 
+#define FILL_ENGINE_GREEDY 0
+#define FILL_ENGINE_PROPAGATE 1
+
+// what the propagating fill engine maximises: nothing, the sum or the
+// minimum of the scores of the words that it places
+#define FILL_OBJECTIVE_NONE 0
+#define FILL_OBJECTIVE_TOTAL 1
+#define FILL_OBJECTIVE_MINIMUM 2
+
+// the number of attempts of the greedy fill engine and the number of words
+// that the propagating fill engine tries, unless another budget is given
+#define FILL_MAX_ATTEMPTS 1000
+#define FILL_MAX_NODES 100000
+
+// the result of a part of the search of the propagating fill engine
+#define FILL_RESULT_EXHAUSTED 0
+#define FILL_RESULT_FOUND 1
+#define FILL_RESULT_PAUSED 2
+
 #define DIR_ACROSS 0
 #define DIR_DOWN 1
 
+#define SEARCH_ENGINE_TREE 0
+#define SEARCH_ENGINE_BITSET 1
+
 typedef struct tnode *Tptr;
 typedef struct tnode {
     char splitchar;
@@ -28,12 +50,177 @@ typedef struct tnode {
     Tptr lokid, eqkid, hikid;
 } Tnode;
 
+// memory for the nodes and words of one tree, released all at once,
+// each block is followed by size bytes of which used bytes are taken
+typedef struct ablock *ABptr;
+typedef struct ablock {
+    ABptr next; // the previously filled block
+    size_t size;
+    size_t used;
+} ArenaBlock;
+
+// a word to insert into a tree
+typedef struct wentry {
+    char *word;
+    int score;
+    int seq; // position in the input, occurrences of a word keep this order
+} WordEntry;
+
+// the words of one length that are read from a word list file
+typedef struct {
+    char *words; // n_words words of length + 1 chars, each ends with '\0'
+    int *scores;
+    int n_words;
+    int size; // number of words for which there is room
+} LoadedWords;
+
+// words of one length of a word list, stored contiguously in alphabetical order
+typedef struct wtable *WTptr;
+typedef struct wtable {
+    int length;
+    int n_words;
+    char *words; // n_words * length chars, the words are not terminated
+    int *scores;
+    PyObject *owner; // object that owns the memory of words and scores
+} WordTable;
+
+// words of one length of a word list with, for each position and character,
+// a bitset of the words that have that character at that position
+typedef unsigned long long Block;
+#define BLOCK_BITS 64
+
+static inline int count_bits(Block x) {
+#ifdef __GNUC__
+    return __builtin_popcountll(x);
+#else
+    int n = 0;
+    for (; x; x &= x - 1) n++;
+    return n;
+#endif
+}
+
+static inline int lowest_bit(Block x) {
+#ifdef __GNUC__
+    return __builtin_ctzll(x);
+#else
+    int n = 0;
+    while (!(x & 1)) {
+        x >>= 1;
+        n++;
+    }
+    return n;
+#endif
+}
+
+typedef struct bindex *BIptr;
+typedef struct bindex {
+    int length;
+    int n_words;
+    int n_blocks; // number of blocks in each bitset
+    char *words; // n_words * length chars, in the order of the tree or table
+    int *scores;
+    Block **bits; // length * 256 bitsets, NULL if no word has the character
+    int mask_score; // minimum score of the cached score mask
+    Block *mask; // words with score >= mask_score, NULL if not computed
+    int *by_score; // positions of the words by decreasing score, NULL if not computed
+    unsigned char *letters; // LETTER_SLOTS letter counts per word, NULL if not computed
+    int n_buckets; // number of buckets of the anagram table, a power of two
+    int *anagrams; // first word of each bucket of words with the same hash of letters
+    int *next_anagram; // next word in the same bucket, -1 at the end
+} BitsetIndex;
+
+// the letters of a word are counted regardless of case, in a vector
+// of LETTER_SLOTS counts so that words can be compared slot by slot,
+// the letters a-z have the slots 1 to 26 and all other characters slot 0
+#define LETTER_SLOTS 32
+
+static inline int letter_slot(char c) {
+    const char lower = c | 0x20;
+    return lower >= 'a' && lower <= 'z' ? lower - 'a' + 1 : 0;
+}
+
+// 1 if each letter count of have is at least the letter count of need
+static inline int contains_letters(const unsigned char *have, const unsigned char *need) {
+    int ok = 1;
+    int c;
+    for (c = 0; c < LETTER_SLOTS; c++) {
+        ok &= have[c] >= need[c];
+    }
+    return ok;
+}
+
+// a word found by a search in several word lists
+typedef struct match {
+    char *word; // not NUL-terminated
+    int length; // of the word, so that sorting needs no shared state
+    int score;
+    int list; // position of the word list in the searched lists
+    int pos; // position of the word in its word list
+    int valid; // whether each position has an intersecting word
+} Match;
+
+// a set of word lists, one bit per index
+typedef unsigned long long ListMask;
+#define LIST_BIT(index) (((ListMask) 1) << (index))
+
+// the distinct words of one length of all merged word lists with, for each
+// word, the lists that contain it and its occurrences in these lists,
+// occurrences are ordered by list and then by their order in the list
+typedef struct mindex *MIptr;
+typedef struct mindex {
+    WordTable table; // the distinct words in sorted order, without scores
+    ListMask *masks; // for each word, the word lists that contain it
+    int *starts; // for each word, its first occurrence (n_words + 1 items)
+    int *lists; // for each occurrence, the index of its word list
+    int *scores; // for each occurrence, its score
+    BIptr bits; // bitsets of the distinct words, NULL if not computed
+} MergedIndex;
+
+// a multi-pattern (Aho-Corasick) automaton of the words of all lengths of
+// a word list, to find the words that occur in a string in one pass,
+// the states are numbered breadth first so that the children of a state
+// are consecutive states, ordered by their character
+typedef struct wautomaton *WAptr;
+typedef struct wautomaton {
+    int n_states;
+    int *first_child; // first child of each state (n_states + 1 items)
+    unsigned char *chars; // the character that leads to each state
+    unsigned char *depth; // the length of the prefix of each state
+    char *is_word; // whether the prefix of each state is a word
+    int *fail; // the state of the longest proper suffix of each state
+    int *output; // the nearest state on the fail chain that is a word, -1 if none
+} WordAutomaton;
+
 typedef struct sresult *Sptr;
 typedef struct sresult {
     int n_matches;
     char *chars;
+    int refs; // number of owners, including the analysis cache
 } SearchResult;
 
+// the analysis of an intersecting slot, kept for later searches
+#define ANALYSIS_CACHE_SIZE 512
+#define ANALYSIS_CACHE_BUCKETS 1024
+typedef struct aentry *AEptr;
+typedef struct aentry {
+    unsigned long hash;
+    ListMask lists; // the merged lists that were analyzed, 0 for one list
+    int offset;
+    int min_score;
+    char *cs;
+    Sptr result;
+    AEptr next; // next entry in the same bucket
+    AEptr newer, older; // neighbours in order of use
+} AnalysisEntry;
+
+// the analyses of one word list, or of merged word lists, the least
+// recently used analysis is dropped when the cache is full
+typedef struct acache {
+    AEptr buckets[ANALYSIS_CACHE_BUCKETS];
+    AEptr newest, oldest;
+    int n_entries;
+} AnalysisCache;
+
 typedef struct sparams *SPPtr;
 typedef struct sparams {
     int offset;
@@ -66,11 +253,115 @@ typedef struct Slot {
     int done; // {0, 1}
     Py_ssize_t offset;
     PyObject *words;
+    char **candidates; // the strings of words, read before a greedy fill
+    Py_ssize_t n_candidates;
     char *cs;
 } Slot;
 
-extern void update_score(Tptr p, char *s, int score);
-extern PyObject *find_matches_i(int index, char *s);
+// the words of each length that the greedy fill engine counts, read from
+// the lists of (word, score) before the fill so that it runs without the GIL
+typedef struct {
+    PyObject *items[MAX_WORD_LENGTH]; // tuples of the items, which keep the words alive
+    char **words[MAX_WORD_LENGTH];
+    Py_ssize_t n_words[MAX_WORD_LENGTH];
+} GreedyWords;
+
+// the words of one length that the propagating fill engine chooses from,
+// in alphabetical order without duplicates, with for each position and
+// letter the bitset of the words that have that letter at that position
+#define FILL_LETTERS 26
+typedef struct fwords *FWptr;
+typedef struct fwords {
+    int length;
+    int n_words;
+    int n_blocks;
+    char *words; // n_words * length chars, the words are not terminated
+    int *scores; // the highest score of each word
+    int *order; // positions of the words by decreasing score
+    Block *bits; // length * FILL_LETTERS bitsets of n_blocks blocks
+} FillWords;
+
+// a slot that crosses a slot of the propagating fill engine
+typedef struct {
+    int slot;
+    int pos; // position of the shared cell in the slot that has the arc
+    int other_pos; // position of the shared cell in the crossing slot
+} FillArc;
+
+#define FILL_OPEN -1
+#define FILL_FIXED -2
+
+typedef struct fslot {
+    FWptr words;
+    Block *domain; // the words that can still be placed in the slot
+    int count; // number of words in the domain
+    int cursor; // the words before this position of words->order are not in the domain
+    int assigned; // position of the placed word, FILL_OPEN or FILL_FIXED
+    int level; // the decision that placed the word, 0 if it is not placed
+    Block *conflicts; // the decisions because of which words were removed from the domain
+    int stamp; // decision at which the domain was last saved on the trail
+    int n_arcs;
+    FillArc *arcs;
+    int queued; // {0,1}
+    unsigned int tie; // the larger one is selected between otherwise equal slots
+} FillSlot;
+
+// the domain of a slot before it was changed, restored when backtracking
+typedef struct {
+    int slot;
+    int count;
+    int cursor;
+    int stamp;
+    Block *domain; // followed by the conflicts of the slot
+} FillTrailEntry;
+
+// a word placed in a slot by the propagating fill engine
+typedef struct {
+    int slot;
+    int word;
+    int mark; // size of the trail before the word was placed
+    int stamp; // the decision that was current before the word was placed
+} FillDecision;
+
+// the slots of a grid as a constraint satisfaction problem, each open slot
+// keeps the words that are consistent with the crossing slots (arc
+// consistency), the slot with the fewest words is filled first, the
+// decisions are numbered from 1 and sets of decisions are bitsets
+typedef struct fproblem *FPptr;
+typedef struct fproblem {
+    int n_slots;
+    FillSlot *slots;
+    FWptr lengths[MAX_WORD_LENGTH];
+    int no_duplicates; // {0,1} whether a word may be placed only once
+    Block *work; // a bitset for the largest number of blocks
+    int n_level_blocks; // number of blocks in each set of decisions
+    Block *conflict; // the decisions that caused the last dead end
+    Block *cause; // a set of decisions to explain the removal of a word
+    int failed; // the slot that has no words left, -1 if unknown
+    int *queue;
+    int n_queued;
+    FillTrailEntry *trail;
+    int n_trail;
+    int trail_size;
+    FillDecision *decisions;
+    int depth;
+    int stamp; // the current decision, unique for each decision
+    int n_stamps;
+    int started; // {0,1} whether the slots have been made arc consistent
+    long nodes; // the number of words that were placed
+    long backjumps; // the dead ends after which decisions were skipped
+    long skipped; // the decisions that were skipped by backjumping
+    int best_depth; // the most words placed at the same time
+    int *best; // the words of the slots when best_depth was reached
+    int objective; // FILL_OBJECTIVE_NONE, FILL_OBJECTIVE_TOTAL or FILL_OBJECTIVE_MINIMUM
+    int has_incumbent; // {0,1} whether best is a complete fill of the objective
+    long incumbent; // the value of the objective for the incumbent
+} FillProblem;
+
+extern void update_score(Tptr p, char *s, int old_score, int score);
+extern int remove_word(Tptr *p, char *s, int score);
+extern void change_scores(Tptr p, int by, int value);
+extern void set_scores(Tptr p, char *s, int score);
 extern void check_intersect(char *word, char **cs, int length, Sptr *results, int is_char_ok[MAX_WORD_LENGTH]);
 extern PyObject* find_matches(PyObject *list, Tptr p, char *s);
 extern char* find_candidate(char **cs_i, Sptr *results, Slot *slot, char *cs, int option_nice, int offset);
@@ -78,14 +369,21 @@ extern int process_constraints(PyObject* constraints, char *cs);
 extern int check_constraints(char *word, char *cs);
 extern int is_intersecting_equal(IntersectingSlot s0, IntersectingSlot s1);
 extern void print(Tptr p, int indent);
-extern Tptr insert1(Tptr p, char *s, char *word, int score);
+extern void* arena_alloc(ABptr *arena, size_t n, size_t align);
+extern Tptr insert1(ABptr *arena, Tptr p, char *s, char *word, int score);
+extern int insert_tree_word(ABptr *arena, Tptr *root, int length, char *word, int score);
+extern int insert_tree_words(ABptr *arena, Tptr *root, int length, WordEntry *entries, int n_entries, int sorted);
+extern int insert_words(int index, int length, WordEntry *entries, int n_entries, int sorted);
 extern int analyze(int offset, Sptr result, Tptr p, char *s, char *cs, int min_score);
-extern Sptr analyze_intersect_slot(int offset, char *cs, int index, int min_score);
-extern void analyze_intersect_slot2(Sptr *results, int *skipped, int *offsets, char **cs, int length, int index, int min_score);
-extern void free_tree(Tptr p);
+extern void free_search_result(Sptr result);
+extern void clear_analysis_cache(int index);
+extern Sptr analyze_intersect_slot(int offset, char *cs, int index, int min_score, int engine);
+extern void analyze_intersect_slot2(Sptr *results, int *skipped, int *offsets, char **cs, int length, int index, int min_score, int engine);
+extern void free_arena(ABptr b);
+extern void free_tree(int index, int length);
 extern int calc_is_available(PyObject *grid, int x, int y);
 extern int calc_is_start_word(PyObject *grid, int x, int y);
-extern int count_words(PyObject *words, int length, char *cs);
+extern int count_words(GreedyWords *words, int length, char *cs);
 extern int get_slot_index(Slot *slots, int n_slots, int x, int y, int dir);
 extern int can_clear_char(Cell *cgrid, int width, int height, Slot slot);
 extern void clear_slot(Cell *cgrid, int width, int height, Slot *slots, int n_slots, int index);
@@ -94,12 +392,56 @@ extern int is_valid(int x, int y, int width, int height);
 extern int is_available(Cell *cgrid, int width, int height, int x, int y);
 extern char* get_constraints(Cell *cgrid, int width, int height, Slot *slot);
 extern void get_constraints_i(Cell *cgrid, int width, int height, Slot *slot, char *cs);
-extern int determine_count(PyObject *words, Cell *cgrid, int width, int height, Slot *slot);
-extern int backtrack(PyObject *words, Cell *cgrid, int width, int height, Slot *slots, int n_slots, int* order, int n_done_slots, int index);
+extern int determine_count(GreedyWords *words, Cell *cgrid, int width, int height, Slot *slot);
+extern int backtrack(GreedyWords *words, Cell *cgrid, int width, int height, Slot *slots, int n_slots, int* order, int n_done_slots, int index);
 extern PyObject* gather_fill(Cell *cgrid, int width, int height);
 extern int find_initial_slot(Slot *slots, int n_slots, int option_start);
 extern int find_slot(Slot *slots, int n_slots, int* order);
-extern int find_nice_slot(PyObject *words, Slot *slots, int n_slots, int width, int height, int* order);
-extern void c_insert_word(int index, int length, char *word, int score);
+extern int find_nice_slot(GreedyWords *words, Slot *slots, int n_slots, int width, int height, int* order);
+extern int c_insert_word(int index, int length, char *word, int score);
+extern int table_range(WTptr t, char *s, int *start, int *end);
+extern PyObject* find_matches_table(PyObject *list, WTptr t, char *s);
+extern PyObject* find_matches_index(PyObject *list, int index, int length, char *s);
+extern int analyze_table(int offset, Sptr result, WTptr t, char *cs, int min_score);
+extern void update_score_table(WTptr t, char *s, int old_score, int score);
+extern void change_scores_table(WTptr t, int by, int value);
+extern void set_scores_table(WTptr t, char *s, int score);
+extern int thaw_table(int index, int length);
+extern void free_table(WTptr t);
+extern int count_list_words(int index, int length);
+extern int parse_wordlist(const char *start, const char *end, int default_score, LoadedWords *loaded);
+extern int append_loaded_words(LoadedWords *loaded, LoadedWords *other, int length);
+extern void free_loaded_words(LoadedWords *loaded);
+extern int sorted_scores(int index, int length, int **scores);
+extern BIptr get_bitset_index(int index, int length);
+extern void free_bitset_index(BIptr b);
+extern void clear_bitset_index(int index, int length);
+extern int bitset_query(BIptr b, char *s, int min_score, Block *result);
+extern PyObject* find_matches_bitset(PyObject *list, BIptr b, char *s);
+extern int* get_score_order(BIptr b);
+extern int find_top_matches(BIptr b, char *s, int min_score, int limit, int order_by_score, int list, Match **matches, int *total);
+extern void sort_matches(Match *matches, int n_matches, int order_by_score);
+extern int analyze_bitset(int offset, Sptr result, BIptr b, char *cs, int min_score);
+extern int count_letters(const char *word, int length, unsigned char *counts);
+extern int prepare_anagrams(BIptr b);
+extern int first_anagram(BIptr b, const unsigned char *counts);
+extern int next_anagram(BIptr b, int w, const unsigned char *counts);
+extern int find_containing_words(BIptr b, const unsigned char *need, int limit, int *positions);
+extern void merge_wordlist(int index);
+extern void unmerge_wordlist(int index);
+extern void mark_merged_stale(int index, int length);
+extern MIptr get_merged_index(int length);
+extern void free_merged_index(MIptr m);
+extern int merged_query(MIptr m, char *s, int engine, Block *result);
+extern int merged_has_word(MIptr m, int w, ListMask lists, int min_score);
+extern Sptr analyze_merged(int offset, char *cs, ListMask lists, int min_score, int engine);
+extern WAptr get_word_automaton(int index);
+extern void clear_word_automaton(int index);
+extern FPptr new_fill_problem(PyObject *words, int width, int height, Slot *slots, int n_slots, int no_duplicates);
+extern void free_fill_problem(FPptr p);
+extern void shuffle_fill_problem(FPptr p, unsigned int seed);
+extern int fill_search(FPptr p, long steps);
+extern void apply_fill(FPptr p, int *assigned, Cell *cgrid, int width, Slot *slots);
+extern int scan_words(WAptr a, const char *s, int length, int *found);
 
 #endif
@@ -17,9 +17,426 @@
 */
 
 #include <Python.h>
+#include <errno.h>
+#include <sys/stat.h>
+#include <sys/time.h>
 #include "cpalabra.h"
+#include "pythread.h"
 
 extern Tptr trees[MAX_WORD_LISTS + 1][MAX_WORD_LENGTH];
+extern ABptr arenas[MAX_WORD_LISTS + 1][MAX_WORD_LENGTH];
+extern WTptr tables[MAX_WORD_LISTS + 1][MAX_WORD_LENGTH];
+extern BIptr bitsets[MAX_WORD_LISTS + 1][MAX_WORD_LENGTH];
+extern MIptr merged[MAX_WORD_LENGTH];
+extern WAptr automata[MAX_WORD_LISTS + 1];
+extern ListMask merged_lists;
+extern ListMask merged_stale[MAX_WORD_LENGTH];
+
+// read an integer option from the options dict, default if it is not given
+static int
+get_int_option(PyObject *options, char *key, int value) {
+    if (options == Py_None) return value;
+    PyObject *item = PyDict_GetItemString(options, key);
+    if (item == NULL || item == Py_None) return value;
+    return (int) PyInt_AsLong(item);
+}
+
+// the searches and the changes of the word lists are serialized with this
+// lock, a search in a worker thread holds it while the GIL is released
+static PyThread_type_lock index_lock = NULL;
+
+// the generation of the newest search, older searches are abandoned
+static volatile long search_generation = 0;
+
+// the load generation of each word list index, which changes whenever the
+// words of the index are replaced so a word list can tell whether the
+// index still has its words
+static long index_generations[MAX_WORD_LISTS + 1];
+static long last_index_generation = 0;
+
+static void
+new_index_generation(int index) {
+    index_generations[index] = ++last_index_generation;
+}
+
+// acquire the index lock, without blocking other threads while waiting
+static void
+lock_index(void) {
+    if (!PyThread_acquire_lock(index_lock, NOWAIT_LOCK)) {
+        Py_BEGIN_ALLOW_THREADS
+        PyThread_acquire_lock(index_lock, WAIT_LOCK);
+        Py_END_ALLOW_THREADS
+    }
+}
+
+static void
+unlock_index(void) {
+    PyThread_release_lock(index_lock);
+}
+
+// 1 if a newer search has been started than the search of this generation,
+// a generation < 0 means the search cannot be superseded
+static int
+is_superseded(long generation) {
+    return generation >= 0 && generation != search_generation;
+}
+
+// define a function that calls the given function with the index lock held
+#define WITH_INDEX_LOCK(name) \
+    static PyObject* \
+    name##_locked(PyObject *self, PyObject *args) { \
+        lock_index(); \
+        PyObject *result = name(self, args); \
+        unlock_index(); \
+        return result; \
+    }
+
+// search the given lists with a single traversal of the merged index,
+// the result is the same as the search in each list sorted by word
+static PyObject*
+search_merged(int length, char *cons_str, PyObject *indices, ListMask lists
+    , int has_more, int *offsets, char **cs, int min_score, int engine) {
+    Sptr results[length];
+    int t;
+    if (has_more) {
+        for (t = 0; t < length; t++) {
+            results[t] = analyze_merged(offsets[t], cs[t], lists, min_score, engine);
+        }
+    }
+    PyObject *result = PyList_New(0);
+    MIptr m = get_merged_index(length);
+    const int n_blocks = m ? (m->table.n_words + BLOCK_BITS - 1) / BLOCK_BITS : 0;
+    Block *matches = n_blocks > 0 ? PyMem_Malloc(n_blocks * sizeof(Block)) : NULL;
+    if (matches && merged_query(m, cons_str, engine, matches) > 0) {
+        const Py_ssize_t n_indices = PyList_Size(indices);
+        int k;
+        for (k = 0; k < n_blocks; k++) {
+            Block x;
+            for (x = matches[k]; x; x &= x - 1) {
+                const int w = k * BLOCK_BITS + lowest_bit(x);
+                if (!(m->masks[w] & lists)) continue;
+                char *word = m->table.words + w * length;
+                int valid = 1;
+                if (has_more) {
+                    int is_char_ok[MAX_WORD_LENGTH];
+                    int i;
+                    for (i = 0; i < length; i++) {
+                        // mark fully filled in intersecting words also as ok
+                        is_char_ok[i] = strchr(cs[i], '.') == NULL;
+                    }
+                    check_intersect(word, cs, length, results, is_char_ok);
+                    for (i = 0; i < length; i++) {
+                        if (!is_char_ok[i]) break;
+                    }
+                    valid = i == length;
+                }
+                Py_ssize_t ii;
+                for (ii = 0; ii < n_indices; ii++) {
+                    const int index = (int) PyInt_AsLong(PyList_GET_ITEM(indices, ii));
+                    int o;
+                    for (o = m->starts[w]; o < m->starts[w + 1]; o++) {
+                        if (m->lists[o] != index || m->scores[o] < min_score)
+                            continue;
+                        PyObject* item = Py_BuildValue("(s#ib)", word, length, m->scores[o], valid);
+                        PyList_Append(result, item);
+                        Py_DECREF(item);
+                    }
+                }
+            }
+        }
+    }
+    PyMem_Free(matches);
+    if (has_more) {
+        for (t = 0; t < length; t++) {
+            if (results[t] != NULL) {
+                free_search_result(results[t]);
+            }
+        }
+    }
+    return result;
+}
+
+// 1 if each position of the word has an intersecting word in one of the lists
+static int
+is_valid_word(char *word, int length, char **cs, Py_ssize_t n_indices, Sptr results[n_indices][length]) {
+    // TODO refactor with find_candidate
+    int is_char_ok[MAX_WORD_LENGTH];
+    int i;
+    for (i = 0; i < length; i++) {
+        is_char_ok[i] = 0;
+    }
+    // mark fully filled in intersecting words also as ok
+    for (i = 0; i < length; i++) {
+        if (strchr(cs[i], '.') == NULL)
+            is_char_ok[i] = 1;
+    }
+    Py_ssize_t jj;
+    for (jj = 0; jj < n_indices; jj++) {
+        check_intersect(word, cs, length, results[jj], is_char_ok);
+        int n_chars = 0;
+        int j;
+        for (j = 0; j < length; j++) {
+            if (is_char_ok[j]) n_chars++;
+        }
+        if (n_chars == length) {
+            return 1;
+        }
+    }
+    return 0;
+}
+
+// free the analyses of the first n_done lists of a search
+static void
+release_search_results(int length, Py_ssize_t n_indices, Sptr results[n_indices][length]
+    , int *skipped, Py_ssize_t n_done) {
+    Py_ssize_t ii;
+    for (ii = 0; ii < n_done; ii++) {
+        int t;
+        for (t = 0; t < length; t++) {
+            if (skipped[t] == 0 && results[ii][t] != NULL) {
+                free_search_result(results[ii][t]);
+            }
+        }
+    }
+}
+
+// find the first limit words (all words if limit < 0) of the lists,
+// alphabetically or by decreasing score, using the bitset indexes so that
+// no Python objects are needed, total is set to the number of words that
+// match, return NULL in case of error, this does not need the GIL
+static Match*
+find_search_matches(int length, char *cons_str, int *indices, int has_more, char **cs
+    , int n_indices, Sptr results[n_indices][length]
+    , int min_score, int limit, int order_by_score, int *n_matches, int *total) {
+    Match *all = PyMem_Malloc(sizeof(Match));
+    int n_all = 0;
+    *total = 0;
+    if (!all) return NULL;
+    int ii;
+    for (ii = 0; ii < n_indices; ii++) {
+        const int index = indices[ii];
+        if (index < 0 || index > MAX_WORD_LISTS) continue;
+        BIptr b = get_bitset_index(index, length);
+        Match *matches;
+        int n_total;
+        const int n = b ? find_top_matches(b, cons_str, min_score, limit
+            , order_by_score, ii, &matches, &n_total) : -1;
+        Match *next = n >= 0 ? PyMem_Realloc(all, (n_all + n) * sizeof(Match) + 1) : NULL;
+        if (!next) {
+            if (n >= 0) PyMem_Free(matches);
+            PyMem_Free(all);
+            return NULL;
+        }
+        all = next;
+        memcpy(all + n_all, matches, n * sizeof(Match));
+        n_all += n;
+        *total += n_total;
+        PyMem_Free(matches);
+    }
+    if (n_indices > 1) {
+        sort_matches(all, n_all, order_by_score);
+    }
+    if (limit >= 0 && n_all > limit) {
+        n_all = limit;
+    }
+    int m;
+    for (m = 0; m < n_all; m++) {
+        all[m].valid = has_more ? is_valid_word(all[m].word, length, cs, n_indices, results) : 1;
+    }
+    *n_matches = n_all;
+    return all;
+}
+
+// copy the words of the matches into a new buffer, so that they no
+// longer point into the indexes, return NULL in case of error
+static char*
+own_words(Match *matches, Py_ssize_t n_matches, int length) {
+    char *buffer = PyMem_Malloc(n_matches * length + 1);
+    if (!buffer) return NULL;
+    Py_ssize_t m;
+    for (m = 0; m < n_matches; m++) {
+        memcpy(buffer + m * length, matches[m].word, length);
+        matches[m].word = buffer + m * length;
+    }
+    return buffer;
+}
+
+// the words of a search, of which Python objects are only
+// created when they are accessed
+typedef struct {
+    PyObject_HEAD
+    int length;
+    int order_by_score; // whether the matches are ordered by score
+    Py_ssize_t n_matches;
+    Match *matches; // the words point into buffer
+    char *buffer;
+} SearchCursor;
+
+static PyTypeObject SearchCursorType;
+
+// create a cursor that takes ownership of the matches and their words
+static PyObject*
+new_search_cursor(Match *matches, char *buffer, Py_ssize_t n_matches, int length, int order_by_score) {
+    SearchCursor *cursor = PyObject_New(SearchCursor, &SearchCursorType);
+    if (!cursor) {
+        PyMem_Free(matches);
+        PyMem_Free(buffer);
+        return NULL;
+    }
+    cursor->length = length;
+    cursor->order_by_score = order_by_score;
+    cursor->n_matches = n_matches;
+    cursor->matches = matches;
+    cursor->buffer = buffer;
+    return (PyObject *) cursor;
+}
+
+static void
+SearchCursor_dealloc(SearchCursor *self) {
+    PyMem_Free(self->matches);
+    PyMem_Free(self->buffer);
+    PyObject_Del(self);
+}
+
+static Py_ssize_t
+SearchCursor_length(SearchCursor *self) {
+    return self->n_matches;
+}
+
+static PyObject*
+SearchCursor_item(SearchCursor *self, Py_ssize_t i) {
+    if (i < 0 || i >= self->n_matches) {
+        PyErr_SetString(PyExc_IndexError, "search cursor index out of range");
+        return NULL;
+    }
+    Match *m = &self->matches[i];
+    return Py_BuildValue("(s#ib)", m->word, self->length, m->score, m->valid);
+}
+
+static PyObject*
+SearchCursor_subscript(SearchCursor *self, PyObject *key) {
+    if (PySlice_Check(key)) {
+        Py_ssize_t start, stop, step, n;
+        if (PySlice_GetIndicesEx((PySliceObject *) key, self->n_matches, &start, &stop, &step, &n) < 0)
+            return NULL;
+        PyObject *result = PyList_New(n);
+        if (!result) return NULL;
+        Py_ssize_t i;
+        for (i = 0; i < n; i++, start += step) {
+            PyObject *item = SearchCursor_item(self, start);
+            if (!item) {
+                Py_DECREF(result);
+                return NULL;
+            }
+            PyList_SET_ITEM(result, i, item);
+        }
+        return result;
+    }
+    Py_ssize_t i = PyNumber_AsSsize_t(key, PyExc_IndexError);
+    if (i == -1 && PyErr_Occurred())
+        return NULL;
+    if (i < 0) i += self->n_matches;
+    return SearchCursor_item(self, i);
+}
+
+// return a cursor with the words that have intersecting words (if valid_only)
+// and that are not in excluded, alphabetically or by decreasing score
+static PyObject*
+SearchCursor_select(SearchCursor *self, PyObject *args) {
+    int valid_only;
+    PyObject *excluded;
+    int order_by_score;
+    if (!PyArg_ParseTuple(args, "iOi", &valid_only, &excluded, &order_by_score))
+        return NULL;
+    PyObject *seq = PySequence_Fast(excluded, "excluded must be a sequence");
+    if (!seq) return NULL;
+    const Py_ssize_t n_excluded = PySequence_Fast_GET_SIZE(seq);
+    char *skip[n_excluded + 1];
+    Py_ssize_t n_skip = 0;
+    Py_ssize_t e;
+    for (e = 0; e < n_excluded; e++) {
+        PyObject *item = PySequence_Fast_GET_ITEM(seq, e);
+        if (PyString_Check(item) && PyString_GET_SIZE(item) == self->length)
+            skip[n_skip++] = PyString_AS_STRING(item);
+    }
+    Match *matches = PyMem_Malloc(self->n_matches * sizeof(Match) + 1);
+    if (!matches) {
+        Py_DECREF(seq);
+        return PyErr_NoMemory();
+    }
+    Py_ssize_t n = 0;
+    Py_ssize_t m;
+    for (m = 0; m < self->n_matches; m++) {
+        if (valid_only && !self->matches[m].valid) continue;
+        for (e = 0; e < n_skip; e++) {
+            if (memcmp(skip[e], self->matches[m].word, self->length) == 0) break;
+        }
+        if (e < n_skip) continue;
+        matches[n++] = self->matches[m];
+    }
+    Py_DECREF(seq);
+    order_by_score = order_by_score != 0;
+    if (order_by_score != self->order_by_score) {
+        sort_matches(matches, (int) n, order_by_score);
+    }
+    char *buffer = own_words(matches, n, self->length);
+    if (!buffer) {
+        PyMem_Free(matches);
+        return PyErr_NoMemory();
+    }
+    return new_search_cursor(matches, buffer, n, self->length, order_by_score);
+}
+
+static PySequenceMethods SearchCursor_as_sequence = {
+    (lenfunc) SearchCursor_length,
+    0,
+    0,
+    (ssizeargfunc) SearchCursor_item,
+};
+
+static PyMappingMethods SearchCursor_as_mapping = {
+    (lenfunc) SearchCursor_length,
+    (binaryfunc) SearchCursor_subscript,
+    0,
+};
+
+static PyMethodDef SearchCursor_methods[] = {
+    {"select", (PyCFunction) SearchCursor_select, METH_VARARGS, "select"},
+    {NULL, NULL, 0, NULL}
+};
+
+static PyTypeObject SearchCursorType = {
+    PyObject_HEAD_INIT(NULL)
+    0,
+    "cPalabra.SearchCursor",
+    sizeof(SearchCursor),
+    0,
+    (destructor) SearchCursor_dealloc,
+    0, 0, 0, 0, 0, 0,
+    &SearchCursor_as_sequence,
+    &SearchCursor_as_mapping,
+    0, 0, 0, 0, 0, 0,
+    Py_TPFLAGS_DEFAULT,
+    "words found by a search",
+    0, 0, 0, 0, 0, 0,
+    SearchCursor_methods,
+};
+
+// analyze the intersecting slots in each of the lists, this does not need
+// the GIL, return 0 if the search is superseded before it is done
+static int
+analyze_search(int length, int *indices, Py_ssize_t n_indices, Sptr results[n_indices][length]
+    , int *skipped, int *offsets, char **cs, int min_score, int engine, long generation) {
+    Py_ssize_t ii;
+    for (ii = 0; ii < n_indices; ii++) {
+        if (is_superseded(generation)) {
+            release_search_results(length, n_indices, results, skipped, ii);
+            return 0;
+        }
+        analyze_intersect_slot2(results[ii], skipped, offsets, cs, length, indices[ii], min_score, engine);
+    }
+    return 1;
+}
 
 static PyObject*
 cPalabra_search(PyObject *self, PyObject *args) {
@@ -36,10 +453,13 @@ cPalabra_search(PyObject *self, PyObject *args) {
     const Py_ssize_t n_indices = PyList_Size(indices);
 
     const int HAS_OPTIONS = options != Py_None;
-    int OPTION_MIN_SCORE = -9999; // TODO ugly
-    if (HAS_OPTIONS) {
-        OPTION_MIN_SCORE = (int) PyInt_AsLong(PyDict_GetItem(options, PyString_FromString("min_score")));
-    }
+    const int OPTION_MIN_SCORE = get_int_option(options, "min_score", -9999);
+    const int OPTION_ENGINE = get_int_option(options, "engine", SEARCH_ENGINE_TREE);
+    const int OPTION_LIMIT = get_int_option(options, "limit", -1);
+    const int OPTION_ORDER_BY_SCORE = get_int_option(options, "order_by_score", 0);
+    const int OPTION_CURSOR = get_int_option(options, "cursor", 0);
+    const long OPTION_GENERATION = get_int_option(options, "generation", -1);
+    const int HAS_MORE = more_constraints != Py_None;
 
     // each of the constraints
     int offsets[length];
@@ -48,7 +468,7 @@ cPalabra_search(PyObject *self, PyObject *args) {
     int skipped[length];
     for (t = 0; t < length; t++) skipped[t] = 0;
     Sptr results[n_indices][length];
-    if (more_constraints != Py_None) {
+    if (HAS_MORE) {
         for (t = 0; t < length; t++) {
             PyObject *py_cons_str2;
             PyObject* item = PyList_GET_ITEM(more_constraints, (Py_ssize_t) t);
@@ -56,77 +476,139 @@ cPalabra_search(PyObject *self, PyObject *args) {
                 return NULL;
             cs[t] = PyString_AS_STRING(py_cons_str2);
         }
-        Py_ssize_t ii;
-        for (ii = 0; ii < n_indices; ii++) {
-            const int index = (int) PyInt_AsLong(PyList_GET_ITEM(indices, ii));
-            analyze_intersect_slot2(results[ii], skipped, offsets, cs, length, index, OPTION_MIN_SCORE);
+    }
+    int c_indices[n_indices + 1];
+    Py_ssize_t ii;
+    for (ii = 0; ii < n_indices; ii++) {
+        c_indices[ii] = (int) PyInt_AsLong(PyList_GET_ITEM(indices, ii));
+    }
+
+    if (OPTION_LIMIT >= 0 || OPTION_ORDER_BY_SCORE || OPTION_CURSOR) {
+        // the words are collected without the GIL so that a search
+        // in another thread does not block the interface
+        int n_matches = 0;
+        int total = 0;
+        int done = 1;
+        Match *matches = NULL;
+        char *buffer = NULL;
+        Py_BEGIN_ALLOW_THREADS
+        PyThread_acquire_lock(index_lock, WAIT_LOCK);
+        if (HAS_MORE) {
+            done = analyze_search(length, c_indices, n_indices, results, skipped
+                , offsets, cs, OPTION_MIN_SCORE, OPTION_ENGINE, OPTION_GENERATION);
+        }
+        if (done && is_superseded(OPTION_GENERATION)) {
+            if (HAS_MORE) release_search_results(length, n_indices, results, skipped, n_indices);
+            done = 0;
+        }
+        if (done) {
+            matches = find_search_matches(length, cons_str, c_indices, HAS_MORE, cs
+                , n_indices, results, OPTION_MIN_SCORE, OPTION_LIMIT, OPTION_ORDER_BY_SCORE, &n_matches, &total);
+            buffer = matches ? own_words(matches, n_matches, length) : NULL;
+            if (HAS_MORE) release_search_results(length, n_indices, results, skipped, n_indices);
+        }
+        PyThread_release_lock(index_lock);
+        Py_END_ALLOW_THREADS
+        if (!done) {
+            Py_INCREF(Py_None);
+            return Py_None;
+        }
+        if (!matches || !buffer) {
+            PyMem_Free(matches);
+            return PyErr_NoMemory();
+        }
+        PyObject *words;
+        if (OPTION_CURSOR) {
+            words = new_search_cursor(matches, buffer, n_matches, length, OPTION_ORDER_BY_SCORE != 0);
+        } else {
+            words = PyList_New(n_matches);
+            int m;
+            for (m = 0; words && m < n_matches; m++) {
+                PyList_SET_ITEM(words, m, Py_BuildValue("(s#ib)"
+                    , matches[m].word, length, matches[m].score, matches[m].valid));
+            }
+            PyMem_Free(matches);
+            PyMem_Free(buffer);
+        }
+        if (words == NULL || OPTION_LIMIT < 0) {
+            return words;
+        }
+        return Py_BuildValue("(Ni)", words, total);
+    }
+
+    lock_index();
+    // search several lists at once when they are all merged
+    ListMask lists = 0;
+    int use_merged = n_indices > 1;
+    for (ii = 0; ii < n_indices; ii++) {
+        const int index = c_indices[ii];
+        if (index < 0 || index >= MAX_WORD_LISTS || !(merged_lists & LIST_BIT(index))) {
+            use_merged = 0;
+            break;
         }
+        lists |= LIST_BIT(index);
+    }
+    if (use_merged) {
+        PyObject *result = search_merged(length, cons_str, indices, lists
+            , HAS_MORE, offsets, cs, OPTION_MIN_SCORE, OPTION_ENGINE);
+        unlock_index();
+        return result;
+    }
+
+    if (HAS_MORE) {
+        analyze_search(length, c_indices, n_indices, results, skipped
+            , offsets, cs, OPTION_MIN_SCORE, OPTION_ENGINE, -1);
     }
 
     // main word
     PyObject *result = PyList_New(0);
-    Py_ssize_t ii;
-    for (ii = 0; ii < n_indices; ii++) {
-        const int index = (int) PyInt_AsLong(PyList_GET_ITEM(indices, ii));
+    for (ii = 0; result && ii < n_indices; ii++) {
+        const int index = c_indices[ii];
         PyObject *mwords = PyList_New(0);
-        mwords = find_matches(mwords, trees[index][strlen(cons_str)], cons_str);
+        if (OPTION_ENGINE == SEARCH_ENGINE_BITSET && get_bitset_index(index, length)) {
+            mwords = find_matches_bitset(mwords, bitsets[index][length], cons_str);
+        } else {
+            mwords = find_matches_index(mwords, index, length, cons_str);
+        }
         Py_ssize_t m;
         for (m = 0; m < PyList_Size(mwords); m++) {
             PyObject* m_item = PyList_GET_ITEM(mwords, m);
             PyObject* word_str;
             const int score;
-            if (!PyArg_ParseTuple(m_item, "Oi", &word_str, &score))
-                return NULL;
+            if (!PyArg_ParseTuple(m_item, "Oi", &word_str, &score)) {
+                Py_CLEAR(result);
+                break;
+            }
             if (HAS_OPTIONS && score < OPTION_MIN_SCORE)
                 continue;
             char *word = PyString_AS_STRING(word_str);
             int valid = 1;
-            if (more_constraints != Py_None) {
-                valid = 0;
-                // TODO refactor with find_candidate
-                int is_char_ok[MAX_WORD_LENGTH];
-                int i;
-                for (i = 0; i < length; i++) {
-                    is_char_ok[i] = 0;
-                }
-                // mark fully filled in intersecting words also as ok
-                for (i = 0; i < length; i++) {
-                    if (strchr(cs[i], '.') == NULL)
-                        is_char_ok[i] = 1;
-                }
-                Py_ssize_t jj;
-                for (jj = 0; jj < n_indices; jj++) {
-                    check_intersect(word, cs, length, results[jj], is_char_ok);
-                    int n_chars = 0;
-                    int j;
-                    for (j = 0; j < length; j++) {
-                        if (is_char_ok[j]) n_chars++;
-                    }
-                    if (n_chars == length) {
-                        valid = 1;
-                        break;
-                    }
-                }
+            if (HAS_MORE) {
+                valid = is_valid_word(word, length, cs, n_indices, results);
             }
             PyObject* item = Py_BuildValue("(sib)", word, score, valid);
             PyList_Append(result, item);
             Py_DECREF(item);
         }
+        Py_DECREF(mwords);
     }
-    if (more_constraints != Py_None) {
-        Py_ssize_t ii;
-        for (ii = 0; ii < n_indices; ii++) {
-            for (t = 0; t < length; t++) {
-                if (skipped[t] == 0 && results[ii][t] != NULL) {
-                    PyMem_Free(results[ii][t]->chars);
-                    PyMem_Free(results[ii][t]);
-                }
-            }
-        }
+    if (HAS_MORE) {
+        release_search_results(length, n_indices, results, skipped, n_indices);
     }
+    unlock_index();
     return result;
 }
 
+static PyObject*
+cPalabra_set_search_generation(PyObject *self, PyObject *args) {
+    long generation;
+    if (!PyArg_ParseTuple(args, "l", &generation))
+        return NULL;
+    search_generation = generation;
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
 static PyObject*
 cPalabra_preprocess_all(PyObject *self, PyObject *args) {
     // make sure each tree is initialized
@@ -135,8 +617,20 @@ cPalabra_preprocess_all(PyObject *self, PyObject *args) {
         int m;
         for (m = 0; m < MAX_WORD_LENGTH; m++) {
             trees[n][m] = NULL;
+            arenas[n][m] = NULL;
+            tables[n][m] = NULL;
+            bitsets[n][m] = NULL;
         }
     }
+    for (n = 0; n < MAX_WORD_LENGTH; n++) {
+        merged[n] = NULL;
+        merged_stale[n] = 0;
+    }
+    merged_lists = 0;
+    for (n = 0; n < MAX_WORD_LISTS + 1; n++) {
+        automata[n] = NULL;
+        clear_analysis_cache(n);
+    }
     Py_INCREF(Py_None);
     return Py_None;
 }
@@ -147,6 +641,11 @@ cPalabra_preprocess(PyObject *self, PyObject *args) {
     const int index;
     if (!PyArg_ParseTuple(args, "Oi", &words, &index))
         return NULL;
+    if (index < 0 || index > MAX_WORD_LISTS) {
+        PyErr_SetString(PyExc_ValueError, "invalid word list index");
+        return NULL;
+    }
+    new_index_generation(index);
 
     // create dict
     // keys = word lengths
@@ -177,30 +676,47 @@ cPalabra_preprocess(PyObject *self, PyObject *args) {
         PyList_Append(PyDict_GetItem(dict, key), word);
     }
 
-    // build ternary search trees per word length
-    // TODO insert in random order for best performance
+    // build ternary search trees per word length,
+    // the words are inserted median first to keep the trees balanced
     int m;
     for (m = 0; m < MAX_WORD_LENGTH; m++) {
         // clear previous tree in case we are rebuilding for this index
-        if (trees[index][m] != NULL) {
-            free_tree(trees[index][m]);
-            PyMem_Free(trees[index][m]);
-        }
-        trees[index][m] = NULL;
+        free_tree(index, m);
+        free_table(tables[index][m]);
+        tables[index][m] = NULL;
+        clear_bitset_index(index, m);
         PyObject *key = Py_BuildValue("i", m);
         PyObject *words = PyDict_GetItem(dict, key);
+        Py_DECREF(key);
         const Py_ssize_t len_m = PyList_Size(words);
+        WordEntry *entries = PyMem_Malloc(len_m * sizeof(WordEntry) + 1);
+        if (!entries) {
+            Py_DECREF(dict);
+            return PyErr_NoMemory();
+        }
         Py_ssize_t w;
         for (w = 0; w < len_m; w++) {
             PyObject *w_word = PyList_GET_ITEM(words, w);
             PyObject* w_str;
             const int w_score;
-            if (!PyArg_ParseTuple(w_word, "Oi", &w_str, &w_score))
+            if (!PyArg_ParseTuple(w_word, "Oi", &w_str, &w_score)) {
+                PyMem_Free(entries);
                 return NULL;
-            char *c_word = PyString_AsString(w_str);
-            c_insert_word(index, m, c_word, w_score);
+            }
+            entries[w].word = PyString_AsString(w_str);
+            entries[w].score = w_score;
+            entries[w].seq = (int) w;
+        }
+        const int inserted = insert_words(index, m, entries, (int) len_m, 0);
+        PyMem_Free(entries);
+        if (!inserted) {
+            Py_DECREF(dict);
+            return PyErr_NoMemory();
         }
     }
+    merge_wordlist(index);
+    clear_word_automaton(index);
+    clear_analysis_cache(index);
     return dict;
 }
 
@@ -212,17 +728,156 @@ cPalabra_insert_word(PyObject *self, PyObject *args) {
     const int score;
     if (!PyArg_ParseTuple(args, "iisi", &index, &length, &word, &score))
         return NULL;
-    c_insert_word(index, length, word, score);
+    if (!thaw_table(index, length))
+        return PyErr_NoMemory();
+    clear_bitset_index(index, length);
+    mark_merged_stale(index, length);
+    clear_word_automaton(index);
+    clear_analysis_cache(index);
+    if (!c_insert_word(index, length, word, score))
+        return PyErr_NoMemory();
     Py_INCREF(Py_None);
     return Py_None;
 }
 
-void c_insert_word(int index, int length, char *word, int score) {
-    // we need to make a copy to prevent errors when we modify the
-    // list later on (see CWordList.update_score)
-    PyObject *use_word = PyString_FromStringAndSize(word, length);
-    char *c_use_word = PyString_AsString(use_word);
-    trees[index][length] = insert1(trees[index][length], c_use_word, c_use_word, score);
+static PyObject*
+cPalabra_remove_word(PyObject *self, PyObject *args) {
+    const int index;
+    const int length;
+    char *word;
+    const int score;
+    if (!PyArg_ParseTuple(args, "iisi", &index, &length, &word, &score))
+        return NULL;
+    if (index < 0 || index > MAX_WORD_LISTS || length <= 0 || length >= MAX_WORD_LENGTH) {
+        PyErr_SetString(PyExc_ValueError, "invalid word list index or word length");
+        return NULL;
+    }
+    if (!thaw_table(index, length))
+        return PyErr_NoMemory();
+    const int removed = remove_word(&trees[index][length], word, score);
+    if (removed) {
+        clear_bitset_index(index, length);
+        mark_merged_stale(index, length);
+        clear_word_automaton(index);
+        clear_analysis_cache(index);
+    }
+    return PyBool_FromLong(removed);
+}
+
+static PyObject*
+cPalabra_load_index(PyObject *self, PyObject *args) {
+    const int index;
+    PyObject *buffer;
+    PyObject *toc;
+    if (!PyArg_ParseTuple(args, "iOO", &index, &buffer, &toc))
+        return NULL;
+    if (index < 0 || index > MAX_WORD_LISTS) {
+        PyErr_SetString(PyExc_ValueError, "invalid word list index");
+        return NULL;
+    }
+    new_index_generation(index);
+    // the buffer is writable so scores can be updated in place
+    // (the word list should be mapped copy-on-write)
+    void *data;
+    Py_ssize_t size;
+    if (PyObject_AsWriteBuffer(buffer, &data, &size) < 0)
+        return NULL;
+    WTptr loaded[MAX_WORD_LENGTH];
+    int m;
+    for (m = 0; m < MAX_WORD_LENGTH; m++) {
+        loaded[m] = NULL;
+    }
+    Py_ssize_t t;
+    for (t = 0; t < PyList_Size(toc); t++) {
+        const int length;
+        const int n_words;
+        const Py_ssize_t words_offset;
+        const Py_ssize_t scores_offset;
+        if (!PyArg_ParseTuple(PyList_GET_ITEM(toc, t), "iinn", &length, &n_words, &words_offset, &scores_offset))
+            goto error;
+        if (length <= 0 || length >= MAX_WORD_LENGTH || n_words <= 0
+            || words_offset < 0 || words_offset + (Py_ssize_t) n_words * length > size
+            || scores_offset < 0 || scores_offset % sizeof(int) != 0
+            || scores_offset + (Py_ssize_t) n_words * sizeof(int) > size
+            || loaded[length] != NULL) {
+            PyErr_SetString(PyExc_ValueError, "invalid compiled word list index");
+            goto error;
+        }
+        WTptr table = (WTptr) PyMem_Malloc(sizeof(WordTable));
+        if (!table) {
+            PyErr_NoMemory();
+            goto error;
+        }
+        table->length = length;
+        table->n_words = n_words;
+        table->words = (char *) data + words_offset;
+        table->scores = (int *) ((char *) data + scores_offset);
+        Py_INCREF(buffer);
+        table->owner = buffer;
+        loaded[length] = table;
+    }
+    for (m = 0; m < MAX_WORD_LENGTH; m++) {
+        free_tree(index, m);
+        free_table(tables[index][m]);
+        tables[index][m] = loaded[m];
+        clear_bitset_index(index, m);
+    }
+    merge_wordlist(index);
+    clear_word_automaton(index);
+    clear_analysis_cache(index);
+    Py_RETURN_NONE;
+error:
+    for (m = 0; m < MAX_WORD_LENGTH; m++) {
+        free_table(loaded[m]);
+    }
+    return NULL;
+}
+
+static PyObject*
+cPalabra_index_words(PyObject *self, PyObject *args) {
+    const int index;
+    if (!PyArg_ParseTuple(args, "i", &index))
+        return NULL;
+    // same structure as the result of cPalabra_preprocess
+    PyObject* dict = PyDict_New();
+    int l;
+    for (l = 0; l < MAX_WORD_LENGTH; l++) {
+        PyObject *ws = PyList_New(0);
+        WTptr t = tables[index][l];
+        if (t) {
+            int w;
+            for (w = 0; w < t->n_words; w++) {
+                PyObject* item = Py_BuildValue("(s#i)", t->words + w * l, l, t->scores[w]);
+                PyList_Append(ws, item);
+                Py_DECREF(item);
+            }
+        } else if (l > 0) {
+            char cons_str[l + 1];
+            memset(cons_str, CONSTRAINT_EMPTY, l);
+            cons_str[l] = '\0';
+            find_matches(ws, trees[index][l], cons_str);
+        }
+        PyObject *key = PyInt_FromLong(l);
+        PyDict_SetItem(dict, key, ws);
+        Py_DECREF(key);
+        Py_DECREF(ws);
+    }
+    return dict;
+}
+
+// insert a copy of the word into the tree, 0 if there is no memory
+int c_insert_word(int index, int length, char *word, int score) {
+    return insert_tree_word(&arenas[index][length], &trees[index][length], length, word, score);
+}
+
+static PyObject*
+cPalabra_unmerge(PyObject *self, PyObject *args) {
+    const int index;
+    if (!PyArg_ParseTuple(args, "i", &index))
+        return NULL;
+    unmerge_wordlist(index);
+    clear_analysis_cache(index);
+    Py_RETURN_NONE;
 }
 
 static PyObject*
@@ -230,14 +885,24 @@ cPalabra_postprocess(PyObject *self, PyObject *args) {
     int i;
     for (i = 0; i < MAX_WORD_LISTS + 1; i++) {
         if (trees[i] == NULL) continue;
+        new_index_generation(i);
         int m;
         for (m = 0; m < MAX_WORD_LENGTH; m++) {
-            if (trees[i][m] != NULL) {
-                free_tree(trees[i][m]);
-                PyMem_Free(trees[i][m]);
-            }
+            free_tree(i, m);
+            free_table(tables[i][m]);
+            tables[i][m] = NULL;
+            clear_bitset_index(i, m);
         }
+        clear_word_automaton(i);
+        clear_analysis_cache(i);
     }
+    int m;
+    for (m = 0; m < MAX_WORD_LENGTH; m++) {
+        free_merged_index(merged[m]);
+        merged[m] = NULL;
+        merged_stale[m] = 0;
+    }
+    merged_lists = 0;
     Py_INCREF(Py_None);
     return Py_None;
 }
@@ -298,6 +963,618 @@ cPalabra_assign_numbers(PyObject *self, PyObject *args) {
     Py_RETURN_NONE;
 }
 
+// the generation of the newest fill, older fills are stopped
+static volatile long fill_generation = 0;
+
+// 1 if a newer fill has been started or the fill has been cancelled,
+// a generation < 0 means the fill cannot be stopped
+static int
+is_fill_stopped(long generation) {
+    return generation >= 0 && generation != fill_generation;
+}
+
+static double
+now_seconds(void) {
+    struct timeval tv;
+    gettimeofday(&tv, NULL);
+    return tv.tv_sec + tv.tv_usec / 1e6;
+}
+
+// the limits of a fill, given by its options
+typedef struct {
+    long max_nodes;
+    double deadline; // 0 if there is no time limit
+    long generation;
+} FillBudget;
+
+static void
+read_fill_budget(PyObject *options, int max_nodes, FillBudget *budget) {
+    budget->max_nodes = get_int_option(options, "max_nodes", max_nodes);
+    const int time_limit = get_int_option(options, "time_limit", 0);
+    budget->deadline = time_limit > 0 ? now_seconds() + time_limit / 1000.0 : 0;
+    budget->generation = get_int_option(options, "generation", -1);
+}
+
+// the reason to stop a fill that is not done, NULL to continue it
+static const char*
+fill_stop_reason(FillBudget *budget, long nodes) {
+    if (nodes >= budget->max_nodes) return "nodes";
+    if (budget->deadline > 0 && now_seconds() >= budget->deadline) return "time";
+    if (is_fill_stopped(budget->generation)) return "cancelled";
+    return NULL;
+}
+
+// store the counters of a fill in the dict of the option "stats", if given
+static void
+set_fill_stats(PyObject *options, const char *status, long nodes, long backjumps, long skipped) {
+    PyObject *stats = PyDict_GetItemString(options, "stats");
+    if (!stats || !PyDict_Check(stats)) return;
+    PyObject *value = PyString_FromString(status);
+    PyDict_SetItemString(stats, "status", value);
+    Py_XDECREF(value);
+    value = PyInt_FromLong(nodes);
+    PyDict_SetItemString(stats, "nodes", value);
+    Py_XDECREF(value);
+    value = PyInt_FromLong(backjumps);
+    PyDict_SetItemString(stats, "backjumps", value);
+    Py_XDECREF(value);
+    value = PyInt_FromLong(skipped);
+    PyDict_SetItemString(stats, "skipped", value);
+    Py_XDECREF(value);
+}
+
+// the cells of the grid with the words of assigned filled in
+static PyObject*
+gather_fill_problem(FPptr p, int *assigned, Cell *cgrid, int width, int height, Slot *slots) {
+    Cell cells[width * height];
+    memcpy(cells, cgrid, width * height * sizeof(Cell));
+    apply_fill(p, assigned, cells, width, slots);
+    return gather_fill(cells, width, height);
+}
+
+// call the progress callable with the number of filled slots (slots), the
+// number of words that were tried (nodes) and per second (nodes_per_second)
+// and the best partial fill (fill), 0 if it raises an exception
+static int
+call_fill_progress(PyObject *progress, PyObject *fill, int n_slots, long nodes, double elapsed) {
+    PyObject *info = Py_BuildValue("{s:i,s:l,s:d,s:N}"
+        , "slots", n_slots
+        , "nodes", nodes
+        , "nodes_per_second", elapsed > 0 ? nodes / elapsed : 0.0
+        , "fill", fill);
+    if (!info) return 0;
+    PyObject *result = PyObject_CallFunctionObjArgs(progress, info, NULL);
+    Py_DECREF(info);
+    if (!result) return 0;
+    Py_DECREF(result);
+    return 1;
+}
+
+static int
+report_fill_progress(PyObject *progress, FPptr p, double elapsed, Cell *cgrid, int width, int height, Slot *slots) {
+    PyObject *fill = gather_fill_problem(p, p->best, cgrid, width, height, slots);
+    return call_fill_progress(progress, fill, p->best_depth, p->nodes, elapsed);
+}
+
+// the progress callable of the options, NULL with an exception set if it
+// is not callable and NULL without one if there is none
+static PyObject*
+get_fill_progress(PyObject *options) {
+    PyObject *progress = PyDict_GetItemString(options, "progress");
+    if (progress == Py_None) progress = NULL;
+    if (progress && !PyCallable_Check(progress)) {
+        PyErr_SetString(PyExc_TypeError, "progress must be callable");
+        return NULL;
+    }
+    return progress;
+}
+
+// fill the grid with the propagating fill engine, the result is a list
+// with the complete fill or, if there is none, the best partial fill,
+// a seed > 0 shuffles the order in which slots and words of equal merit
+// are tried, with an objective the result is the best complete fill that
+// was found and its value is stored as score in the stats, the search
+// runs without the GIL in steps of FILL_STEP_NODES words until it is
+// done or its budget is spent, the progress callable of the options is
+// called after the first step and then every FILL_PROGRESS_INTERVAL seconds
+#define FILL_STEP_NODES 64
+#define FILL_PROGRESS_INTERVAL 0.25
+static PyObject*
+fill_propagating(PyObject *words, PyObject *options, Cell *cgrid, int width, int height, Slot *slots, int n_slots, int no_duplicates) {
+    int s;
+    for (s = 0; s < n_slots; s++) {
+        if (slots[s].length <= 0 || slots[s].length >= MAX_WORD_LENGTH) {
+            PyErr_SetString(PyExc_ValueError, "invalid slot length");
+            return NULL;
+        }
+    }
+    PyObject *progress = get_fill_progress(options);
+    if (!progress && PyErr_Occurred()) return NULL;
+    const int objective = get_int_option(options, "objective", FILL_OBJECTIVE_NONE);
+    if (objective < FILL_OBJECTIVE_NONE || objective > FILL_OBJECTIVE_MINIMUM) {
+        PyErr_SetString(PyExc_ValueError, "invalid fill objective");
+        return NULL;
+    }
+    FillBudget budget;
+    read_fill_budget(options, FILL_MAX_NODES, &budget);
+    FPptr p = new_fill_problem(words, width, height, slots, n_slots, no_duplicates);
+    if (!p) return PyErr_NoMemory();
+    const int seed = get_int_option(options, "seed", 0);
+    if (seed > 0) {
+        shuffle_fill_problem(p, seed);
+    }
+    p->objective = objective;
+    const double start = now_seconds();
+    double reported = start - FILL_PROGRESS_INTERVAL;
+    const char *status = NULL;
+    while (!status) {
+        long steps = budget.max_nodes - p->nodes;
+        if (steps > FILL_STEP_NODES) steps = FILL_STEP_NODES;
+        int found;
+        Py_BEGIN_ALLOW_THREADS
+        found = fill_search(p, steps);
+        Py_END_ALLOW_THREADS
+        if (found == FILL_RESULT_FOUND) {
+            status = "complete";
+            for (s = 0; s < n_slots; s++) {
+                p->best[s] = p->slots[s].assigned;
+            }
+        } else if (found == FILL_RESULT_EXHAUSTED) {
+            status = p->has_incumbent ? "complete" : "exhausted";
+        } else {
+            status = fill_stop_reason(&budget, p->nodes);
+        }
+        const double now = now_seconds();
+        if (!status && progress && now - reported >= FILL_PROGRESS_INTERVAL) {
+            reported = now;
+            if (!report_fill_progress(progress, p, now - start, cgrid, width, height, slots)) {
+                free_fill_problem(p);
+                return NULL;
+            }
+        }
+    }
+    set_fill_stats(options, status, p->nodes, p->backjumps, p->skipped);
+    PyObject *stats = PyDict_GetItemString(options, "stats");
+    if (objective != FILL_OBJECTIVE_NONE && stats && PyDict_Check(stats)) {
+        PyObject *score = p->has_incumbent ? PyInt_FromLong(p->incumbent) : Py_None;
+        if (!p->has_incumbent) Py_INCREF(score);
+        PyDict_SetItemString(stats, "score", score);
+        Py_XDECREF(score);
+    }
+    PyObject *fill = gather_fill_problem(p, p->best, cgrid, width, height, slots);
+    free_fill_problem(p);
+    PyObject *result = PyList_New(0);
+    PyList_Append(result, fill);
+    Py_DECREF(fill);
+    return result;
+}
+
+static PyObject*
+cPalabra_set_fill_generation(PyObject *self, PyObject *args) {
+    long generation;
+    if (!PyArg_ParseTuple(args, "l", &generation))
+        return NULL;
+    fill_generation = generation;
+    Py_RETURN_NONE;
+}
+
+static PyObject*
+cPalabra_index_generation(PyObject *self, PyObject *args) {
+    const int index;
+    if (!PyArg_ParseTuple(args, "i", &index))
+        return NULL;
+    if (index < 0 || index > MAX_WORD_LISTS) {
+        PyErr_SetString(PyExc_ValueError, "invalid word list index");
+        return NULL;
+    }
+    return PyInt_FromLong(index_generations[index]);
+}
+
+static PyObject*
+cPalabra_get_fill_generation(PyObject *self, PyObject *args) {
+    return PyInt_FromLong(fill_generation);
+}
+
+// a forked process only has the thread that forked it, so the index lock
+// is replaced in case another thread of the parent process held it
+static PyObject*
+cPalabra_after_fork(PyObject *self, PyObject *args) {
+    PyThread_type_lock lock = PyThread_allocate_lock();
+    if (lock == NULL)
+        return PyErr_NoMemory();
+    index_lock = lock;
+    Py_RETURN_NONE;
+}
+
+// read the words of each length of the dict of words, 0 with an exception
+// set in case of an error, free_greedy_words must be called in any case
+static int
+read_greedy_words(PyObject *words, GreedyWords *g) {
+    int t;
+    for (t = 0; t < MAX_WORD_LENGTH; t++) {
+        g->items[t] = NULL;
+        g->words[t] = NULL;
+        g->n_words[t] = 0;
+    }
+    for (t = 0; t < MAX_WORD_LENGTH; t++) {
+        PyObject *key = PyInt_FromLong(t);
+        if (!key) return 0;
+        PyObject *l_words = PyDict_GetItem(words, key);
+        Py_DECREF(key);
+        if (!l_words) continue;
+        g->items[t] = PySequence_Tuple(l_words);
+        if (!g->items[t]) return 0;
+        const Py_ssize_t n_words = PyTuple_GET_SIZE(g->items[t]);
+        g->words[t] = PyMem_Malloc(n_words * sizeof(char*) + 1);
+        if (!g->words[t]) {
+            PyErr_NoMemory();
+            return 0;
+        }
+        Py_ssize_t w;
+        for (w = 0; w < n_words; w++) {
+            PyObject *word_str;
+            int word_score;
+            if (!PyArg_ParseTuple(PyTuple_GET_ITEM(g->items[t], w), "Oi", &word_str, &word_score))
+                return 0;
+            g->words[t][w] = PyString_AsString(word_str);
+            if (!g->words[t][w]) return 0;
+        }
+        g->n_words[t] = n_words;
+    }
+    return 1;
+}
+
+static void
+free_greedy_words(GreedyWords *g) {
+    int t;
+    for (t = 0; t < MAX_WORD_LENGTH; t++) {
+        PyMem_Free(g->words[t]);
+        Py_XDECREF(g->items[t]);
+    }
+}
+
+static void
+free_greedy_fill(GreedyWords *g, Slot *slots, int n_slots) {
+    free_greedy_words(g);
+    int m;
+    for (m = 0; m < n_slots; m++) {
+        PyMem_Free(slots[m].candidates);
+    }
+}
+
+// read the strings of the candidate words of a slot, 0 with an exception
+// set in case of an error, the list of words must outlive the fill
+static int
+read_slot_candidates(Slot *slot) {
+    slot->n_candidates = 0;
+    slot->candidates = NULL;
+    if (!PyList_Check(slot->words)) {
+        PyErr_SetString(PyExc_TypeError, "words of a slot must be a list");
+        return 0;
+    }
+    const Py_ssize_t n_words = PyList_GET_SIZE(slot->words);
+    slot->candidates = PyMem_Malloc(n_words * sizeof(char*) + 1);
+    if (!slot->candidates) {
+        PyErr_NoMemory();
+        return 0;
+    }
+    Py_ssize_t w;
+    for (w = 0; w < n_words; w++) {
+        slot->candidates[w] = PyString_AsString(PyList_GET_ITEM(slot->words, w));
+        if (!slot->candidates[w]) return 0;
+    }
+    slot->n_candidates = n_words;
+    return 1;
+}
+
+// the state of the greedy fill engine between its attempts
+typedef struct {
+    GreedyWords words;
+    Cell *cgrid;
+    int width;
+    int height;
+    Slot *slots;
+    int n_slots;
+    int *order; // the indices of the filled slots in order, then -1
+    int n_done_slots;
+    int start;
+    int nice;
+    int nice_count;
+    int duplicate;
+    long attempts;
+    Cell *best; // the cells of the best partial fill
+    int has_best;
+    int best_n_done_slots;
+} GreedyFill;
+
+// the cells of the best fill so far, NULL if there is none
+static Cell*
+greedy_best_cells(GreedyFill *f) {
+    if (f->nice) {
+        if (f->n_done_slots == f->nice_count) return f->cgrid;
+        return f->has_best ? f->best : NULL;
+    }
+    if (f->has_best && f->best_n_done_slots > f->n_done_slots) return f->best;
+    return f->cgrid;
+}
+
+// fill in a word in one slot or backtrack if there is none, this does not
+// use Python objects so it runs without the GIL, 0 if the fill is done
+static int
+greedy_fill_attempt(GreedyFill *f) {
+    Cell *cgrid = f->cgrid;
+    const int width = f->width;
+    const int height = f->height;
+    Slot *slots = f->slots;
+    const int n_slots = f->n_slots;
+    int *order = f->order;
+    int m;
+    int index = -1;
+    if (f->nice) {
+        index = find_nice_slot(&f->words, slots, n_slots, width, height, order);
+    } else if (f->attempts == 0 || f->n_done_slots == 0) {
+        index = find_initial_slot(slots, n_slots, f->start);
+    } else {
+        index = find_slot(slots, n_slots, order);
+    }
+    if (index < 0) return 0;
+    Slot *slot = &slots[index];
+    if (DEBUG) {
+        printf("Searching word for (%i, %i, %s, %i) at index %i: \n", slot->x, slot->y, slot->dir == 0 ? "across" : "down", slot->count, index);
+    }
+    get_constraints_i(cgrid, width, height, slot, slot->cs);
+
+    char *cs_i[slot->length];
+    for (m = 0; m < slot->length; m++) {
+        cs_i[m] = NULL;
+    }
+    int offsets[slot->length];
+    Sptr results[slot->length];
+    int skipped[slot->length];
+    int t;
+    for (t = 0; t < slot->length; t++) {
+        skipped[t] = 0;
+        results[t] = NULL;
+    }
+    if (!f->nice) {
+        for (m = 0; m < n_slots; m++) {
+            if (is_intersecting(slot, &slots[m])) {
+                int index = 0;
+                int offset = 0;
+                if (slot->dir == DIR_ACROSS) {
+                    index = slots[m].x - slot->x;
+                    offset = slot->y - slots[m].y;
+                } else {
+                    index = (&slots[m])->y - slot->y;
+                    offset = slot->x - (&slots[m])->x;
+                }
+                cs_i[index] = PyMem_Malloc(slots[m].length * sizeof(char) + 1);
+                offsets[index] = offset;
+                get_constraints_i(cgrid, width, height, &slots[m], cs_i[index]);
+            }
+        }
+        // TODO index
+        // TODO min_score
+        analyze_intersect_slot2(results, skipped, offsets, cs_i, slot->length, 0, -9999, SEARCH_ENGINE_TREE);
+    }
+
+    int is_word_ok = 1;
+
+    char* word = find_candidate(cs_i, results, slot, slot->cs, f->nice, slot->offset);
+    if (word && f->duplicate) {
+        int duplicates[n_slots];
+        for (t = 0; t < n_slots; t++) {
+            duplicates[t] = 0;
+        }
+        while (1) {
+            int added_offset = 0;
+            int next = 0;
+            for (t = 0; t < n_slots; t++) {
+                if (!slots[t].done) continue;
+                if (duplicates[t]) added_offset++;
+                char *word_t = get_constraints(cgrid, width, height, &slots[t]);
+                if (word_t && strcmp(word, word_t) == 0) {
+                    PyMem_Free(word_t);
+                    duplicates[t] = 1;
+                    added_offset++;
+                    word = find_candidate(cs_i, results, slot, slot->cs, f->nice, slot->offset + added_offset);
+                    next = word != NULL;
+                    break;
+                }
+            }
+            if (!next) break;
+        }
+    }
+
+    for (m = 0; m < slot->length; m++) {
+        if (cs_i[m] != NULL) {
+            PyMem_Free(cs_i[m]);
+        }
+    }
+
+    for (t = 0; t < slot->length; t++) {
+        if (skipped[t] == 0 && results[t] != NULL) {
+            free_search_result(results[t]);
+        }
+    }
+
+    int is_backtrack = 0;
+    if (!word) {
+        is_backtrack = 1;
+    }
+    if (word) {
+        int affected[slot->length];
+        int k;
+        for (k = 0; k < slot->length; k++) {
+            // mark the affected slot of the modified cell
+            affected[k] = -1;
+            int cx = slot->x + (slot->dir == DIR_ACROSS ? k : 0);
+            int cy = slot->y + (slot->dir == DIR_DOWN ? k : 0);
+            int dir = slot->dir == DIR_ACROSS ? 1 : 0;
+            int indexD = get_slot_index(slots, n_slots, cx, cy, dir);
+            if (indexD >= 0 && indexD != index) {
+                affected[k] = indexD;
+            }
+        }
+        // update counts for affected slots
+        slot->count = 1;
+        for (k = 0; k < slot->length; k++) {
+            if (affected[k] >= 0) {
+                int cx = slot->x + (slot->dir == DIR_ACROSS ? k : 0);
+                int cy = slot->y + (slot->dir == DIR_DOWN ? k : 0);
+                int is_empty = cgrid[cx + cy * width].c == CONSTRAINT_EMPTY;
+                cgrid[cx + cy * width].c = word[k];
+                int count = determine_count(&f->words, cgrid, width, height, &slots[affected[k]]);
+                if (is_empty) {
+                    cgrid[cx + cy * width].c = CONSTRAINT_EMPTY;
+                }
+                // words are not ok when intersecting slot has nothing
+                if (!f->nice && count == 0) {
+                    is_backtrack = 1;
+                }
+            }
+        }
+        if (!is_backtrack) {
+            for (k = 0; k < slot->length; k++) {
+                int cx = slot->x + (slot->dir == DIR_ACROSS ? k : 0);
+                int cy = slot->y + (slot->dir == DIR_DOWN ? k : 0);
+                cgrid[cx + cy * width].c = word[k];
+                if (affected[k] >= 0) {
+                    int count = determine_count(&f->words, cgrid, width, height, &slots[affected[k]]);
+                    (&slots[affected[k]])->count = count;
+                    // if an intersecting slot is not yet done, reset
+                    // offset because constraints have changed.
+                    if (!slots[affected[k]].done) {
+                        (&slots[affected[k]])->offset = 0;
+                    }
+                }
+            }
+        }
+    }
+    if (is_backtrack) {
+        is_word_ok = 0;
+        if (f->n_done_slots > 0) {
+            if (f->nice ? f->n_done_slots == f->nice_count : f->n_done_slots > f->best_n_done_slots) {
+                f->best_n_done_slots = f->n_done_slots;
+                memcpy(f->best, cgrid, width * height * sizeof(Cell));
+                f->has_best = 1;
+            }
+            int cleared = backtrack(&f->words, cgrid, width, height, slots, n_slots, order, f->n_done_slots, index);
+            //assert cleared > 0
+            int c;
+            for (c = f->n_done_slots; c >= f->n_done_slots - cleared; c--) {
+                order[c] = -1;
+            }
+            f->n_done_slots -= cleared;
+        }
+    }
+    if (is_word_ok) {
+        slot->done = 1;
+        order[f->n_done_slots] = index;
+        f->n_done_slots++;
+    }
+    if (f->nice && f->n_done_slots == f->nice_count) return 0;
+    f->attempts++;
+    return 1;
+}
+
+// fill the grid with the greedy fill engine, the result is a list with the
+// complete fill or, if there is none, the best partial fill, each attempt
+// runs without the GIL and the progress callable of the options is called
+// after the first attempt and then every FILL_PROGRESS_INTERVAL seconds
+static PyObject*
+fill_greedy(PyObject *words, PyObject *options, Cell *cgrid, int width, int height, Slot *slots, int n_slots, int n_done_slots) {
+    PyObject *progress = get_fill_progress(options);
+    if (!progress && PyErr_Occurred()) return NULL;
+    GreedyFill f;
+    int m;
+    for (m = 0; m < n_slots; m++) {
+        slots[m].candidates = NULL;
+    }
+    int is_read = read_greedy_words(words, &f.words);
+    for (m = 0; is_read && m < n_slots; m++) {
+        is_read = read_slot_candidates(&slots[m]);
+    }
+    if (!is_read) {
+        free_greedy_fill(&f.words, slots, n_slots);
+        return NULL;
+    }
+    for (m = 0; m < n_slots; m++) {
+        slots[m].count = count_words(&f.words, slots[m].length, slots[m].cs);
+    }
+    int order[n_slots];
+    for (m = 0; m < n_slots; m++) {
+        order[m] = -1;
+    }
+    Cell best[width * height];
+    f.cgrid = cgrid;
+    f.width = width;
+    f.height = height;
+    f.slots = slots;
+    f.n_slots = n_slots;
+    f.order = order;
+    f.n_done_slots = n_done_slots;
+    f.start = get_int_option(options, "start", FILL_START_AT_AUTO);
+    f.nice = get_int_option(options, "nice", 0);
+    f.nice_count = get_int_option(options, "nice_count", 0);
+    f.duplicate = get_int_option(options, "duplicate", 0);
+    f.attempts = 0;
+    f.best = best;
+    f.has_best = 0;
+    f.best_n_done_slots = 0;
+
+    // only the propagating engine can fill without the index, which is
+    // locked during each attempt only so progress may use it, the words of
+    // the fill were checked against the words of the index so the fill
+    // stops when those are replaced
+    const long generation = index_generations[0];
+    FillBudget budget;
+    read_fill_budget(options, FILL_MAX_ATTEMPTS, &budget);
+    const double start = now_seconds();
+    double reported = start - FILL_PROGRESS_INTERVAL;
+    const char *status = NULL;
+    while (!status) {
+        status = fill_stop_reason(&budget, f.attempts);
+        if (status) break;
+        int busy;
+        lock_index();
+        if (index_generations[0] != generation) {
+            unlock_index();
+            status = "changed";
+            break;
+        }
+        Py_BEGIN_ALLOW_THREADS
+        busy = greedy_fill_attempt(&f);
+        Py_END_ALLOW_THREADS
+        unlock_index();
+        if (!busy) break;
+        const double now = now_seconds();
+        if (progress && now - reported >= FILL_PROGRESS_INTERVAL) {
+            reported = now;
+            int n_filled = f.n_done_slots;
+            if (f.has_best && f.best_n_done_slots > n_filled) n_filled = f.best_n_done_slots;
+            PyObject *fill = gather_fill(greedy_best_cells(&f), width, height);
+            if (!call_fill_progress(progress, fill, n_filled, f.attempts, now - start)) {
+                free_greedy_fill(&f.words, slots, n_slots);
+                return NULL;
+            }
+        }
+    }
+    if (!status) {
+        status = (f.nice ? f.n_done_slots == f.nice_count : f.n_done_slots == n_slots) ? "complete" : "exhausted";
+    }
+    free_greedy_fill(&f.words, slots, n_slots);
+    set_fill_stats(options, status, f.attempts, 0, 0);
+    PyObject *result = PyList_New(0);
+    Cell *cells = greedy_best_cells(&f);
+    if (result && cells) {
+        PyObject *fill = gather_fill(cells, width, height);
+        PyList_Append(result, fill);
+        Py_DECREF(fill);
+    }
+    return result;
+}
+
 static PyObject*
 cPalabra_fill(PyObject *self, PyObject *args) {
     PyObject *grid;
@@ -307,17 +1584,13 @@ cPalabra_fill(PyObject *self, PyObject *args) {
     if (!PyArg_ParseTuple(args, "OOOO", &grid, &words, &meta, &options))
         return NULL;
 
-    const int OPTION_START = (int) PyInt_AsLong(PyDict_GetItem(options, PyString_FromString("start")));
-    const int OPTION_NICE = (int) PyInt_AsLong(PyDict_GetItem(options, PyString_FromString("nice")));
     const int OPTION_DUPLICATE = (int) PyInt_AsLong(PyDict_GetItem(options, PyString_FromString("duplicate")));
-    const int NICE_COUNT = (int) PyInt_AsLong(PyDict_GetItem(options, PyString_FromString("nice_count")));
+    const int OPTION_ENGINE = get_int_option(options, "engine", FILL_ENGINE_GREEDY);
 
     const int width = (int) PyInt_AsLong(PyObject_GetAttrString(grid, "width"));
     const int height = (int) PyInt_AsLong(PyObject_GetAttrString(grid, "height"));
     PyObject* data = PyObject_GetAttrString(grid, "data");
 
-    const int OUTPUT_DEBUG = 0;
-
     int x;
     int y;
     Cell cgrid[width * height];
@@ -378,239 +1651,30 @@ cPalabra_fill(PyObject *self, PyObject *args) {
         }
 
         slots[m].cs = PyMem_Malloc(length * sizeof(char) + 1);
-        if (!slots[m].cs) {
-            printf("Warning: fill failed to obtain constraints.\n");
-            return NULL;
-        }
-        get_constraints_i(cgrid, width, height, &slots[m], slots[m].cs);
-        slots[m].count = count_words(words, length, slots[m].cs);
-        slots[m].done = 1;
-        slots[m].offset = 0;
-        int j;
-        for (j = 0; j < length; j++) {
-            if (slots[m].cs[j] == CONSTRAINT_EMPTY) {
-                slots[m].done = 0;
-            }
-        }
-        if (slots[m].done) {
-            n_done_slots++;
-        }
-    }
-
-    int order[n_slots];
-    int o;
-    for (o = 0; o < n_slots; o++) {
-        order[o] = -1;
-    }
-
-    int attempts = 0;
-    PyObject *result = PyList_New(0);
-    PyObject *best_fill = NULL;
-    int best_n_done_slots = 0;
-    while (attempts < 1000) {
-        int index = -1;
-        if (OPTION_NICE) {
-            index = find_nice_slot(words, slots, n_slots, width, height, order);
-        } else if (attempts == 0 || n_done_slots == 0) {
-            index = find_initial_slot(slots, n_slots, OPTION_START);
-        } else {
-            index = find_slot(slots, n_slots, order);
-        }
-        if (index < 0) break;
-        Slot *slot = &slots[index];
-        if (DEBUG) {
-            printf("Searching word for (%i, %i, %s, %i) at index %i: \n", slot->x, slot->y, slot->dir == 0 ? "across" : "down", slot->count, index);
-        }
-        get_constraints_i(cgrid, width, height, slot, slot->cs);
-
-        char *cs_i[slot->length];
-        for (m = 0; m < slot->length; m++) {
-            cs_i[m] = NULL;
-        }
-        int offsets[slot->length];
-        Sptr results[slot->length];
-        int skipped[slot->length];
-        int t;
-        for (t = 0; t < slot->length; t++) {
-            skipped[t] = 0;
-            results[t] = NULL;
-        }
-        if (!OPTION_NICE) {
-            for (m = 0; m < n_slots; m++) {
-                if (is_intersecting(slot, &slots[m])) {
-                    int index = 0;
-                    int offset = 0;
-                    if (slot->dir == DIR_ACROSS) {
-                        index = slots[m].x - slot->x;
-                        offset = slot->y - slots[m].y;
-                    } else {
-                        index = (&slots[m])->y - slot->y;
-                        offset = slot->x - (&slots[m])->x;
-                    }
-                    cs_i[index] = PyMem_Malloc(slots[m].length * sizeof(char) + 1);
-                    offsets[index] = offset;
-                    get_constraints_i(cgrid, width, height, &slots[m], cs_i[index]);
-                }
-            }
-            // TODO index
-            // TODO min_score
-            analyze_intersect_slot2(results, skipped, offsets, cs_i, slot->length, 0, -9999);
-        }
-
-        int is_word_ok = 1;
-
-        /*int s;
-        for (s = 0; s < n_slots; s++) {
-            printf("%i %i %i (%i), ", slots[s].x, slots[s].y, slots[s].dir, slots[s].offset);
-        }*/
-
-        //printf("Trying for %i %i %i\n", slot->x, slot->y, slot->dir);
-        char* word = find_candidate(cs_i, results, slot, slot->cs, OPTION_NICE, slot->offset);
-        //if (word) printf("before %s at %i %i %i from %i\n", word, slot->x, slot->y, slot->dir, slot->offset);
-        if (0) {
-            PyObject *val = Py_BuildValue("(ssiiii)", "before", word, slot->x, slot->y, slot->dir, slot->offset);
-            PyList_Append(result, val);
-            Py_DECREF(val);
-        }
-
-        if (word && OPTION_DUPLICATE) {
-            int duplicates[n_slots];
-            for (t = 0; t < n_slots; t++) {
-                duplicates[t] = 0;
-            }
-            while (1) {
-                int added_offset = 0;
-                int next = 0;
-                for (t = 0; t < n_slots; t++) {
-                    if (!slots[t].done) continue;
-                    if (duplicates[t]) added_offset++;
-                    char *word_t = get_constraints(cgrid, width, height, &slots[t]);
-                    if (word_t && strcmp(word, word_t) == 0) {
-                        PyMem_Free(word_t);
-                        duplicates[t] = 1;
-                        added_offset++;
-                        word = find_candidate(cs_i, results, slot, slot->cs, OPTION_NICE, slot->offset + added_offset);
-                        next = word != NULL;
-                        break;
-                    }
-                }
-                if (!next) break;
-            }
-        }
-        //if (word) printf("after %s at %i %i %i from %i\n", word, slot->x, slot->y, slot->dir, slot->offset);
-        if (0 && word) {
-            PyObject *val = Py_BuildValue("(ssiiii)", "after", word, slot->x, slot->y, slot->dir, slot->offset);
-            PyList_Append(result, val);
-            Py_DECREF(val);
-        }
-
-        for (m = 0; m < slot->length; m++) {
-            if (cs_i[m] != NULL) {
-                PyMem_Free(cs_i[m]);
-            }
-        }
-
-        for (t = 0; t < slot->length; t++) {
-            if (skipped[t] == 0 && results[t] != NULL) {
-                PyMem_Free(results[t]->chars);
-                PyMem_Free(results[t]);
-            }
-        }
-
-        int is_backtrack = 0;
-        if (!word) {
-            is_backtrack = 1;
-        }
-        if (word) {
-            int affected[slot->length];
-            int k;
-            for (k = 0; k < slot->length; k++) {
-                // mark the affected slot of the modified cell
-                affected[k] = -1;
-                int cx = slot->x + (slot->dir == DIR_ACROSS ? k : 0);
-                int cy = slot->y + (slot->dir == DIR_DOWN ? k : 0);
-                int dir = slot->dir == DIR_ACROSS ? 1 : 0;
-                int indexD = get_slot_index(slots, n_slots, cx, cy, dir);
-                if (indexD >= 0 && indexD != index) {
-                    affected[k] = indexD;
-                }
-            }
-            // update counts for affected slots
-            slot->count = 1;
-            for (k = 0; k < slot->length; k++) {
-                if (affected[k] >= 0) {
-                    int cx = slot->x + (slot->dir == DIR_ACROSS ? k : 0);
-                    int cy = slot->y + (slot->dir == DIR_DOWN ? k : 0);
-                    int is_empty = cgrid[cx + cy * width].c == CONSTRAINT_EMPTY;
-                    cgrid[cx + cy * width].c = word[k];
-                    int count = determine_count(words, cgrid, width, height, &slots[affected[k]]);
-                    if (is_empty) {
-                        cgrid[cx + cy * width].c = CONSTRAINT_EMPTY;
-                    }
-                    // words are not ok when intersecting slot has nothing
-                    if (!OPTION_NICE && count == 0) {
-                        is_backtrack = 1;
-                    }
-                }
-            }
-            if (!is_backtrack) {
-                for (k = 0; k < slot->length; k++) {
-                    int cx = slot->x + (slot->dir == DIR_ACROSS ? k : 0);
-                    int cy = slot->y + (slot->dir == DIR_DOWN ? k : 0);
-                    cgrid[cx + cy * width].c = word[k];
-                    if (affected[k] >= 0) {
-                        int count = determine_count(words, cgrid, width, height, &slots[affected[k]]);
-                        (&slots[affected[k]])->count = count;
-                        // if an intersecting slot is not yet done, reset
-                        // offset because constraints have changed.
-                        if (!slots[affected[k]].done) {
-                            (&slots[affected[k]])->offset = 0;
-                        }
-                    }
-                }
-            }
+        if (!slots[m].cs) {
+            printf("Warning: fill failed to obtain constraints.\n");
+            return NULL;
         }
-        if (is_backtrack) {
-            //printf("Backtracking\n");
-            is_word_ok = 0;
-            if (n_done_slots > 0) {
-                if (OPTION_NICE ? n_done_slots == NICE_COUNT : n_done_slots > best_n_done_slots) {
-                    best_n_done_slots = n_done_slots;
-                    Py_XDECREF(best_fill);
-                    best_fill = gather_fill(cgrid, width, height);
-                }
-                int c;
-                for (c = 0; c < n_slots; c++) {
-                    if (order[c] < 0) break;
-                }
-                int cleared = backtrack(words, cgrid, width, height, slots, n_slots, order, n_done_slots, index);
-                //assert cleared > 0
-                for (c = n_done_slots; c >= n_done_slots - cleared; c--) {
-                    order[c] = -1;
-                }
-                n_done_slots -= cleared;
+        get_constraints_i(cgrid, width, height, &slots[m], slots[m].cs);
+        slots[m].count = 0;
+        slots[m].done = 1;
+        slots[m].offset = 0;
+        int j;
+        for (j = 0; j < length; j++) {
+            if (slots[m].cs[j] == CONSTRAINT_EMPTY) {
+                slots[m].done = 0;
             }
         }
-        if (OUTPUT_DEBUG) {
-            PyObject *val = gather_fill(cgrid, width, height);
-            PyList_Append(result, val);
-            Py_DECREF(val);
-        }
-        if (is_word_ok) {
-            slot->done = 1;
-            order[n_done_slots] = index;
+        if (slots[m].done) {
             n_done_slots++;
-            //printf("Filled in: %s (%i %i %i)\n", word, slot->x, slot->y, slot->dir);
         }
-        if (OPTION_NICE && n_done_slots == NICE_COUNT) break;
-        attempts++;
-    }
-    if (best_fill == NULL && (OPTION_NICE ? n_done_slots == NICE_COUNT : 1)) {
-        best_fill = gather_fill(cgrid, width, height);
     }
-    if (best_fill != NULL) {
-        PyList_Append(result, best_fill);
-        Py_DECREF(best_fill);
+
+    PyObject *result;
+    if (OPTION_ENGINE == FILL_ENGINE_PROPAGATE) {
+        result = fill_propagating(words, options, cgrid, width, height, slots, n_slots, OPTION_DUPLICATE);
+    } else {
+        result = fill_greedy(words, options, cgrid, width, height, slots, n_slots, n_done_slots);
     }
     for (m = 0; m < n_slots; m++) {
         PyMem_Free(slots[m].cs);
@@ -986,76 +2050,100 @@ cPalabra_compute_render_lines(PyObject *self, PyObject *args) {
 }
 
 static PyObject*
-cPalabra_compute_distances(PyObject *self, PyObject *args) {
-    /* NO LONGER UPDATED:
+cPalabra_sort_by_distance(PyObject *self, PyObject *args) {
+    /*
     def compute_distance(w):
         places = 0
         for i, c in enumerate(w):
             l = cs[x, y, d][i][1]
             l_i = cs[x, y, d][i][0]
-            for j, item in enumerate(a[l][l_i]):
-                if item[0] == c:
-                    places += j
-                    break
+            places += ranks[l][l_i * 256 + ord(c)]
         return places
-    data = [(w, compute_distance(w)) for w in words]
+    return [w for w, score in sorted(words, key=lambda item: compute_distance(item[0]))]
     */
     PyObject *words;
     PyObject *cs;
-    PyObject *counts;
+    PyObject *ranks;
     PyObject *key;
-    if (!PyArg_ParseTuple(args, "OOOO", &words, &cs, &counts, &key))
+    if (!PyArg_ParseTuple(args, "OOOO", &words, &cs, &ranks, &key))
+        return NULL;
+    PyObject *cs_item = PyDict_GetItem(cs, key);
+    if (!cs_item || !PyList_Check(cs_item)) {
+        PyErr_SetString(PyExc_KeyError, "no constraints for slot");
         return NULL;
-
-    PyObject *py_lengths[MAX_WORD_LENGTH];
-    int m;
-    for (m = 0; m < MAX_WORD_LENGTH; m++) {
-        py_lengths[m] = PyInt_FromLong(m);
     }
-
-    PyObject *result = PyList_New(0);
+    // the ranks of the characters at the intersecting position of each cell
+    const unsigned short *tables[MAX_WORD_LENGTH];
+    Py_ssize_t n_cells = PyList_GET_SIZE(cs_item);
+    if (n_cells > MAX_WORD_LENGTH) n_cells = MAX_WORD_LENGTH;
+    Py_ssize_t i;
+    for (i = 0; i < n_cells; i++) {
+        PyObject *cs_item_i = PyList_GET_ITEM(cs_item, i);
+        const int l_i = (int) PyInt_AsLong(PyTuple_GET_ITEM(cs_item_i, 0));
+        PyObject *py_l = PyTuple_GET_ITEM(cs_item_i, 1);
+        PyObject *table = PyDict_GetItem(ranks, py_l);
+        const void *buffer;
+        Py_ssize_t size;
+        if (!table || PyObject_AsReadBuffer(table, &buffer, &size) < 0
+            || l_i < 0 || (l_i + 1) * 256 * sizeof(unsigned short) > size) {
+            PyErr_Clear();
+            PyErr_SetString(PyExc_ValueError, "no letter ranks for intersecting word");
+            return NULL;
+        }
+        tables[i] = (const unsigned short *) buffer + l_i * 256;
+    }
+    if (!PyList_Check(words)) {
+        PyErr_SetString(PyExc_TypeError, "expected a list of words");
+        return NULL;
+    }
+    const Py_ssize_t n_words = PyList_GET_SIZE(words);
+    // a distance is at most 256 for each cell so the words are
+    // ordered with a counting sort, which keeps words of equal
+    // distance in their original order
+    const int max_distance = n_cells * 256;
+    int *distances = PyMem_Malloc(n_words * sizeof(int) + 1);
+    Py_ssize_t *starts = PyMem_Malloc((max_distance + 2) * sizeof(Py_ssize_t));
+    if (!distances || !starts) {
+        PyMem_Free(distances);
+        PyMem_Free(starts);
+        return PyErr_NoMemory();
+    }
+    memset(starts, 0, (max_distance + 2) * sizeof(Py_ssize_t));
     Py_ssize_t w;
-    for (w = 0; w < PyList_GET_SIZE(words); w++) {
-        int count = 0;
-        char *word = PyString_AS_STRING(PyList_GET_ITEM(words, w));
-        int i;
-        for (i = 0; i < strlen(word); i++) {
-            char c = *(word + i);
-            PyObject *cs_item = PyDict_GetItem(cs, key);
-            PyObject *cs_item_i = PyList_GET_ITEM(cs_item, i);
-            PyObject *py_l = PyTuple_GET_ITEM(cs_item_i, 1);
-            PyObject *py_l_i = PyTuple_GET_ITEM(cs_item_i, 0);
-            const int l = (int) PyInt_AS_LONG(py_l);
-            const int l_i = (int) PyInt_AS_LONG(py_l_i);
-
-            PyObject *a_l = PyDict_GetItem(counts, py_lengths[l]);
-            PyObject *a_l_i = PyDict_GetItem(a_l, py_lengths[l_i]);
-
-            int occurs = 0;
-            int j;
-            for (j = 0; j < PyList_GET_SIZE(a_l_i); j++) {
-                PyObject *item = PyList_GET_ITEM(a_l_i, j);
-                PyObject *py_c = PyTuple_GET_ITEM(item, 0);
-                char *c_c = PyString_AS_STRING(py_c);
-                if (c == *c_c) {
-                    count += j;
-                    // TODO use number of times that character occurs as well
-                    occurs = 1;
-                    break;
-                }
-            }
-            // penalize score if character does not occur at all
-            if (!occurs) {
-                count += PyList_GET_SIZE(a_l_i);
-            }
+    for (w = 0; w < n_words; w++) {
+        PyObject *item = PyList_GET_ITEM(words, w);
+        PyObject *py_word = PyTuple_Check(item) && PyTuple_GET_SIZE(item) > 0
+            ? PyTuple_GET_ITEM(item, 0) : NULL;
+        if (!py_word || !PyString_Check(py_word)) {
+            PyMem_Free(distances);
+            PyMem_Free(starts);
+            PyErr_SetString(PyExc_TypeError, "expected (word, score) tuples");
+            return NULL;
         }
-        PyObject* item = Py_BuildValue("(si)", word, count);
-        PyList_Append(result, item);
-        Py_DECREF(item);
+        const unsigned char *word = (const unsigned char *) PyString_AS_STRING(py_word);
+        Py_ssize_t n = PyString_GET_SIZE(py_word);
+        if (n > n_cells) n = n_cells;
+        int distance = 0;
+        for (i = 0; i < n; i++) {
+            distance += tables[i][word[i]];
+        }
+        distances[w] = distance;
+        starts[distance + 1]++;
     }
-    for (m = 0; m < MAX_WORD_LENGTH; m++) {
-        Py_DECREF(py_lengths[m]);
+    int d;
+    for (d = 0; d <= max_distance; d++) {
+        starts[d + 1] += starts[d];
+    }
+    PyObject *result = PyList_New(n_words);
+    if (result) {
+        for (w = 0; w < n_words; w++) {
+            PyObject *py_word = PyTuple_GET_ITEM(PyList_GET_ITEM(words, w), 0);
+            Py_INCREF(py_word);
+            PyList_SET_ITEM(result, starts[distances[w]]++, py_word);
+        }
     }
+    PyMem_Free(distances);
+    PyMem_Free(starts);
     return result;
 }
 
@@ -1077,12 +2165,23 @@ cPalabra_compute_counts(PyObject *self, PyObject *args) {
     PyObject *words;
     if (!PyArg_ParseTuple(args, "O", &words))
         return NULL;
+    // the number of words with each character at each position and
+    // the characters at each position in order of first occurrence
+    int counts[MAX_WORD_LENGTH][256];
+    unsigned char chars[MAX_WORD_LENGTH][256];
+    int n_chars[MAX_WORD_LENGTH];
     PyObject *result = PyDict_New();
+    if (!result) return NULL;
     int l;
     for (l = 0; l < MAX_WORD_LENGTH; l++) {
         PyObject *key = PyInt_FromLong(l);
         PyObject *a_l = PyDict_New();
-        PyDict_SetItem(result, key, a_l);
+        if (!key || !a_l || PyDict_SetItem(result, key, a_l) < 0) {
+            Py_XDECREF(key);
+            Py_XDECREF(a_l);
+            Py_DECREF(result);
+            return NULL;
+        }
         int m;
         for (m = 0; m < MAX_WORD_LENGTH; m++) {
             PyObject *key2 = PyInt_FromLong(m);
@@ -1091,39 +2190,29 @@ cPalabra_compute_counts(PyObject *self, PyObject *args) {
             Py_DECREF(key2);
             Py_DECREF(a_l_i);
         }
-        char *a_chars[l];
-        int *a_counts[l];
-        for (m = 0; m < l; m++) {
-            a_chars[m] = malloc(sizeof(char) * MAX_ALPHABET_SIZE);
-            a_counts[m] = malloc(sizeof(int) * MAX_ALPHABET_SIZE);
-            int k;
-            for (k = 0; k < MAX_ALPHABET_SIZE; k++) {
-                a_chars[m][k] = -1;
-                a_counts[m][k] = 0;
-            }
-        }
+        memset(counts, 0, l * sizeof(counts[0]));
+        memset(n_chars, 0, l * sizeof(int));
         PyObject *l_words = PyDict_GetItem(words, key);
+        Py_ssize_t n_words = l_words ? PyList_Size(l_words) : 0;
         Py_ssize_t w;
-        for (w = 0; w < PyList_Size(l_words); w++) {
+        for (w = 0; w < n_words; w++) {
             PyObject* item = PyList_GET_ITEM(l_words, w);
-            PyObject* word_str;
-            const int word_score;
-            if (!PyArg_ParseTuple(item, "Oi", &word_str, &word_score))
+            PyObject* word_str = PyTuple_Check(item) && PyTuple_GET_SIZE(item) > 0
+                ? PyTuple_GET_ITEM(item, 0) : NULL;
+            if (!word_str || !PyString_Check(word_str)) {
+                PyErr_SetString(PyExc_TypeError, "expected (word, score) tuples");
+                Py_DECREF(key);
+                Py_DECREF(a_l);
+                Py_DECREF(result);
                 return NULL;
-            char *word = PyString_AsString(word_str);
+            }
+            const unsigned char *word = (const unsigned char *) PyString_AS_STRING(word_str);
+            Py_ssize_t n = PyString_GET_SIZE(word_str);
             int i;
-            for (i = 0; i < strlen(word); i++) {
-                char c = *(word + i);
-                int j;
-                for (j = 0; j < MAX_ALPHABET_SIZE; j++) {
-                    if (a_chars[i][j] == -1) {
-                        a_chars[i][j] = c;
-                        a_counts[i][j] = 1;
-                        break;
-                    } else if (a_chars[i][j] == c) {
-                        a_counts[i][j] += 1;
-                        break;
-                    }
+            for (i = 0; i < n && i < l; i++) {
+                const unsigned char c = word[i];
+                if (counts[i][c]++ == 0) {
+                    chars[i][n_chars[i]++] = c;
                 }
             }
         }
@@ -1131,21 +2220,15 @@ cPalabra_compute_counts(PyObject *self, PyObject *args) {
             PyObject *key_m = PyInt_FromLong(m);
             PyObject *a_l_i = PyDict_GetItem(a_l, key_m);
             int k;
-            for (k = 0; k < MAX_ALPHABET_SIZE; k++) {
-                if (a_chars[m][k] == -1) break;
-                char str[2];
-                str[0] = a_chars[m][k];
-                str[1] = '\0';
-                PyObject *py_c = PyString_FromString(str);
-                PyObject *py_count = PyInt_FromLong(a_counts[m][k]);
+            for (k = 0; k < n_chars[m]; k++) {
+                const char str = chars[m][k];
+                PyObject *py_c = PyString_FromStringAndSize(&str, 1);
+                PyObject *py_count = PyInt_FromLong(counts[m][chars[m][k]]);
                 PyDict_SetItem(a_l_i, py_c, py_count);
                 Py_DECREF(py_c);
                 Py_DECREF(py_count);
             }
-        }
-        for (m = 0; m < l; m++) {
-            free(a_chars[m]);
-            free(a_counts[m]);
+            Py_DECREF(key_m);
         }
         Py_DECREF(key);
         Py_DECREF(a_l);
@@ -1153,6 +2236,80 @@ cPalabra_compute_counts(PyObject *self, PyObject *args) {
     return result;
 }
 
+// count the words of a word list by length
+static PyObject*
+cPalabra_word_counts(PyObject *self, PyObject *args) {
+    const int index;
+    if (!PyArg_ParseTuple(args, "i", &index))
+        return NULL;
+    if (index < 0 || index > MAX_WORD_LISTS) {
+        PyErr_SetString(PyExc_ValueError, "invalid word list index");
+        return NULL;
+    }
+    PyObject *counts = PyDict_New();
+    if (!counts) return NULL;
+    int l;
+    for (l = 0; l < MAX_WORD_LENGTH; l++) {
+        PyObject *key = PyInt_FromLong(l);
+        PyObject *count = PyInt_FromLong(l > 0 ? count_list_words(index, l) : 0);
+        if (!key || !count || PyDict_SetItem(counts, key, count) < 0) {
+            Py_XDECREF(key);
+            Py_XDECREF(count);
+            Py_DECREF(counts);
+            return NULL;
+        }
+        Py_DECREF(key);
+        Py_DECREF(count);
+    }
+    return counts;
+}
+
+// count the words of a word list by score
+static PyObject*
+cPalabra_score_counts(PyObject *self, PyObject *args) {
+    const int index;
+    if (!PyArg_ParseTuple(args, "i", &index))
+        return NULL;
+    if (index < 0 || index > MAX_WORD_LISTS) {
+        PyErr_SetString(PyExc_ValueError, "invalid word list index");
+        return NULL;
+    }
+    PyObject *counts = PyDict_New();
+    if (!counts) return NULL;
+    int l;
+    for (l = 1; l < MAX_WORD_LENGTH; l++) {
+        int *scores;
+        const int n_words = sorted_scores(index, l, &scores);
+        if (n_words < 0) {
+            Py_DECREF(counts);
+            return PyErr_NoMemory();
+        }
+        // the scores are sorted so each run of equal scores is counted at once
+        int w = 0;
+        while (w < n_words) {
+            int end = w + 1;
+            while (end < n_words && scores[end] == scores[w]) end++;
+            PyObject *key = PyInt_FromLong(scores[w]);
+            PyObject *previous = key ? PyDict_GetItem(counts, key) : NULL;
+            PyObject *count = PyInt_FromLong(end - w + (previous ? PyInt_AsLong(previous) : 0));
+            if (!key || !count || PyDict_SetItem(counts, key, count) < 0) {
+                Py_XDECREF(key);
+                Py_XDECREF(count);
+                break;
+            }
+            Py_DECREF(key);
+            Py_DECREF(count);
+            w = end;
+        }
+        PyMem_Free(scores);
+        if (w < n_words) {
+            Py_DECREF(counts);
+            return NULL;
+        }
+    }
+    return counts;
+}
+
 int read_counts(char *counts_c, int *counts_i, PyObject *counts) {
     Py_ssize_t n_counts = PyList_Size(counts);
     int i;
@@ -1174,75 +2331,281 @@ cPalabra_get_contained_words(PyObject *self, PyObject *args) {
     const int length;
     PyObject *counts;
     const int counts_length;
-    if (!PyArg_ParseTuple(args, "iiOi", &index, &length, &counts, &counts_length))
+    int limit = -1;
+    if (!PyArg_ParseTuple(args, "iiOi|i", &index, &length, &counts, &counts_length, &limit))
         return NULL;
-    char counts_c[counts_length];
-    int counts_i[counts_length];
+    char counts_c[counts_length + 1];
+    int counts_i[counts_length + 1];
     if (!read_counts(counts_c, counts_i, counts))
         return NULL;
-
-    char cons_str[length + 1];
+    if (length <= 0 || length >= MAX_WORD_LENGTH)
+        return PyList_New(0);
+    unsigned char need[LETTER_SLOTS];
+    memset(need, 0, LETTER_SLOTS);
     int i;
-    for (i = 0; i < length; i++) {
-        cons_str[i] = '.';
+    for (i = 0; i < counts_length; i++) {
+        const int slot = letter_slot(counts_c[i]);
+        // only letters can be contained in words
+        if (slot == 0)
+            return PyList_New(0);
+        need[slot] += counts_i[i];
+    }
+    BIptr b = get_bitset_index(index, length);
+    if (!b) return PyErr_NoMemory();
+    const int n_positions = limit >= 0 && limit < b->n_words ? limit : b->n_words;
+    int *positions = PyMem_Malloc(n_positions * sizeof(int) + 1);
+    if (!positions) return PyErr_NoMemory();
+    const int n = find_containing_words(b, need, limit, positions);
+    if (n < 0) {
+        PyMem_Free(positions);
+        return PyErr_NoMemory();
+    }
+    PyObject *result = PyList_New(n);
+    int w;
+    for (w = 0; result && w < n; w++) {
+        PyList_SET_ITEM(result, w, PyString_FromStringAndSize(b->words + positions[w] * length, length));
+    }
+    PyMem_Free(positions);
+    return result;
+}
+
+// append the words of the word list with the same letters as word to list,
+// as (word, score), return -1 in case of error
+static int
+append_anagrams(PyObject *list, int index, char *word) {
+    const int length = strlen(word);
+    if (length <= 0 || length >= MAX_WORD_LENGTH)
+        return 0;
+    BIptr b = get_bitset_index(index, length);
+    if (!b) return -1;
+    unsigned char counts[LETTER_SLOTS];
+    // only words of letters have anagrams
+    if (!count_letters(word, length, counts))
+        return 0;
+    int w;
+    for (w = first_anagram(b, counts); w >= 0; w = next_anagram(b, w, counts)) {
+        PyObject *item = Py_BuildValue("(s#i)", b->words + w * length, length, b->scores[w]);
+        if (!item || PyList_Append(list, item) < 0) {
+            Py_XDECREF(item);
+            return -1;
+        }
+        Py_DECREF(item);
     }
-    cons_str[length] = '\0';
+    return b->letters ? 0 : -1;
+}
+
+static PyObject*
+cPalabra_find_anagrams(PyObject *self, PyObject *args) {
+    const int index;
+    char *word;
+    if (!PyArg_ParseTuple(args, "is", &index, &word))
+        return NULL;
     PyObject *result = PyList_New(0);
-    PyObject *mwords = PyList_New(0);
-    mwords = find_matches(mwords, trees[index][length], cons_str);
-    Py_ssize_t m;
-    for (m = 0; m < PyList_Size(mwords); m++) {
-        char *word = PyString_AS_STRING(PyList_GET_ITEM(mwords, m));
-        int ok = 0;
-        for (i = 0; i < counts_length; i++) {
-            int count = 0;
-            int j;
-            for (j = 0; j < strlen(word); j++) {
-                if (word[j] == counts_c[i]) count++;
-            }
-            if (count >= counts_i[i]) {
-                ok++;
+    if (result && append_anagrams(result, index, word) < 0) {
+        Py_DECREF(result);
+        return PyErr_Occurred() ? NULL : PyErr_NoMemory();
+    }
+    return result;
+}
+
+// the threads of one call, the last thread to finish releases done,
+// the locks are shared by the calls as these are serialized by the index lock
+typedef struct {
+    PyThread_type_lock mutex;
+    PyThread_type_lock done;
+    int n_running;
+} ThreadJob;
+
+static PyThread_type_lock job_mutex = NULL;
+static PyThread_type_lock job_done = NULL;
+
+static void
+start_job(ThreadJob *job, int n_threads) {
+    job->mutex = job_mutex;
+    job->done = job_done;
+    job->n_running = n_threads - 1;
+    if (n_threads > 1) {
+        PyThread_acquire_lock(job->done, WAIT_LOCK);
+    }
+}
+
+// called by each thread of the job other than the calling thread
+static void
+finish_job(ThreadJob *job) {
+    PyThread_type_lock done = job->done;
+    PyThread_acquire_lock(job->mutex, WAIT_LOCK);
+    const int last = --job->n_running == 0;
+    PyThread_release_lock(job->mutex);
+    // the job may be gone as soon as done is released
+    if (last) {
+        PyThread_release_lock(done);
+    }
+}
+
+// wait until the other threads of the job have finished
+static void
+wait_job(ThreadJob *job, int n_threads) {
+    if (n_threads > 1) {
+        PyThread_acquire_lock(job->done, WAIT_LOCK);
+        PyThread_release_lock(job->done);
+    }
+}
+
+// a range of pairs that is verified by one thread, the words that are found
+// are stored as (pair, position of the word in its bitset index)
+typedef struct {
+    ThreadJob *job;
+    int index;
+    char **letters; // the letters of each pair
+    Py_ssize_t start;
+    Py_ssize_t end;
+    int *found;
+    Py_ssize_t n_found;
+    int failed;
+} VerifySlice;
+
+// find the anagrams of the letters of the pairs of the slice, this
+// does not need the GIL and only reads the prepared indexes
+static void
+verify_slice(VerifySlice *slice) {
+    Py_ssize_t size = 0;
+    Py_ssize_t p;
+    for (p = slice->start; p < slice->end; p++) {
+        const int length = strlen(slice->letters[p]);
+        if (length <= 0 || length >= MAX_WORD_LENGTH)
+            continue;
+        BIptr b = bitsets[slice->index][length];
+        if (!b || !b->letters)
+            continue;
+        unsigned char counts[LETTER_SLOTS];
+        if (!count_letters(slice->letters[p], length, counts))
+            continue;
+        int w;
+        for (w = first_anagram(b, counts); w >= 0; w = next_anagram(b, w, counts)) {
+            if (slice->n_found == size) {
+                size = 2 * size + 64;
+                int *found = PyMem_Realloc(slice->found, 2 * size * sizeof(int));
+                if (!found) {
+                    slice->failed = 1;
+                    return;
+                }
+                slice->found = found;
             }
-        }
-        if (ok == counts_length) {
-            PyObject *py_word = PyString_FromString(word);
-            PyList_Append(result, py_word);
-            Py_DECREF(py_word);
+            slice->found[2 * slice->n_found] = (int) p;
+            slice->found[2 * slice->n_found + 1] = w;
+            slice->n_found++;
         }
     }
-    return result;
 }
 
+static void
+verify_thread(void *arg) {
+    VerifySlice *slice = (VerifySlice *) arg;
+    verify_slice(slice);
+    finish_job(slice->job);
+}
+
+// given pairs (a, b), produce all pairs (a, w) such that w is a word of
+// the word list with the same letters as b, the pairs are divided over
+// n_threads threads which run without the GIL
 static PyObject*
 cPalabra_verify_contained_words(PyObject *self, PyObject *args) {
     const int index;
     PyObject *pairs;
-    if (!PyArg_ParseTuple(args, "iO", &index, &pairs))
+    int n_threads = 1;
+    if (!PyArg_ParseTuple(args, "iO|i", &index, &pairs, &n_threads))
         return NULL;
-    int test = 0;
-    PyObject *result = PyList_New(0);
+    if (index < 0 || index > MAX_WORD_LISTS) {
+        PyErr_SetString(PyExc_ValueError, "invalid word list index");
+        return NULL;
+    }
+    // a copy so that the pairs remain while the GIL is released
+    PyObject *items = PySequence_Tuple(pairs);
+    if (!items) return NULL;
+    const Py_ssize_t n_pairs = PyTuple_GET_SIZE(items);
+    PyObject **firsts = PyMem_Malloc(n_pairs * sizeof(PyObject *) + 1);
+    char **letters = PyMem_Malloc(n_pairs * sizeof(char *) + 1);
+    if (n_threads < 1 || n_pairs == 0) n_threads = 1;
+    if (n_threads > n_pairs && n_pairs > 0) n_threads = (int) n_pairs;
+    VerifySlice *slices = PyMem_Malloc(n_threads * sizeof(VerifySlice));
+    ThreadJob job;
+    PyObject *result = NULL;
+    int n_slices = 0;
+    if (!firsts || !letters || !slices) {
+        PyErr_NoMemory();
+        goto done;
+    }
+    int t;
+    for (t = 0; t < n_threads; t++) {
+        slices[t].job = &job;
+        slices[t].index = index;
+        slices[t].letters = letters;
+        slices[t].start = n_pairs * t / n_threads;
+        slices[t].end = n_pairs * (t + 1) / n_threads;
+        slices[t].found = NULL;
+        slices[t].n_found = 0;
+        slices[t].failed = 0;
+    }
+    n_slices = n_threads;
+    int needed[MAX_WORD_LENGTH];
+    int m;
+    for (m = 0; m < MAX_WORD_LENGTH; m++) {
+        needed[m] = 0;
+    }
     Py_ssize_t p;
-    for (p = 0; p < PyList_Size(pairs); p++) {
-        PyObject *pair = PyList_GET_ITEM(pairs, p);
-        PyObject *w1;
-        PyObject *w2;
-        if (!PyArg_ParseTuple(pair, "OO", &w1, &w2))
-            return NULL;
-        char *w1_word = PyString_AsString(w1);
-        char *w2_word = PyString_AsString(w2);
-
-        test++;
-        PyObject *res = find_matches_i(index, w2_word);
-        Py_ssize_t mm;
-        for (mm = 0; mm < PyList_Size(res); mm++) {
-            char *mm_word = PyString_AS_STRING(PyList_GET_ITEM(res, mm));
-            PyObject* item = Py_BuildValue("(ss)", w1_word, mm_word);
-            PyList_Append(result, item);
-            Py_DECREF(item);
+    for (p = 0; p < n_pairs; p++) {
+        if (!PyArg_ParseTuple(PyTuple_GET_ITEM(items, p), "Os", &firsts[p], &letters[p]))
+            goto done;
+        const int length = strlen(letters[p]);
+        if (length > 0 && length < MAX_WORD_LENGTH)
+            needed[length] = 1;
+    }
+    int prepared = 1;
+    Py_BEGIN_ALLOW_THREADS
+    // the indexes are prepared first so that the threads only read them
+    for (m = 0; m < MAX_WORD_LENGTH; m++) {
+        if (needed[m]) {
+            BIptr b = get_bitset_index(index, m);
+            if (!b || !prepare_anagrams(b)) prepared = 0;
+        }
+    }
+    start_job(&job, n_threads);
+    for (t = 1; t < n_threads; t++) {
+        if (PyThread_start_new_thread(verify_thread, &slices[t]) == -1) {
+            verify_thread(&slices[t]);
+        }
+    }
+    verify_slice(&slices[0]);
+    wait_job(&job, n_threads);
+    Py_END_ALLOW_THREADS
+    Py_ssize_t n_found = 0;
+    for (t = 0; t < n_threads; t++) {
+        if (slices[t].failed) prepared = 0;
+        n_found += slices[t].n_found;
+    }
+    if (!prepared) {
+        PyErr_NoMemory();
+        goto done;
+    }
+    result = PyList_New(n_found);
+    Py_ssize_t r = 0;
+    for (t = 0; result && t < n_threads; t++) {
+        Py_ssize_t f;
+        for (f = 0; f < slices[t].n_found; f++) {
+            const int pair = slices[t].found[2 * f];
+            const int length = strlen(letters[pair]);
+            char *word = bitsets[index][length]->words + slices[t].found[2 * f + 1] * length;
+            PyList_SET_ITEM(result, r++, Py_BuildValue("(Os#)", firsts[pair], word, length));
         }
-        if (test == 1000) break;
     }
-    printf("TEST %i\n", test);
+done:
+    for (t = 0; t < n_slices; t++) {
+        PyMem_Free(slices[t].found);
+    }
+    PyMem_Free(slices);
+    PyMem_Free(letters);
+    PyMem_Free(firsts);
+    Py_DECREF(items);
     return result;
 }
 
@@ -1252,34 +2615,459 @@ cPalabra_update_score(PyObject *self, PyObject *args) {
     const int word_length;
     const int score;
     const int wlist_index;
-    if (!PyArg_ParseTuple(args, "Oiii", &word, &word_length, &score, &wlist_index))
+    const int old_score;
+    if (!PyArg_ParseTuple(args, "Oiiii", &word, &word_length, &score, &wlist_index, &old_score))
         return NULL;
-    update_score(trees[wlist_index][word_length], PyString_AsString(word), score);
+    if (tables[wlist_index][word_length]) {
+        update_score_table(tables[wlist_index][word_length], PyString_AsString(word), old_score, score);
+    } else {
+        update_score(trees[wlist_index][word_length], PyString_AsString(word), old_score, score);
+    }
+    clear_bitset_index(wlist_index, word_length);
+    mark_merged_stale(wlist_index, word_length);
+    clear_analysis_cache(wlist_index);
     Py_INCREF(Py_None); // needed for reference counting
     return Py_None;
 }
 
+// change the scores of all words of a word list: "to" or "by" a value,
+// or "map" to set the score of each word in a dict of words and scores
+static PyObject*
+cPalabra_change_scores(PyObject *self, PyObject *args) {
+    const int index;
+    char *change;
+    PyObject *value;
+    if (!PyArg_ParseTuple(args, "isO", &index, &change, &value))
+        return NULL;
+    if (index < 0 || index > MAX_WORD_LISTS) {
+        PyErr_SetString(PyExc_ValueError, "invalid word list index");
+        return NULL;
+    }
+    int m;
+    if (strcmp(change, "map") == 0) {
+        if (!PyDict_Check(value)) {
+            PyErr_SetString(PyExc_TypeError, "a dict of words and scores is required");
+            return NULL;
+        }
+        PyObject *key;
+        PyObject *score;
+        Py_ssize_t pos = 0;
+        while (PyDict_Next(value, &pos, &key, &score)) {
+            char *word = PyString_AsString(key);
+            const long l_score = PyInt_AsLong(score);
+            if (word == NULL || (l_score == -1 && PyErr_Occurred()))
+                return NULL;
+            const int length = (int) PyString_GET_SIZE(key);
+            if (length <= 0 || length >= MAX_WORD_LENGTH)
+                continue;
+            if (tables[index][length]) {
+                set_scores_table(tables[index][length], word, (int) l_score);
+            } else {
+                set_scores(trees[index][length], word, (int) l_score);
+            }
+        }
+    } else if (strcmp(change, "to") == 0 || strcmp(change, "by") == 0) {
+        const long l_value = PyInt_AsLong(value);
+        if (l_value == -1 && PyErr_Occurred())
+            return NULL;
+        const int by = strcmp(change, "by") == 0;
+        for (m = 0; m < MAX_WORD_LENGTH; m++) {
+            if (tables[index][m]) {
+                change_scores_table(tables[index][m], by, (int) l_value);
+            } else {
+                change_scores(trees[index][m], by, (int) l_value);
+            }
+        }
+    } else {
+        PyErr_SetString(PyExc_ValueError, "change must be to, by or map");
+        return NULL;
+    }
+    for (m = 0; m < MAX_WORD_LENGTH; m++) {
+        clear_bitset_index(index, m);
+        mark_merged_stale(index, m);
+    }
+    clear_analysis_cache(index);
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+// word list files are read in chunks of this size, the chunks of a file
+// of at least LOAD_PARALLEL_SIZE bytes are parsed by several threads
+#define LOAD_CHUNK_SIZE (1 << 22)
+#define LOAD_PARALLEL_SIZE (1 << 23)
+
+// a range of complete lines of a chunk that is parsed by one thread
+typedef struct {
+    ThreadJob *job;
+    const char *start;
+    const char *end;
+    int default_score;
+    LoadedWords loaded[MAX_WORD_LENGTH];
+    int failed;
+} LoadSlice;
+
+static void
+load_slice(LoadSlice *slice) {
+    if (!parse_wordlist(slice->start, slice->end, slice->default_score, slice->loaded))
+        slice->failed = 1;
+}
+
+static void
+load_thread(void *arg) {
+    LoadSlice *slice = (LoadSlice *) arg;
+    load_slice(slice);
+    finish_job(slice->job);
+}
+
+// parse the complete lines of a chunk, divided over the threads at line
+// boundaries, and append the words to loaded in the order of the file
+static int
+load_chunk(const char *chunk, size_t size, LoadSlice *slices, int n_threads, LoadedWords *loaded) {
+    ThreadJob job;
+    const char *start = chunk;
+    int t;
+    for (t = 0; t < n_threads; t++) {
+        const char *end = chunk + size * (t + 1) / n_threads;
+        while (end < chunk + size && end > start && *(end - 1) != '\n') end++;
+        slices[t].job = &job;
+        slices[t].start = start;
+        slices[t].end = end;
+        start = end;
+    }
+    start_job(&job, n_threads);
+    for (t = 1; t < n_threads; t++) {
+        if (PyThread_start_new_thread(load_thread, &slices[t]) == -1) {
+            load_thread(&slices[t]);
+        }
+    }
+    load_slice(&slices[0]);
+    wait_job(&job, n_threads);
+    int ok = 1;
+    for (t = 0; t < n_threads; t++) {
+        if (slices[t].failed) ok = 0;
+        int m;
+        for (m = 1; ok && m < MAX_WORD_LENGTH; m++) {
+            if (!append_loaded_words(&loaded[m], &slices[t].loaded[m], m)) ok = 0;
+        }
+    }
+    return ok;
+}
+
+static int
+compare_loaded_entries(const void *a, const void *b) {
+    const WordEntry *e1 = (const WordEntry *) a;
+    const WordEntry *e2 = (const WordEntry *) b;
+    int cmp = strcmp(e1->word, e2->word);
+    if (cmp != 0) return cmp;
+    if (e1->score != e2->score) return e1->score < e2->score ? -1 : 1;
+    return e1->seq - e2->seq;
+}
+
+// read the words of a word list file into the index, the file is read in
+// chunks without the GIL and progress is called with the fraction of the
+// file that has been read after each chunk, the result is the same as
+// that of cPalabra_preprocess with the words of each length in order,
+// the index lock is only held while the new words replace those of the
+// index so progress may call the other functions of the index
+static PyObject*
+cPalabra_load_wordlist(PyObject *self, PyObject *args) {
+    char *path;
+    const int index;
+    const int default_score;
+    int n_threads = 1;
+    PyObject *progress = Py_None;
+    if (!PyArg_ParseTuple(args, "sii|iO", &path, &index, &default_score, &n_threads, &progress))
+        return NULL;
+    if (index < 0 || index > MAX_WORD_LISTS) {
+        PyErr_SetString(PyExc_ValueError, "invalid word list index");
+        return NULL;
+    }
+    if (progress != Py_None && !PyCallable_Check(progress)) {
+        PyErr_SetString(PyExc_TypeError, "progress must be callable");
+        return NULL;
+    }
+    LoadedWords loaded[MAX_WORD_LENGTH];
+    memset(loaded, 0, sizeof(loaded));
+    Tptr new_trees[MAX_WORD_LENGTH];
+    ABptr new_arenas[MAX_WORD_LENGTH];
+    memset(new_trees, 0, sizeof(new_trees));
+    memset(new_arenas, 0, sizeof(new_arenas));
+    FILE *f = fopen(path, "rb");
+    // a word list that does not exist has no words
+    if (!f && errno != ENOENT) {
+        return PyErr_SetFromErrnoWithFilename(PyExc_IOError, path);
+    }
+    struct stat st;
+    const long long size = f && fstat(fileno(f), &st) == 0 ? st.st_size : 0;
+    if (n_threads < 1 || size < LOAD_PARALLEL_SIZE) n_threads = 1;
+    if (n_threads > MAX_WORD_LISTS) n_threads = MAX_WORD_LISTS;
+    LoadSlice *slices = PyMem_Malloc(n_threads * sizeof(LoadSlice));
+    size_t capacity = LOAD_CHUNK_SIZE;
+    char *buffer = PyMem_Malloc(capacity);
+    if (!slices || !buffer) {
+        if (f) fclose(f);
+        PyMem_Free(slices);
+        PyMem_Free(buffer);
+        return PyErr_NoMemory();
+    }
+    memset(slices, 0, n_threads * sizeof(LoadSlice));
+    int t;
+    for (t = 0; t < n_threads; t++) {
+        slices[t].default_score = default_score;
+    }
+    size_t used = 0;
+    long long n_read = 0;
+    int eof = f == NULL;
+    int failed = 0;
+    PyObject *dict = NULL;
+    while (!eof && !failed) {
+        int read_error = 0;
+        Py_BEGIN_ALLOW_THREADS
+        if (used == capacity) {
+            // a line that does not fit in the buffer
+            char *larger = PyMem_Realloc(buffer, 2 * capacity);
+            if (larger) {
+                buffer = larger;
+                capacity *= 2;
+            } else {
+                failed = 1;
+            }
+        }
+        if (!failed) {
+            used += fread(buffer + used, 1, capacity - used, f);
+            read_error = ferror(f);
+            eof = feof(f) || read_error;
+            size_t end = used;
+            if (!eof) {
+                while (end > 0 && buffer[end - 1] != '\n') end--;
+            }
+            if (end > 0) {
+                if (!load_chunk(buffer, end, slices, n_threads, loaded)) failed = 1;
+                memmove(buffer, buffer + end, used - end);
+                used -= end;
+                n_read += end;
+            }
+        }
+        Py_END_ALLOW_THREADS
+        if (read_error) {
+            PyErr_SetFromErrnoWithFilename(PyExc_IOError, path);
+            goto done;
+        }
+        if (failed) {
+            PyErr_NoMemory();
+            goto done;
+        }
+        if (progress != Py_None) {
+            PyObject *r = PyObject_CallFunction(progress, "d", size > 0 ? (double) n_read / size : 1.0);
+            if (!r) goto done;
+            Py_DECREF(r);
+        }
+    }
+    // the new trees are built aside and only replace those of the index
+    // once all of them have been built, so a failure leaves the index as it was
+    dict = PyDict_New();
+    if (!dict) goto done;
+    int m;
+    for (m = 0; m < MAX_WORD_LENGTH; m++) {
+        const int n_words = loaded[m].n_words;
+        WordEntry *entries = PyMem_Malloc(n_words * sizeof(WordEntry) + 1);
+        PyObject *ws = PyList_New(0);
+        PyObject *key = PyInt_FromLong(m);
+        if (!entries || !ws || !key || PyDict_SetItem(dict, key, ws) < 0) {
+            PyMem_Free(entries);
+            Py_XDECREF(ws);
+            Py_XDECREF(key);
+            Py_CLEAR(dict);
+            if (!PyErr_Occurred()) PyErr_NoMemory();
+            goto done;
+        }
+        Py_DECREF(key);
+        Py_DECREF(ws);
+        int w;
+        for (w = 0; w < n_words; w++) {
+            entries[w].word = loaded[m].words + w * (m + 1);
+            entries[w].score = loaded[m].scores[w];
+            entries[w].seq = w;
+        }
+        qsort(entries, n_words, sizeof(WordEntry), compare_loaded_entries);
+        // the same word and score are only kept once
+        int n_entries = 0;
+        for (w = 0; w < n_words; w++) {
+            if (n_entries > 0 && entries[n_entries - 1].score == entries[w].score
+                && strcmp(entries[n_entries - 1].word, entries[w].word) == 0)
+                continue;
+            entries[n_entries] = entries[w];
+            entries[n_entries].seq = n_entries;
+            n_entries++;
+            PyObject *item = Py_BuildValue("(s#i)", entries[w].word, m, entries[w].score);
+            if (!item || PyList_Append(ws, item) < 0) {
+                Py_XDECREF(item);
+                PyMem_Free(entries);
+                Py_CLEAR(dict);
+                goto done;
+            }
+            Py_DECREF(item);
+        }
+        const int inserted = insert_tree_words(&new_arenas[m], &new_trees[m], m, entries, n_entries, 1);
+        PyMem_Free(entries);
+        if (!inserted) {
+            PyErr_NoMemory();
+            Py_CLEAR(dict);
+            goto done;
+        }
+    }
+    lock_index();
+    new_index_generation(index);
+    for (m = 0; m < MAX_WORD_LENGTH; m++) {
+        free_tree(index, m);
+        free_table(tables[index][m]);
+        tables[index][m] = NULL;
+        clear_bitset_index(index, m);
+        trees[index][m] = new_trees[m];
+        arenas[index][m] = new_arenas[m];
+        new_trees[m] = NULL;
+        new_arenas[m] = NULL;
+    }
+    merge_wordlist(index);
+    clear_word_automaton(index);
+    clear_analysis_cache(index);
+    unlock_index();
+done:
+    if (f) fclose(f);
+    for (t = 0; t < n_threads; t++) {
+        for (m = 0; m < MAX_WORD_LENGTH; m++) {
+            free_loaded_words(&slices[t].loaded[m]);
+        }
+    }
+    for (m = 0; m < MAX_WORD_LENGTH; m++) {
+        free_loaded_words(&loaded[m]);
+        free_arena(new_arenas[m]);
+    }
+    PyMem_Free(slices);
+    PyMem_Free(buffer);
+    return dict;
+}
+
+static int
+compare_found_words(const void *a, const void *b) {
+    const int *f1 = (const int *) a;
+    const int *f2 = (const int *) b;
+    if (f1[0] != f2[0]) return f1[0] - f2[0];
+    return f1[1] - f2[1];
+}
+
+// find the words of the word lists that occur in s, as (position, length)
+// pairs ordered by position and then by length
+static PyObject*
+cPalabra_scan_words(PyObject *self, PyObject *args) {
+    char *s;
+    int length;
+    PyObject *indices;
+    if (!PyArg_ParseTuple(args, "s#O", &s, &length, &indices))
+        return NULL;
+    const Py_ssize_t n_indices = PyList_Size(indices);
+    if (n_indices < 0) return NULL;
+    int *found = PyMem_Malloc(n_indices * length * (length + 1) * sizeof(int) + 1);
+    if (!found) return PyErr_NoMemory();
+    int n_found = 0;
+    Py_ssize_t ii;
+    for (ii = 0; ii < n_indices; ii++) {
+        const int index = (int) PyInt_AsLong(PyList_GET_ITEM(indices, ii));
+        if (index < 0 || index > MAX_WORD_LISTS) {
+            PyMem_Free(found);
+            PyErr_SetString(PyExc_ValueError, "invalid word list index");
+            return NULL;
+        }
+        WAptr a = get_word_automaton(index);
+        if (!a) {
+            PyMem_Free(found);
+            return PyErr_NoMemory();
+        }
+        n_found += scan_words(a, s, length, found + 2 * n_found);
+    }
+    // a word may occur in more than one word list
+    qsort(found, n_found, 2 * sizeof(int), compare_found_words);
+    PyObject *result = PyList_New(0);
+    int f;
+    for (f = 0; result && f < n_found; f++) {
+        if (f > 0 && compare_found_words(found + 2 * f, found + 2 * (f - 1)) == 0)
+            continue;
+        PyObject *item = Py_BuildValue("(ii)", found[2 * f], found[2 * f + 1]);
+        if (!item || PyList_Append(result, item) < 0) {
+            Py_XDECREF(item);
+            Py_CLEAR(result);
+            break;
+        }
+        Py_DECREF(item);
+    }
+    PyMem_Free(found);
+    return result;
+}
+
+WITH_INDEX_LOCK(cPalabra_preprocess)
+WITH_INDEX_LOCK(cPalabra_preprocess_all)
+WITH_INDEX_LOCK(cPalabra_postprocess)
+WITH_INDEX_LOCK(cPalabra_unmerge)
+WITH_INDEX_LOCK(cPalabra_get_contained_words)
+WITH_INDEX_LOCK(cPalabra_find_anagrams)
+WITH_INDEX_LOCK(cPalabra_scan_words)
+WITH_INDEX_LOCK(cPalabra_word_counts)
+WITH_INDEX_LOCK(cPalabra_score_counts)
+WITH_INDEX_LOCK(cPalabra_verify_contained_words)
+WITH_INDEX_LOCK(cPalabra_update_score)
+WITH_INDEX_LOCK(cPalabra_change_scores)
+WITH_INDEX_LOCK(cPalabra_insert_word)
+WITH_INDEX_LOCK(cPalabra_remove_word)
+WITH_INDEX_LOCK(cPalabra_load_index)
+WITH_INDEX_LOCK(cPalabra_index_words)
+
 static PyMethodDef methods[] = {
     {"search", cPalabra_search, METH_VARARGS, "search"},
-    {"preprocess", cPalabra_preprocess, METH_VARARGS, "preprocess"},
-    {"preprocess_all", cPalabra_preprocess_all, METH_VARARGS, "preprocess_all"},
-    {"postprocess", cPalabra_postprocess, METH_VARARGS, "postprocess"},
+    {"preprocess", cPalabra_preprocess_locked, METH_VARARGS, "preprocess"},
+    {"preprocess_all", cPalabra_preprocess_all_locked, METH_VARARGS, "preprocess_all"},
+    {"postprocess", cPalabra_postprocess_locked, METH_VARARGS, "postprocess"},
+    {"unmerge", cPalabra_unmerge_locked, METH_VARARGS, "unmerge"},
+    {"set_search_generation", cPalabra_set_search_generation, METH_VARARGS, "set_search_generation"},
     {"is_available",  cPalabra_is_available, METH_VARARGS, "is_available"},
     {"assign_numbers", cPalabra_assign_numbers, METH_VARARGS, "assign_numbers"},
     {"fill", cPalabra_fill, METH_VARARGS, "fill"},
+    {"set_fill_generation", cPalabra_set_fill_generation, METH_VARARGS, "set_fill_generation"},
+    {"get_fill_generation", cPalabra_get_fill_generation, METH_NOARGS, "get_fill_generation"},
+    {"index_generation", cPalabra_index_generation, METH_VARARGS, "index_generation"},
+    {"after_fork", cPalabra_after_fork, METH_NOARGS, "after_fork"},
     {"compute_lines",  cPalabra_compute_lines, METH_VARARGS, "compute_lines"},
     {"compute_render_lines", cPalabra_compute_render_lines, METH_VARARGS, "compute_render_lines"},
-    {"compute_distances", cPalabra_compute_distances, METH_VARARGS, "compute_distances"},
+    {"sort_by_distance", cPalabra_sort_by_distance, METH_VARARGS, "sort_by_distance"},
     {"compute_counts", cPalabra_compute_counts, METH_VARARGS, "compute_counts"},
-    {"get_contained_words", cPalabra_get_contained_words, METH_VARARGS, "get_contained_words"},
-    {"verify_contained_words", cPalabra_verify_contained_words, METH_VARARGS, "verify_contained_words"},
-    {"update_score", cPalabra_update_score, METH_VARARGS, "update_score"},
-    {"insert_word", cPalabra_insert_word, METH_VARARGS, "insert_word"},
+    {"get_contained_words", cPalabra_get_contained_words_locked, METH_VARARGS, "get_contained_words"},
+    {"verify_contained_words", cPalabra_verify_contained_words_locked, METH_VARARGS, "verify_contained_words"},
+    {"find_anagrams", cPalabra_find_anagrams_locked, METH_VARARGS, "find_anagrams"},
+    {"scan_words", cPalabra_scan_words_locked, METH_VARARGS, "scan_words"},
+    {"load_wordlist", cPalabra_load_wordlist, METH_VARARGS, "load_wordlist"},
+    {"word_counts", cPalabra_word_counts_locked, METH_VARARGS, "word_counts"},
+    {"score_counts", cPalabra_score_counts_locked, METH_VARARGS, "score_counts"},
+    {"update_score", cPalabra_update_score_locked, METH_VARARGS, "update_score"},
+    {"change_scores", cPalabra_change_scores_locked, METH_VARARGS, "change_scores"},
+    {"insert_word", cPalabra_insert_word_locked, METH_VARARGS, "insert_word"},
+    {"remove_word", cPalabra_remove_word_locked, METH_VARARGS, "remove_word"},
+    {"load_index", cPalabra_load_index_locked, METH_VARARGS, "load_index"},
+    {"index_words", cPalabra_index_words_locked, METH_VARARGS, "index_words"},
     {NULL, NULL, 0, NULL}
 };
 
 PyMODINIT_FUNC
 initcPalabra(void)
 {
-    (void) Py_InitModule("cPalabra", methods);
+    PyObject *module = Py_InitModule("cPalabra", methods);
+    if (module == NULL)
+        return;
+    index_lock = PyThread_allocate_lock();
+    job_mutex = PyThread_allocate_lock();
+    job_done = PyThread_allocate_lock();
+    if (index_lock == NULL || job_mutex == NULL || job_done == NULL)
+        return;
+    if (PyType_Ready(&SearchCursorType) < 0)
+        return;
+    Py_INCREF(&SearchCursorType);
+    PyModule_AddObject(module, "SearchCursor", (PyObject *) &SearchCursorType);
 }
@@ -17,8 +17,11 @@
 
 import cairo
 import copy
+import glib
 import gtk
+import multiprocessing
 import pangocairo
+import threading
 import webbrowser
 from collections import namedtuple
 from itertools import chain
@@ -37,13 +40,16 @@ from word import (CWordList,
     analyze_words,
 )
 import cPalabra
-from gui_debug import FillDebugDialog
 
 DEFAULT_FILL_OPTIONS = {
     constants.FILL_OPTION_START: constants.FILL_START_AT_AUTO
     , constants.FILL_OPTION_NICE: constants.FILL_NICE_FALSE
     , constants.FILL_OPTION_DUPLICATE: constants.FILL_DUPLICATE_FALSE
     , constants.FILL_NICE_COUNT: 0
+    , constants.FILL_OPTION_ENGINE: constants.FILL_ENGINE_GREEDY
+    , constants.FILL_OPTION_TIME_LIMIT: 0
+    , constants.FILL_OPTION_WORKERS: 1
+    , constants.FILL_OPTION_OBJECTIVE: constants.FILL_OBJECTIVE_NONE
 }
 
 Selection = namedtuple('Selection', ['x', 'y', 'direction'])
@@ -157,7 +163,39 @@ def compute_search_args(grid, slot, force=False):
     more = grid.gather_all_constraints(x, y, d)
     return length, constraints, more
 
-def fill(grid, words, fill_options):
+def fill(grid, words, fill_options, ranks=None, stats=None):
+    """
+    Return a list with fills of the grid, each fill is a list of (x, y, c).
+    If stats is a dict, the counters of the fill engine are stored in it:
+    why the fill stopped (status), the words that were tried (nodes) and,
+    for the propagating engine, the dead ends after which decisions were
+    skipped (backjumps) and the number of skipped decisions (skipped).
+
+    The fill stops when the grid is filled (status "complete"), when no
+    fill exists ("exhausted"), after max_nodes words ("nodes"), after
+    time_limit milliseconds ("time"), when the generation of the
+    options is superseded by cPalabra.set_fill_generation ("cancelled")
+    or, for the greedy engine, when the words of the word list index are
+    replaced during the fill ("changed").
+    Both engines call the progress callable of the options, if given,
+    after their first step and then a few times per second with a dict
+    with the filled slots (slots), the words that were tried (nodes and
+    nodes_per_second) and the best partial fill (fill).
+
+    With an objective, the propagating engine searches for the fill with
+    the highest total or minimum score of the words that it places. It
+    gives the best complete fill that it found, whose value is stored in
+    stats (score), and its status is "complete" only when that fill has
+    been proven to be optimal. The greedy engine ignores the objective.
+
+    With more than one worker in the options, the grid is filled by a
+    portfolio of processes, see fill_portfolio.
+    """
+    if fill_options.get(constants.FILL_OPTION_WORKERS, 1) > 1:
+        return fill_portfolio(grid, words, fill_options, ranks, stats)
+    if stats is not None:
+        fill_options = dict(fill_options)
+        fill_options[constants.FILL_OPTION_STATS] = stats
     meta = []
     g_words = [i for i in grid.words(allow_duplicates=True, include_dir=True)]
     g_lengths = {}
@@ -165,7 +203,11 @@ def fill(grid, words, fill_options):
     for n, x, y, d in g_words:
         g_lengths[x, y, d] = grid.word_length(x, y, d)
         g_cs[x, y, d] = grid.gather_constraints(x, y, d)
-    result = analyze_words(grid, g_words, g_cs, g_lengths, words)
+    if fill_options.get(constants.FILL_OPTION_ENGINE) == constants.FILL_ENGINE_PROPAGATE:
+        # the propagating engine computes the words of each slot itself
+        result = dict.fromkeys(g_lengths)
+    else:
+        result = analyze_words(grid, g_words, g_cs, g_lengths, words, ranks)
     for n, x, y, d in g_words:
         d_i = 0 if d == "across" else 1
         l = g_lengths[x, y, d]
@@ -173,6 +215,181 @@ def fill(grid, words, fill_options):
         meta.append((x, y, d_i, l, cs, result[x, y, d]))
     return cPalabra.fill(grid, words, meta, fill_options)
 
+def portfolio_options(fill_options, n_workers):
+    """
+    Return the options of the workers of a portfolio fill. The first worker
+    fills as the options say, a greedy portfolio also tries the other start
+    slot and the other workers use the propagating engine, each with a
+    different seed.
+    """
+    options = dict(fill_options)
+    options[constants.FILL_OPTION_WORKERS] = 1
+    options.pop(constants.FILL_OPTION_PROGRESS, None)
+    options.pop(constants.FILL_OPTION_STATS, None)
+    variants = [options]
+    if options.get(constants.FILL_OPTION_ENGINE) != constants.FILL_ENGINE_PROPAGATE:
+        variant = dict(options)
+        if options.get(constants.FILL_OPTION_START) == constants.FILL_START_AT_ZERO:
+            variant[constants.FILL_OPTION_START] = constants.FILL_START_AT_AUTO
+        else:
+            variant[constants.FILL_OPTION_START] = constants.FILL_START_AT_ZERO
+        variants.append(variant)
+    seed = 1
+    while len(variants) < n_workers:
+        variant = dict(options)
+        variant[constants.FILL_OPTION_ENGINE] = constants.FILL_ENGINE_PROPAGATE
+        variant[constants.FILL_OPTION_SEED] = seed
+        variants.append(variant)
+        seed += 1
+    return variants[:n_workers]
+
+# the grid, words, options and ranks of the current portfolio fill, the
+# worker processes inherit them when they are forked
+_portfolio = None
+
+def _fill_portfolio_worker(index):
+    grid, words, variants, ranks = _portfolio
+    stats = {}
+    results = fill(grid, words, variants[index], ranks, stats)
+    return index, results, stats
+
+def _next_portfolio_result(done, generation):
+    """Wait for the next worker that is done, None if the fill is superseded."""
+    while generation < 0 or cPalabra.get_fill_generation() == generation:
+        try:
+            return done.next(0.1)
+        except multiprocessing.TimeoutError:
+            pass
+    return None
+
+def _rank_fill(result, objective):
+    """
+    Return a key to compare the results of portfolio workers: the fill
+    with the best score, then the most filled cells, then the first worker.
+    """
+    index, results, stats = result
+    filled = len(results[0]) if results else -1
+    score = stats.get("score") if objective else None
+    return score is not None, score, filled, -index
+
+def fill_portfolio(grid, words, fill_options, ranks=None, stats=None):
+    """
+    Fill the grid with the number of processes in the workers option, each
+    with the options of portfolio_options, and return the first complete
+    fill or else the best partial fill. The remaining workers are
+    terminated as soon as a fill is complete. The processes are forked so
+    that they share the word lists with this process without copying them.
+
+    With an objective, the fill with the highest score is returned, unless
+    a worker proves that its fill is optimal before the others are done.
+
+    A portfolio fill does not report its progress. When its generation is
+    superseded, the workers are terminated and the best fill of the
+    workers that are done is returned, which is [] if there is none.
+    In stats, the counters of the chosen fill are stored together with
+    the worker that found it (worker).
+    """
+    global _portfolio
+    n_workers = fill_options[constants.FILL_OPTION_WORKERS]
+    variants = portfolio_options(fill_options, n_workers)
+    generation = fill_options.get(constants.FILL_OPTION_GENERATION, -1)
+    objective = fill_options.get(constants.FILL_OPTION_OBJECTIVE, constants.FILL_OBJECTIVE_NONE)
+    _portfolio = grid, words, variants, ranks
+    try:
+        pool = multiprocessing.Pool(n_workers, cPalabra.after_fork)
+    finally:
+        _portfolio = None
+    best = None
+    cancelled = False
+    try:
+        done = pool.imap_unordered(_fill_portfolio_worker, range(n_workers))
+        for i in xrange(n_workers):
+            result = _next_portfolio_result(done, generation)
+            if result is None:
+                cancelled = True
+                break
+            index, results, w_stats = result
+            # without an objective, a complete fill is good enough
+            # and with one, only an optimal fill is good enough
+            if (w_stats["status"] == constants.FILL_STATUS_COMPLETE
+                and (not objective or w_stats.get("score") is not None)):
+                best = result
+                break
+            if best is None or _rank_fill(result, objective) > _rank_fill(best, objective):
+                best = result
+    finally:
+        pool.terminate()
+        pool.join()
+    if best is None:
+        if stats is not None:
+            stats["status"] = constants.FILL_STATUS_CANCELLED
+        return []
+    index, results, w_stats = best
+    if stats is not None:
+        stats.update(w_stats)
+        stats["worker"] = index
+        if cancelled:
+            stats["status"] = constants.FILL_STATUS_CANCELLED
+    return results
+
+class FillWorker(object):
+    """
+    Fill grids in a separate thread so that the interface remains
+    responsive. The progress callback is called with the dicts of the
+    progress option of fill and the done callback with the fills and the
+    stats of a fill, both in the main loop. A fill that is cancelled stops
+    and its best partial fill is still passed to the done callback, a fill
+    that is superseded by a newer fill is abandoned. A fill that raises an
+    exception is passed to the done callback without fills and with the
+    status FILL_STATUS_ERROR.
+    """
+    def __init__(self, on_progress, on_done):
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.generation = 0
+        self.cancelled = None
+
+    def fill(self, grid, words, fill_options, ranks=None):
+        """Fill a copy of the grid, as fill, in a new thread."""
+        self._next_generation()
+        self.cancelled = None
+        generation = self.generation
+        def progress(info):
+            glib.idle_add(self._deliver, generation, self.on_progress, info)
+        options = dict(fill_options)
+        options[constants.FILL_OPTION_GENERATION] = generation
+        options[constants.FILL_OPTION_PROGRESS] = progress
+        grid = copy.deepcopy(grid)
+        def run():
+            stats = {}
+            results = None
+            try:
+                results = fill(grid, words, options, ranks, stats)
+            finally:
+                if results is None:
+                    results, stats = [], {"status": constants.FILL_STATUS_ERROR}
+                glib.idle_add(self._deliver, generation, self.on_done, results, stats)
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    def cancel(self, deliver=True):
+        """
+        Stop the current fill, if any. Its best partial fill is only
+        passed to the done callback if deliver is True.
+        """
+        self.cancelled = self.generation if deliver else None
+        self._next_generation()
+
+    def _next_generation(self):
+        self.generation += 1
+        cPalabra.set_fill_generation(self.generation)
+
+    def _deliver(self, generation, callback, *args):
+        if generation in (self.generation, self.cancelled):
+            callback(*args)
+        return False
+
 def attempt_fill(grid, words):
     """
     Return a grid with possibly the given words filled in.
@@ -711,19 +928,49 @@ class Editor:
         self.blacklist = []
         self.fill_options = {}
         self.fill_options.update(DEFAULT_FILL_OPTIONS)
+        self.fill_worker = FillWorker(self._on_fill_progress, self._on_fill_done)
+        # called with the progress dicts of a fill and its stats when done
+        self.fill_listener = None
+        # the puzzle and a copy of the grid that the fill started from
+        self.fill_puzzle = None
+        self.fill_grid = None
 
     def fill(self):
+        """
+        Fill the grid in the background with the first word list.
+        Return False if there is no word list to fill with.
+        """
         for wlist in self.window.wordlists:
-            #backup = copy.deepcopy(self.window.puzzle.grid)
-            results = fill(self.window.puzzle.grid, wlist.words, self.fill_options)
-            if False:
-                w = FillDebugDialog(self.window, [backup] + results)
-                w.show_all()
-                w.run()
-                w.destroy()
-                break
+            self.fill_puzzle = self.window.puzzle
+            self.fill_grid = copy.deepcopy(self.fill_puzzle.grid)
+            self.fill_worker.fill(self.fill_grid, wlist.words
+                , self.fill_options, wlist.get_letter_ranks())
+            return True
+        return False
+
+    def cancel_fill(self):
+        """Stop the current fill, its best partial fill is still applied."""
+        self.fill_worker.cancel()
+
+    def close(self):
+        """Abandon the current fill when its puzzle is closed."""
+        self.fill_listener = None
+        self.fill_worker.cancel(deliver=False)
+
+    def _on_fill_progress(self, info):
+        if self.fill_listener is not None:
+            self.fill_listener(info, None)
+
+    def _on_fill_done(self, results, stats):
+        # the fill does not fit when another puzzle is open or the grid changed
+        puzzle = self.window.puzzle
+        if (results and puzzle is self.fill_puzzle
+            and puzzle.grid == self.fill_grid):
             self.window.transform_grid(transform.modify_chars, chars=results[0])
-            break
+        self.fill_puzzle = None
+        self.fill_grid = None
+        if self.fill_listener is not None:
+            self.fill_listener(None, stats)
 
     def insert(self, word):
         """Insert a word in the selected slot."""
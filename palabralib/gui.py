@@ -42,7 +42,7 @@ from clue import ClueTool, create_clues, ManageCluesDialog
 import constants
 from export import ExportWindow
 from editor import (
-    compute_words,
+    compute_search_args,
     e_settings,
     e_tools,
     Editor,
@@ -90,21 +90,22 @@ from properties import PropertiesWindow
 from puzzle import Puzzle, PuzzleManager
 import transform
 import view
-from word import create_wordlists, write_wordlists
+from word import create_wordlists, write_wordlists, SearchWorker, SimilarWords
 
 def create_splash():
     window = gtk.Window(gtk.WINDOW_TOPLEVEL)
     window.set_type_hint(gtk.gdk.WINDOW_TYPE_HINT_SPLASHSCREEN)
     window.set_decorated(False)
     window.set_position(gtk.WIN_POS_CENTER)
-    hbox = gtk.HBox()
-    window.add(hbox)
+    vbox = gtk.VBox()
+    window.add(vbox)
     image = gtk.Image()
     image.set_from_file(os.path.join('resources', 'splash.png'))
-    hbox.pack_start(image)
-    image.show()
-    hbox.show()
-    return window
+    vbox.pack_start(image)
+    bar = gtk.ProgressBar()
+    vbox.pack_start(bar, False, False)
+    vbox.show_all()
+    return window, bar
 
 def determine_status_message(grid):
     status = grid.determine_status(False)
@@ -250,6 +251,8 @@ class PalabraWindow(gtk.Window):
         self.puzzle_toggle_items = []
         self.selection_toggle_items = []
         self.puzzle_manager = PuzzleManager()
+        self.search_worker = SearchWorker(lambda words: e_tools["word"].display_words(words))
+        self.similar_words = SimilarWords()
         MENUBAR = [self.create_file_menu
             , self.create_edit_menu
             , self.create_view_menu
@@ -449,6 +452,7 @@ class PalabraWindow(gtk.Window):
         if need_to_close:
             if need_to_save:
                 self.save_puzzle()
+            self.editor.close()
             self.puzzle_manager.current_puzzle = None
             action.stack.clear()
             for widget in self.panel.get_children():
@@ -766,10 +770,18 @@ class PalabraWindow(gtk.Window):
         min_score = preferences.prefs[constants.PREF_FIND_WORD_MIN_SCORE]
         options = {
             constants.SEARCH_OPTION_MIN_SCORE: min_score
+            , constants.SEARCH_OPTION_ENGINE: constants.SEARCH_ENGINE_BITSET
+            , constants.SEARCH_OPTION_ORDER_BY_SCORE: e_tools["word"].show_order == 1
+            , constants.SEARCH_OPTION_CURSOR: True
         }
-        words = compute_words(self.puzzle.grid
-            , wordlists, e_settings.selection, force_refresh, options)
-        e_tools["word"].display_words(words)
+        # the words are searched in the background, the current words
+        # remain visible until the words of the newest search arrive
+        args = compute_search_args(self.puzzle.grid, e_settings.selection, force_refresh)
+        if args:
+            self.search_worker.search(wordlists, *args, options=options)
+        else:
+            self.search_worker.cancel()
+            e_tools["word"].display_words([])
 
     def update_undo_redo(self):
         """Update the controls for undo and redo."""
@@ -1208,16 +1220,23 @@ def main(argv=None):
     try:
         has_splash = False
         if has_splash:
-            splash = create_splash()
+            splash, splash_bar = create_splash()
             splash.show()
             while gtk.events_pending():
                 gtk.main_iteration()
+        gobject.threads_init()
         print "Reading configuration file..."
         read_config_file()
         print "Loading word lists..."
         WORD_FILES = preferences.prefs[constants.PREF_WORD_FILES]
         cPalabra.preprocess_all()
-        wordlists = create_wordlists(WORD_FILES)
+        progress = None
+        if has_splash:
+            def progress(fraction):
+                splash_bar.set_fraction(fraction)
+                while gtk.events_pending():
+                    gtk.main_iteration()
+        wordlists = create_wordlists(WORD_FILES, progress=progress)
         print "Loading grid files..."
         fs = constants.STANDARD_PATTERN_FILES + preferences.prefs[constants.PREF_PATTERN_FILES]
         patterns = read_containers(fs)
@@ -16,6 +16,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import gtk
+import multiprocessing
 import operator
 
 import constants
@@ -37,6 +38,7 @@ class WordTool:
         self.show_intersect = False
         self.show_used = True
         self.show_order = 0
+        self.words = []
 
     def create(self):
         img = gtk.Image()
@@ -78,6 +80,9 @@ class WordTool:
         show_hbox.pack_start(create_label(u"Sort words by:"))
         def on_show_changed(widget):
             self.show_order = widget.get_active()
+            if self.show_order == 0 and isinstance(self.words, list):
+                # words may have been searched by score
+                self.words.sort(key=operator.itemgetter(0))
             self.display_words()
         show_combo = create_combo(WORD_DISPLAY_OPTIONS
             , active=self.show_order
@@ -113,6 +118,24 @@ class FillTool:
             (constants.FILL_START_AT_ZERO, "First slot")
             , (constants.FILL_START_AT_AUTO, "Suitably chosen slot")
         ]
+        self.engines = [
+            (constants.FILL_ENGINE_GREEDY, "Greedy")
+            , (constants.FILL_ENGINE_PROPAGATE, "Constraint propagation")
+        ]
+        self.objectives = [
+            (constants.FILL_OBJECTIVE_NONE, "Any fill")
+            , (constants.FILL_OBJECTIVE_TOTAL, "Highest total score")
+            , (constants.FILL_OBJECTIVE_MINIMUM, "Highest lowest score")
+        ]
+        self.statuses = {
+            constants.FILL_STATUS_COMPLETE: u"The grid has been filled."
+            , constants.FILL_STATUS_EXHAUSTED: u"No fill was found."
+            , constants.FILL_STATUS_NODES: u"Stopped after trying too many words."
+            , constants.FILL_STATUS_TIME: u"Stopped at the time limit."
+            , constants.FILL_STATUS_CANCELLED: u"The fill was cancelled."
+            , constants.FILL_STATUS_CHANGED: u"Stopped because the word lists changed."
+            , constants.FILL_STATUS_ERROR: u"The fill failed."
+        }
         self.editor.fill_options.update(DEFAULT_FILL_OPTIONS)
 
     def create(self):
@@ -120,9 +143,34 @@ class FillTool:
         main.set_spacing(9)
 
         def on_fill_button_clicked(button):
-            self.editor.fill()
-        button = create_button(u"Fill", f_click=on_fill_button_clicked)
-        main.pack_start(button, False, False, 0)
+            if not self.editor.fill():
+                status_label.set_text(u"There is no word list to fill with.")
+                return
+            fill_button.set_sensitive(False)
+            cancel_button.set_sensitive(True)
+            status_label.set_text(u"Filling...")
+        def on_cancel_button_clicked(button):
+            self.editor.cancel_fill()
+        fill_button = create_button(u"Fill", f_click=on_fill_button_clicked)
+        cancel_button = create_button(u"Cancel", f_click=on_cancel_button_clicked)
+        cancel_button.set_sensitive(False)
+        buttons = gtk.HBox(True, 0)
+        buttons.set_spacing(6)
+        buttons.pack_start(fill_button, True, True, 0)
+        buttons.pack_start(cancel_button, True, True, 0)
+        main.pack_start(buttons, False, False, 0)
+
+        status_label = create_label(u"")
+        main.pack_start(status_label, False, False, 0)
+        def on_fill_update(info, stats):
+            if stats is None:
+                text = u"Filled %i slots, %i words per second"
+                status_label.set_text(text % (info["slots"], info["nodes_per_second"]))
+                return
+            fill_button.set_sensitive(True)
+            cancel_button.set_sensitive(False)
+            status_label.set_text(self.statuses.get(stats.get("status"), u""))
+        self.editor.fill_listener = on_fill_update
 
         start_combo = gtk.combo_box_new_text()
         for i, (c, txt) in enumerate(self.starts):
@@ -136,8 +184,65 @@ class FillTool:
         main.pack_start(create_label(u"Start filling from:"), False, False, 0)
         main.pack_start(start_combo, False, False, 0)
 
+        engine_combo = gtk.combo_box_new_text()
+        for i, (c, txt) in enumerate(self.engines):
+            engine_combo.append_text(txt)
+            if c == self.editor.fill_options[constants.FILL_OPTION_ENGINE]:
+                engine_combo.set_active(i)
+        def on_engine_changed(combo):
+            engine = self.engines[combo.get_active()][0]
+            self.editor.fill_options[constants.FILL_OPTION_ENGINE] = engine
+            start_combo.set_sensitive(engine == constants.FILL_ENGINE_GREEDY)
+            objective_combo.set_sensitive(engine == constants.FILL_ENGINE_PROPAGATE)
+        engine_combo.connect("changed", on_engine_changed)
+
+        main.pack_start(create_label(u"Fill method:"), False, False, 0)
+        main.pack_start(engine_combo, False, False, 0)
+
+        objective_combo = gtk.combo_box_new_text()
+        for i, (c, txt) in enumerate(self.objectives):
+            objective_combo.append_text(txt)
+            if c == self.editor.fill_options[constants.FILL_OPTION_OBJECTIVE]:
+                objective_combo.set_active(i)
+        def on_objective_changed(combo):
+            objective = self.objectives[combo.get_active()][0]
+            self.editor.fill_options[constants.FILL_OPTION_OBJECTIVE] = objective
+        objective_combo.connect("changed", on_objective_changed)
+        engine = self.editor.fill_options[constants.FILL_OPTION_ENGINE]
+        objective_combo.set_sensitive(engine == constants.FILL_ENGINE_PROPAGATE)
+
+        main.pack_start(create_label(u"Word scores:"), False, False, 0)
+        main.pack_start(objective_combo, False, False, 0)
+
+        # the time limit is in seconds here, in milliseconds in the options
+        current = self.editor.fill_options[constants.FILL_OPTION_TIME_LIMIT] / 1000
+        adj = gtk.Adjustment(current, 0, 3600, 1, 0, 0)
+        time_spinner = gtk.SpinButton(adj, 0.0, 0)
+        def on_time_limit_changed(spinner):
+            seconds = spinner.get_value_as_int()
+            self.editor.fill_options[constants.FILL_OPTION_TIME_LIMIT] = seconds * 1000
+        time_spinner.connect("value-changed", on_time_limit_changed)
+
+        main.pack_start(create_label(u"Time limit in seconds (0 for none):"), False, False, 0)
+        main.pack_start(time_spinner, False, False, 0)
+
+        current = self.editor.fill_options[constants.FILL_OPTION_WORKERS]
+        adj = gtk.Adjustment(current, 1, max(multiprocessing.cpu_count(), current), 1, 0, 0)
+        workers_spinner = gtk.SpinButton(adj, 0.0, 0)
+        def on_workers_changed(spinner):
+            workers = spinner.get_value_as_int()
+            self.editor.fill_options[constants.FILL_OPTION_WORKERS] = workers
+        workers_spinner.connect("value-changed", on_workers_changed)
+
+        main.pack_start(create_label(u"Parallel fills:"), False, False, 0)
+        main.pack_start(workers_spinner, False, False, 0)
+
         hbox = gtk.HBox(False, 0)
         hbox.set_border_width(6)
         hbox.set_spacing(6)
         hbox.pack_start(main, True, True, 0)
+        def on_destroy(widget):
+            if self.editor.fill_listener is on_fill_update:
+                self.editor.close()
+        hbox.connect("destroy", on_destroy)
         return hbox
@@ -17,6 +17,8 @@
 
 import gtk
 import glib
+import itertools
+import multiprocessing
 import operator
 import pango
 import pangocairo
@@ -199,7 +201,8 @@ class SimilarWordsDialog(PalabraDialog):
         self.add_button(gtk.STOCK_OK, gtk.RESPONSE_OK)
         destroy = lambda w: highlight_cells(self.pwindow, self.puzzle, clear=True)
         self.connect("destroy", destroy)
-        self.entries = word.similar_entries(word.similar_words(puzzle.grid))
+        parent.similar_words.update(puzzle.grid)
+        self.entries = word.similar_entries(parent.similar_words.result(shared=True))
         self.load_entries(self.entries)
 
     def load_entries(self, entries):
@@ -311,6 +314,7 @@ class FindWordsDialog(PalabraDialog):
         self.wordlists = parent.wordlists
         self.sort_option = 0
         self.pattern = None
+        self.result = None
         self.pack(create_label(u"Use ? for an unknown letter and * for zero or more unknown letters."))
         def on_entry_changed(widget):
             glib.source_remove(self.timer)
@@ -331,6 +335,7 @@ class FindWordsDialog(PalabraDialog):
         sort_hbox.pack_start(create_label(u"Sort by:"), False, False, 0)
         def on_sort_changed(combo):
             self.sort_option = combo.get_active()
+            self.result = None
             self.launch_pattern(self.pattern)
         sort_hbox.pack_start(create_combo(["Alphabet", "Length", "Score"]
             , active=self.sort_option, f_change=on_sort_changed))
@@ -350,8 +355,14 @@ class FindWordsDialog(PalabraDialog):
         def find_words(pattern=None):
             if pattern is None:
                 return False
-            result = word.search_wordlists_by_pattern(self.wordlists, pattern, sort=self.sort_option)
+            # narrow down the words of the previous pattern, if possible
+            previous = None
+            if self.result is not None:
+                previous = (self.pattern, self.result)
+            result = word.search_wordlists_by_pattern(self.wordlists
+                , pattern, sort=self.sort_option, previous=previous)
             self.pattern = pattern
+            self.result = result
             self.store.clear()
             self.set_n_label(len(result))
             for name, w, score in result:
@@ -402,11 +413,13 @@ class AnagramDialog(gtk.Dialog):
         if word is None:
             return
         self.store.clear()
-        counts, strings = get_contained_words(self.wordlists, word)
+        counts, strings = get_contained_words(self.wordlists, word
+            , limit=constants.MAX_CONTAINED_WORDS)
         counts = dict(counts)
         result = [extract(counts, s) for s in strings]
         pairs = [(w1, ''.join(w2)) for w1, w2 in result if len(w2) > 1]
-        f_result = verify_contained_words(self.wordlists, pairs)
+        f_result = itertools.islice(iter_verified_words(self.wordlists, pairs
+            , n_threads=multiprocessing.cpu_count()), constants.MAX_CONTAINED_WORDS)
         self._display([s1 + " (" + s2 + ")" for s1, s2 in f_result])
         return False
 
@@ -452,7 +465,7 @@ class WordListPropertiesDialog(PalabraPropertiesDialog):
         self.add_button(gtk.STOCK_OK, gtk.RESPONSE_OK)
         counts = wlist.get_word_counts()
         scores = wlist.get_score_counts()
-        for l in sorted(wlist.words.keys()):
+        for l in sorted(counts.keys()):
             if counts[l] == 0:
                 continue
             self.counts_store.append([l, counts[l]])
@@ -705,6 +718,7 @@ class WordWidget(gtk.DrawingArea):
         self.connect('expose_event', self.expose)
 
     def set_words(self, words):
+        # words is a list or a SearchCursor, rows are taken when drawn
         self.words = words
         self.selection = None
         self.set_size_request(-1, self.STEP * len(self.words))
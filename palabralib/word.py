@@ -15,12 +15,19 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from array import array
+from bisect import insort
 import copy
 import glib
 import gtk
+import mmap
+import multiprocessing
 import os
 import re
+import struct
+import threading
 import time
+import traceback
 from operator import itemgetter
 
 import cPalabra
@@ -46,6 +53,8 @@ def visible_entries(words, grid, show_used=True, show_intersect=False, show_orde
     entries = []
     if not show_used:
         entries = [e.lower() for e in grid.entries() if constants.MISSING_CHAR not in e]
+    if isinstance(words, cPalabra.SearchCursor):
+        return words.select(show_intersect, entries, show_order == 1)
     shown = [row for row in words if
         not ( (show_intersect and not row[2]) or (not show_used and row[0] in entries) ) ]
     if show_order == 1: # sort by score
@@ -101,45 +110,91 @@ def similar_entries(results):
         result[s] = [(x, y, d, word.lower(), word.find(s)) for x, y, d, word in words]
     return result
 
-def read_wordlist(path, default_score):
-    """Yield all words found in the specified file."""
-    if not os.path.exists(path):
-        return []
-    words = set()
-    with open(path, "r") as f:
-        ord_A = ord("A")
-        ord_Z = ord("Z")
-        ord_a = ord("a")
-        ord_z = ord("z")
-        ords = {}
-        lower = str.lower
-        for line in f:
-            line = line.strip("\n")
-            line = line.split(",")
-            l_line = len(line)
-            if not line or l_line > 2:
-                continue
-            if l_line == 1:
-                word, score = line[0], default_score
-            elif l_line == 2:
-                word, score = line
-            word = word.replace(" ", '')
-            if len(word) > constants.MAX_WORD_LENGTH:
-                continue
-            for c in word:
-                if c not in ords:
-                    ord_c = ords[c] = ord(c)
-                else:
-                    ord_c = ords[c]
-                if not (ord_A <= ord_c <= ord_Z
-                    or ord_a <= ord_c <= ord_z):
-                    break
-            else:
-                try:
-                    words.add((lower(word), int(score)))
-                except ValueError:
-                    pass
-    return words
+INDEX_EXTENSION = ".pidx"
+INDEX_MAGIC = "PALABRA\0"
+INDEX_VERSION = 1
+# detects a compiled index that was written with a different byte order
+INDEX_BYTE_ORDER = 0x01020304
+# magic, version, byte order, mtime, size, default score, length of path
+INDEX_HEADER = struct.Struct("=8siidqii")
+# number of words, offset of words, offset of scores for each word length
+INDEX_TOC = struct.Struct("=" + "iqq" * constants.MAX_WORD_LENGTH)
+
+def get_index_path(path):
+    """Return the path of the compiled index of the given word list file."""
+    return path + INDEX_EXTENSION
+
+def write_index(path, words, default_score):
+    """
+    Write a compiled index of the words next to the word list file.
+    The words are stored per length in alphabetical order so they can be
+    searched without building the trees. The index is only valid for
+    the current path, modification time and size of the word list file.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    a_path = os.path.abspath(path)
+    header = INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, INDEX_BYTE_ORDER
+        , st.st_mtime, st.st_size, default_score, len(a_path))
+    offset = INDEX_HEADER.size + len(a_path) + INDEX_TOC.size
+    toc = []
+    data = []
+    for l in xrange(constants.MAX_WORD_LENGTH):
+        l_words = sorted(words.get(l, [])) if l > 0 else []
+        if not l_words:
+            toc.extend([0, 0, 0])
+            continue
+        s_words = ''.join([w for w, score in l_words])
+        a_scores = array('i', [score for w, score in l_words])
+        s_scores = a_scores.tostring()
+        # align the scores to the size of an int
+        padding = -(offset + len(s_words)) % a_scores.itemsize
+        toc.extend([len(l_words), offset, offset + len(s_words) + padding])
+        data.extend([s_words, "\0" * padding, s_scores])
+        offset += len(s_words) + padding + len(s_scores)
+    t_path = get_index_path(path) + ".tmp"
+    try:
+        with open(t_path, "wb") as f:
+            f.write(header)
+            f.write(a_path)
+            f.write(INDEX_TOC.pack(*toc))
+            f.write(''.join(data))
+        os.rename(t_path, get_index_path(path))
+    except (IOError, OSError):
+        return False
+    return True
+
+def open_index(path, default_score):
+    """
+    Return the memory-mapped compiled index of the given word list file
+    and its table of contents or None when there is no valid index.
+    """
+    try:
+        st = os.stat(path)
+        with open(get_index_path(path), "rb") as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    except (IOError, OSError, ValueError, mmap.error):
+        return None
+    try:
+        header = INDEX_HEADER.unpack_from(buf)
+        magic, version, byte_order, mtime, size, score, l_path = header
+        if (magic, version, byte_order) != (INDEX_MAGIC, INDEX_VERSION, INDEX_BYTE_ORDER):
+            return None
+        if (mtime, size, score) != (st.st_mtime, st.st_size, default_score):
+            return None
+        if buf[INDEX_HEADER.size:INDEX_HEADER.size + l_path] != os.path.abspath(path):
+            return None
+        values = INDEX_TOC.unpack_from(buf, INDEX_HEADER.size + l_path)
+    except struct.error:
+        return None
+    toc = []
+    for l in xrange(constants.MAX_WORD_LENGTH):
+        n_words, words_offset, scores_offset = values[3 * l:3 * l + 3]
+        if n_words > 0:
+            toc.append((l, n_words, words_offset, scores_offset))
+    return buf, toc
 
 def check_accidental_words(wordlists, grid):
     """
@@ -197,9 +252,8 @@ def check_str_for_words(wordlists, offset, s):
     occur in the given wordlists. The given offset is the offset of
     string s in the original sequence.
     """
-    l = len(s)
-    return [(offset + i, j - i) for i in xrange(l) for j in xrange(i + 1, l + 1)
-        if search_wordlists(wordlists, j - i, s[i:j], sort=False)]
+    indices = [wlist.index for wlist in wordlists]
+    return [(offset + i, length) for i, length in cPalabra.scan_words(s, indices)]
 
 def produce_word_counts(word):
     counts = {}
@@ -210,54 +264,145 @@ def produce_word_counts(word):
             counts[c] += 1
     return counts
 
-def get_contained_words(wordlists, word):
+def get_contained_words(wordlists, word, limit=None):
     """
     Produce all words w, where len(w) > len(word), such that
     all characters of word are found in w.
+    When limit is given, at most limit words are produced.
     """
     c_items = produce_word_counts(word).items()
     result = []
     for p, wlist in wordlists.items():
         for l in xrange(len(word) + 1, constants.MAX_WORD_LENGTH):
-            result.extend(cPalabra.get_contained_words(wlist.index, l, c_items, len(c_items)))
+            if limit is None:
+                result.extend(cPalabra.get_contained_words(wlist.index, l, c_items, len(c_items)))
+                continue
+            if len(result) >= limit:
+                return c_items, result
+            result.extend(cPalabra.get_contained_words(wlist.index, l, c_items, len(c_items), limit - len(result)))
     return c_items, result
 
-def verify_contained_words(wordlists, pairs):
+def find_anagrams(wordlists, word):
     """
-    Given pairs (a, b), produce all pairs such that all
-    characters of b are found in a word of a wordlist.
+    Give all (word, score) pairs of words in the wordlists
+    that consist of the same letters as word.
     """
     result = []
-    for p, wlist in wordlists.items():
-        result.extend(cPalabra.verify_contained_words(wlist.index, pairs))
+    for wlist in wordlists:
+        result.extend(cPalabra.find_anagrams(wlist.index, word))
     return result
 
+# number of pairs that is verified at once by iter_verified_words
+VERIFY_CHUNK_SIZE = 10000
+
+def iter_verified_words(wordlists, pairs, n_threads=1):
+    """
+    Given pairs (a, b), yield all pairs (a, w) such that w is a word
+    of a wordlist with the same characters as b. The pairs are verified
+    in chunks, each divided over n_threads threads, and the results of
+    a chunk are yielded as soon as it is done.
+    """
+    for p, wlist in wordlists.items():
+        for i in xrange(0, len(pairs), VERIFY_CHUNK_SIZE):
+            chunk = pairs[i:i + VERIFY_CHUNK_SIZE]
+            for item in cPalabra.verify_contained_words(wlist.index, chunk, n_threads):
+                yield item
+
+def verify_contained_words(wordlists, pairs, n_threads=1):
+    """
+    Given pairs (a, b), produce all pairs such that all
+    characters of b are found in a word of a wordlist.
+    """
+    return list(iter_verified_words(wordlists, pairs, n_threads))
+
+class SimilarWords(object):
+    """
+    Index of the substrings of at least min_length characters of
+    the entries of a grid. The index is updated per entry so only
+    the entries that have changed need to be indexed again.
+    """
+    def __init__(self, min_length=3):
+        self.min_length = min_length
+        self.entries = {}
+        self.slots = {}
+        self.proper = {}
+
+    def _substrings(self, word):
+        l_word = len(word)
+        return set([word[o:o + l] for l in xrange(self.min_length, l_word + 1)
+            for o in xrange(0, l_word - l + 1)])
+
+    def add_entry(self, x, y, d, word):
+        """Index the given word as the entry of the slot (x, y, d)."""
+        if (x, y, d) in self.entries:
+            self.remove_entry(x, y, d)
+        self.entries[(x, y, d)] = word
+        l_word = len(word)
+        for s in self._substrings(word):
+            try:
+                self.slots[s].add((x, y, d))
+            except KeyError:
+                self.slots[s] = set([(x, y, d)])
+            if len(s) < l_word:
+                self.proper[s] = self.proper.get(s, 0) + 1
+
+    def remove_entry(self, x, y, d):
+        """Remove the entry of the slot (x, y, d) from the index."""
+        word = self.entries.pop((x, y, d))
+        l_word = len(word)
+        for s in self._substrings(word):
+            slots = self.slots[s]
+            slots.discard((x, y, d))
+            if not slots:
+                del self.slots[s]
+            if len(s) < l_word:
+                self.proper[s] -= 1
+                if not self.proper[s]:
+                    del self.proper[s]
+
+    def update(self, grid):
+        """Index the entries of the grid that differ from the indexed ones."""
+        current = {}
+        for n, x, y, d in grid.words(allow_duplicates=True, include_dir=True):
+            current[(x, y, d)] = grid.gather_word(x, y, d)
+        for slot in [slot for slot in self.entries if slot not in current]:
+            self.remove_entry(*slot)
+        for (x, y, d), word in current.items():
+            if self.entries.get((x, y, d)) != word:
+                self.add_entry(x, y, d, word)
+
+    def result(self, shared=False):
+        """
+        Return a dict with the substrings that are part of a longer
+        entry and the entries in which they can be found. If shared
+        is True, only substrings found in multiple entries are included.
+        """
+        entries = self.entries
+        key = lambda slot: (slot[1], slot[0], slot[2])
+        result = {}
+        for s in self.proper:
+            slots = self.slots[s]
+            if len(slots) == 1:
+                if shared:
+                    continue
+            else:
+                slots = sorted(slots, key=key)
+            result[s] = [slot + (entries[slot],) for slot in slots]
+        return result
+
 def similar_words(grid, min_length=3):
     """
     Compute all substrings of at least min_length characters
     and the words in which they can be found.
     """
-    lengths = {}
-    words = []
-    for n, x, y, d in grid.words(allow_duplicates=True, include_dir=True):
-        word = grid.gather_word(x, y, d)
-        words.append((x, y, d, word, len(word)))
-    substrings = {}
-    for x, y, d, word, l_word in words:
-        for l in xrange(min_length, l_word):
-            for o in xrange(0, l_word - min_length + 1):
-                subs = word[o:o + l]
-                if subs not in substrings:
-                    substrings[subs] = []
-    for s in substrings.keys():
-        for x, y, d, word, l_word in words:
-            if s in word:
-                substrings[s].append((x, y, d, word))
-    return substrings
-
-def create_wordlists(prefs, previous=None):
+    index = SimilarWords(min_length)
+    index.update(grid)
+    return index.result()
+
+def create_wordlists(prefs, previous=None, progress=None):
     """
     Convert preference data of word files into CWordLists.
+    The progress callable receives the fraction of the files that is loaded.
     """
     files = []
     for i, data in enumerate(prefs):
@@ -280,12 +425,23 @@ def create_wordlists(prefs, previous=None):
                 path = data["path"]["value"]
                 name = data["name"]["value"]
                 wordlists.append(CWordList(path, index=index, name=name))
+        for clist in previous:
+            if clist not in wordlists:
+                cPalabra.unmerge(clist.index)
         return wordlists
-    return [CWordList(path, index=i, name=name) for i, path, name in files]
+    def file_progress(f):
+        if progress is None:
+            return None
+        return lambda fraction: progress((f + fraction) / len(files))
+    return [CWordList(path, index=i, name=name, progress=file_progress(f))
+        for f, (i, path, name) in enumerate(files)]
 
 def remove_wordlist(prefs, wordlists, path):
     n_prefs = [p for p in prefs if p["path"]["value"] != path]
     n_wordlists = [wlist for wlist in wordlists if wlist.path != path]
+    for wlist in wordlists:
+        if wlist.path == path:
+            cPalabra.unmerge(wlist.index)
     return n_prefs, n_wordlists
 
 def rename_wordlists(prefs, wordlists, path, name):
@@ -321,7 +477,20 @@ def search_wordlists(wordlists, length, constraints, more=None, sort=True, optio
     (i.e., if intersecting word at position 0 starts with 'a' then
     main word must also have a constraint 'a' at position 0).
 
-    Words are returned in alphabetical order.
+    Words are returned in alphabetical order, or by decreasing score
+    when the order_by_score option is set.
+
+    When the cursor option is set, a SearchCursor is returned instead
+    of a list. It supports len() and index and slice access and only
+    creates the tuples of the words that are accessed.
+
+    When the limit option is given, only the first limit words are
+    returned, as a tuple (words, total) where total is the number
+    of words that match.
+
+    When the generation option is given together with one of the
+    above options, None is returned if a search of a newer generation
+    is started (see SearchWorker) before this search is done.
     """
     def cs_to_str(l, cs):
         result = ['.' for i in xrange(l)]
@@ -336,19 +505,150 @@ def search_wordlists(wordlists, length, constraints, more=None, sort=True, optio
         more = css_to_strs(more)
     indices = [wlist.index for wlist in wordlists]
     result = cPalabra.search(length, constraints, more, indices, options)
+    if options is not None and (options.get(constants.SEARCH_OPTION_LIMIT) is not None
+        or options.get(constants.SEARCH_OPTION_ORDER_BY_SCORE)
+        or options.get(constants.SEARCH_OPTION_CURSOR)):
+        return result
     if sort and len(indices) > 1:
         result.sort(key=itemgetter(0))
     return result
 
-def search_wordlists_by_pattern(wordlists, pattern, sort=None):
+class SearchWorker(object):
+    """
+    Search word lists in a separate thread so that the interface remains
+    responsive. Only the newest request is searched: a search that is
+    superseded by a newer request is abandoned and its words are never
+    passed to the callback, which is called in the main loop.
+    """
+    def __init__(self, callback):
+        self.callback = callback
+        self.generation = 0
+        self.request = None
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def search(self, wordlists, length, constraints, more=None, options=None):
+        """Search the word lists, as search_wordlists, in the worker thread."""
+        with self.condition:
+            self._next_generation()
+            options = dict(options or {})
+            options[constants.SEARCH_OPTION_GENERATION] = self.generation
+            self.request = (self.generation, wordlists, length, constraints, more, options)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify()
+
+    def cancel(self):
+        """Abandon the current search, if any."""
+        with self.condition:
+            self._next_generation()
+            self.request = None
+
+    def _next_generation(self):
+        self.generation += 1
+        cPalabra.set_search_generation(self.generation)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.request is None:
+                    self.condition.wait()
+                generation, wordlists, length, constraints, more, options = self.request
+                self.request = None
+            try:
+                words = search_wordlists(wordlists, length, constraints, more, options=options)
+            except Exception:
+                # a failed search must not stop the searches after it
+                traceback.print_exc()
+                continue
+            if words is not None:
+                glib.idle_add(self._deliver, generation, words)
+
+    def _deliver(self, generation, words):
+        if generation == self.generation:
+            self.callback(words)
+        return False
+
+class WordPattern(object):
+    """
+    A pattern of letters, ? (one letter) and * (zero or more letters).
+    The pattern is compiled into the lengths of the words that it can
+    match and the letters at fixed positions from the start and the
+    end of a word. A regular expression is only needed for the letters
+    between two *.
+    """
+    def __init__(self, pattern):
+        ord_a, ord_z = ord("a"), ord("z")
+        pattern = pattern.lower()
+        pattern = ''.join([c for c in pattern if ord_a <= ord(c) <= ord_z or c in ['*', '?']])
+        pattern = re.sub(r"\*+", "*", pattern)
+        self.pattern = pattern
+        segments = pattern.split("*")
+        self.prefix = segments[0]
+        self.suffix = segments[-1] if len(segments) > 1 else ""
+        middle = segments[1:-1]
+        self.min_length = sum([len(segment) for segment in segments])
+        self.max_length = self.min_length if len(segments) == 1 else None
+        if [segment for segment in middle if segment.strip("?")]:
+            self.regex = re.compile(pattern.replace("?", ".").replace("*", ".*") + "$")
+        else:
+            self.regex = None
+
+    def lengths(self):
+        """Return the lengths of the words that this pattern can match."""
+        if self.max_length is None:
+            return xrange(max(1, self.min_length), constants.MAX_WORD_LENGTH)
+        return xrange(max(1, self.min_length), self.max_length + 1)
+
+    def constraints(self, length):
+        """Return the letters at fixed positions in a word of the given length."""
+        n_free = length - len(self.prefix) - len(self.suffix)
+        return (self.prefix + "." * n_free + self.suffix).replace("?", ".")
+
+    def match(self, word):
+        """Return True if the word matches this pattern."""
+        length = len(word)
+        if length < self.min_length:
+            return False
+        if self.max_length is not None and length > self.max_length:
+            return False
+        for i, c in enumerate(self.constraints(length)):
+            if c != "." and word[i] != c:
+                return False
+        return self.regex is None or self.regex.match(word) is not None
+
+    def narrows(self, other):
+        """
+        Return True if each word that matches this pattern also
+        matches the other pattern (e.g., w*d narrows w*).
+        """
+        # the other pattern is matched against the tokens of this pattern:
+        # its letters only against the same letters, its ? against
+        # letters or ? and its * against any sequence of tokens
+        tokens = {"?": "[a-z?]", "*": ".*"}
+        regex = ''.join([tokens.get(c, c) for c in other.pattern]) + "$"
+        return re.match(regex, self.pattern) is not None
+
+def search_wordlists_by_pattern(wordlists, pattern, sort=None, previous=None):
     """
     Give all (descr, word) pairs of words in wordlists that match the
     pattern. descr is either the name of the wordlist or its path.
+
+    When previous is given, as a tuple (pattern, result) of an earlier
+    search of the same word lists, and the pattern narrows the previous
+    pattern (for example, when the user continues typing) then the words
+    are selected from the previous result instead.
     """
-    result = []
-    for wlist in wordlists:
-        name = wlist.name if wlist.name is not None else wlist.path
-        result.extend([(name, w, score) for w, score in wlist.find_by_pattern(pattern)])
+    pattern = WordPattern(pattern)
+    if previous is not None and pattern.narrows(WordPattern(previous[0])):
+        result = [item for item in previous[1] if pattern.match(item[1])]
+    else:
+        result = []
+        for wlist in wordlists:
+            name = wlist.name if wlist.name is not None else wlist.path
+            result.extend([(name, w, score) for w, score in wlist.find_by_pattern(pattern)])
     if sort is not None:
         if sort == 0: # alphabet
             result.sort(key=itemgetter(1))
@@ -358,21 +658,36 @@ def search_wordlists_by_pattern(wordlists, pattern, sort=None):
             result.sort(key=itemgetter(2), reverse=True)
     return result
 
-def analyze_words(grid, g_words, g_cs, g_lengths, words):
-    cs = {}
-    for n, x, y, d in g_words:
-        cs[x, y, d] = grid.gather_all_constraints(x, y, d, g_cs, g_lengths)
+def compute_letter_ranks(words):
+    """
+    Rank the characters at each position of the words of each length
+    from most to least frequent (ties in alphabetical order). The ranks
+    of the words of length l are stored in an array of l * 256 values in
+    which the rank of character c at position i is at i * 256 + ord(c).
+    A character that does not occur ranks after all other characters.
+    """
     counts = cPalabra.compute_counts(words)
+    ranks = {}
     for l in words:
+        table = array('H')
         for i in xrange(l):
-            counts[l][i] = sorted(counts[l][i].items(), key=itemgetter(1), reverse=True)
-            #if counts[l][i]:
-            #    print l, i, counts[l][i]
+            order = sorted(counts[l][i].items(), key=lambda item: (-item[1], item[0]))
+            ranks_i = [len(order)] * 256
+            for r, (c, count) in enumerate(order):
+                ranks_i[ord(c)] = r
+            table.extend(ranks_i)
+        ranks[l] = table
+    return ranks
+
+def analyze_words(grid, g_words, g_cs, g_lengths, words, ranks=None):
+    cs = {}
+    for n, x, y, d in g_words:
+        cs[x, y, d] = grid.gather_all_constraints(x, y, d, g_cs, g_lengths)
+    if ranks is None:
+        ranks = compute_letter_ranks(words)
     result = {}
     for n, x, y, d in g_words:
-        data = cPalabra.compute_distances([w for w, score in words[g_lengths[x, y, d]]], cs, counts, (x, y, d))
-        result[x, y, d] = [t[0] for t in sorted(data, key=itemgetter(1))]
-        #print x, y, d, result[x, y, d], data
+        result[x, y, d] = cPalabra.sort_by_distance(words[g_lengths[x, y, d]], cs, ranks, (x, y, d))
     return result
 
 def write_wordlists(wlists):
@@ -385,12 +700,29 @@ def write_wordlists(wlists):
             fail.append((wlist.name, e.strerror))
     return fail
 
-class CWordList:
-    def __init__(self, content, index=0, name=None, score=0):
-        """Accepts either a filepath or a list of words, possibly with ranks."""
+class CWordList(object):
+    def __init__(self, content, index=0, name=None, score=0, progress=None):
+        """
+        Accepts either a filepath or a list of words, possibly with ranks.
+        A word list file is loaded from its compiled index when it is
+        up-to-date, otherwise the file is read and the index is written.
+        While a file is read, progress is called with the fraction read.
+        """
+        self.index = index
+        self.name = name
+        self._positions = None
+        self._ranks = None
         if isinstance(content, str):
-            words = list(read_wordlist(content, score))
             self.path = content
+            compiled = open_index(content, score)
+            if compiled is not None:
+                # the words are materialized when self.words is first used
+                self._words = None
+                cPalabra.load_index(index, *compiled)
+            else:
+                self.words = cPalabra.load_wordlist(content, index, score
+                    , multiprocessing.cpu_count(), progress)
+                write_index(content, self.words, score)
         else:
             self.path = None
             words = [(w if isinstance(w, tuple) else (w, score)) for w in content]
@@ -409,56 +741,111 @@ class CWordList:
                         return False
                 return True
             words = [item for item in words if is_ok(item[0])]
-        self.words = cPalabra.preprocess(words, index)
-        # keys of self.words = lengths
-        # values = list of words of that length with (word, score)
-        self.index = index
-        self.name = name
+            self.words = cPalabra.preprocess(words, index)
+        # the index has the words of this word list until it is loaded again
+        self.generation = cPalabra.index_generation(index)
+
+    def _owns_index(self):
+        """Return True if the index still has the words of this word list."""
+        return cPalabra.index_generation(self.index) == self.generation
+
+    def _get_words(self):
+        if self._words is None:
+            self._words = cPalabra.index_words(self.index)
+        return self._words
 
-    def find_by_pattern(self, pattern):
+    def _set_words(self, words):
+        self._words = words
+        self._positions = None
+        self._ranks = None
+
+    def _get_positions(self):
+        """
+        Return a dict with for each word its positions in the list
+        of words of its length, in increasing order.
+        """
+        if self._positions is None:
+            positions = {}
+            for l_words in self.words.values():
+                for i, (w, score) in enumerate(l_words):
+                    if w in positions:
+                        positions[w].append(i)
+                    else:
+                        positions[w] = [i]
+            self._positions = positions
+        return self._positions
+
+    # keys of self.words = lengths
+    # values = list of words of that length with (word, score)
+    words = property(_get_words, _set_words)
+
+    def find_by_pattern(self, pattern, previous=None):
         """
         Find all words that match the specified pattern.
         ? = one character
         * = zero or more characters
+        The words are searched in the index of each length that the
+        pattern allows. When previous is given, the words that match
+        the pattern are instead selected from previous, which should
+        be the words of a pattern that this pattern narrows.
         """
-        ord_a, ord_z = ord("a"), ord("z")
-        pattern = pattern.lower()
-        pattern = ''.join([c for c in pattern if ord_a <= ord(c) <= ord_z or c in ['*', '?']])
-        pattern = pattern.replace("?", ".")
-        pattern = pattern.replace("*", ".*")
-        prog = re.compile(pattern + "$")
+        if not isinstance(pattern, WordPattern):
+            pattern = WordPattern(pattern)
+        if previous is not None:
+            return [item for item in previous if pattern.match(item[0])]
         result = []
-        for l, words in self.words.items():
-            result.extend([item for item in words if prog.match(item[0])])
+        if not self._owns_index():
+            # the index has been taken over by another word list
+            for length in pattern.lengths():
+                words = self.words.get(length, [])
+                result.extend([item for item in words if pattern.match(item[0])])
+            return result
+        for length in pattern.lengths():
+            words = cPalabra.search(length, pattern.constraints(length), None, [self.index], None)
+            if pattern.regex is None:
+                result.extend([(w, score) for w, score, valid in words])
+            else:
+                match = pattern.regex.match
+                result.extend([(w, score) for w, score, valid in words if match(w)])
         return result
 
     def search(self, length, constraints, more=None, options=None):
         """
         Search for words that match the given criteria.
         """
-        return search_wordlists([self], length, constraints, more, options)
+        return search_wordlists([self], length, constraints, more, options=options)
 
     def update_score(self, word, new_score):
-        """Update the first occurrence of word with the new score."""
+        """
+        Update an occurrence of word with the new score. The index changes
+        the first occurrence with the same old score, which is the same
+        entry even after remove_words has reordered self.words.
+        """
+        positions = self._get_positions().get(word)
+        if not positions:
+            return
         l_word = len(word)
-        for w, score in self.words[l_word]:
-            if w == word:
-                item = (w, score)
-                break
-        index = self.words[l_word].index(item)
-        self.words[l_word][index] = (word, new_score)
-        cPalabra.update_score(word, l_word, new_score, self.index)
+        old_score = self.words[l_word][positions[0]][1]
+        self.words[l_word][positions[0]] = (word, new_score)
+        cPalabra.update_score(word, l_word, new_score, self.index, old_score)
 
     def change_scores(self, change, value):
-        """Change all scores in this word list using the given modification."""
-        for length in self.words.keys():
-            for i, (w, score) in enumerate(self.words[length]):
-                if change == "to":
-                    next_score = value
-                elif change == "by":
-                    next_score = score + value
-                self.words[length][i] = (w, next_score)
-                cPalabra.update_score(w, length, next_score, self.index)
+        """
+        Change all scores in this word list using the given modification:
+        "to" or "by" the given value, or "map" to give each word in the
+        dict value its score in the dict.
+        """
+        cPalabra.change_scores(self.index, change, value)
+        if self._words is None:
+            # the words are materialized from the index with their new scores
+            return
+        for length, l_words in self.words.items():
+            if change == "to":
+                self.words[length] = [(w, value) for w, score in l_words]
+            elif change == "by":
+                self.words[length] = [(w, score + value) for w, score in l_words]
+            elif change == "map":
+                self.words[length] = [(w, value.get(w, score)) for w, score in l_words]
 
     def write_to_file(self):
         """Write the contents of this word list to a file."""
@@ -470,14 +857,19 @@ class CWordList:
 
     def count_words(self):
         """Return the number of words in this word list."""
-        return sum([len(self.words[i]) for i in self.words.keys()])
+        return sum(self.get_word_counts().values())
 
     def get_word_counts(self):
         """Return the number of words in this word list by length."""
+        if self._owns_index():
+            # counted from the index so the words need not be materialized
+            return cPalabra.word_counts(self.index)
         return dict([(k, len(ws)) for k, ws in self.words.items()])
 
     def get_score_counts(self):
         """Return the number of words in this word list by score."""
+        if self._owns_index():
+            return cPalabra.score_counts(self.index)
         scores = {}
         for k, k_words in self.words.items():
             for w, s in k_words:
@@ -490,18 +882,18 @@ class CWordList:
     def average_word_length(self):
         """Return the average length of a word in this word list."""
         counts = self.get_word_counts()
-        n_words = self.count_words()
+        n_words = sum(counts.values())
         if n_words == 0:
             return 0
         total = 0.0
-        for l in self.words.keys():
-            total += (l * counts[l])
+        for l, count in counts.items():
+            total += (l * count)
         return total / n_words
 
     def average_word_score(self):
         """Return the average score of a word in this word list."""
         scores = self.get_score_counts()
-        n_words = self.count_words()
+        n_words = sum(scores.values())
         if n_words == 0:
             return 0
         total = 0.0
@@ -509,25 +901,53 @@ class CWordList:
             total += (s * count)
         return total / n_words
 
+    def get_letter_ranks(self):
+        """
+        Return the ranks of the characters at each position of the words
+        (see compute_letter_ranks), computed again after words are changed.
+        """
+        if self._ranks is None:
+            self._ranks = compute_letter_ranks(self.words)
+        return self._ranks
+
     def add_word(self, word, score):
         """Add a word to the word list."""
         key = len(word)
+        positions = self._get_positions()
         self.words[key].append((word, score))
+        if word in positions:
+            positions[word].append(len(self.words[key]) - 1)
+        else:
+            positions[word] = [len(self.words[key]) - 1]
         cPalabra.insert_word(self.index, len(word), word, score)
+        self._ranks = None
 
     def remove_words(self, words):
         """
         Remove a list of words from the word list.
-        This method removes the words and rebuilds the word list.
+        Each word is removed from the index, without rebuilding it, and
+        the last word of its length takes its place in self.words.
         """
-        rebuild = False
+        positions = self._get_positions()
         for item in words:
-            key = len(item[0])
-            if item in self.words[key]:
-                self.words[key].remove(item)
-                rebuild = True
-        if rebuild:
-            new_words = []
-            for l in self.words.keys():
-                new_words.extend(self.words[l])
-            self.words = cPalabra.preprocess(new_words, self.index)
+            w, score = item
+            w_positions = positions.get(w, [])
+            for i in w_positions:
+                if self.words[len(w)][i] == item:
+                    break
+            else:
+                continue
+            l_words = self.words[len(w)]
+            last = len(l_words) - 1
+            w_positions.remove(i)
+            if not w_positions:
+                del positions[w]
+            if i != last:
+                moved = l_words[last]
+                l_words[i] = moved
+                m_positions = positions[moved[0]]
+                m_positions.pop()
+                insort(m_positions, i)
+            l_words.pop()
+            cPalabra.remove_word(self.index, len(w), w, score)
+            self._ranks = None
@@ -18,6 +18,7 @@
 import unittest
 import gtk
 import os
+import random
 
 import palabralib.clue as clue
 import palabralib.constants as constants
@@ -27,10 +28,10 @@ class ClueTestCase(unittest.TestCase):
     LOCATION2 = "palabralib/tests/test_clues2.txt"
 
     def tearDown(self):
-        if os.path.exists(self.LOCATION):
-            os.remove(self.LOCATION)
-        if os.path.exists(self.LOCATION2):
-            os.remove(self.LOCATION2)
+        for path in [self.LOCATION, self.LOCATION2]:
+            for p in [path, clue.get_clue_index_path(path)]:
+                if os.path.exists(p):
+                    os.remove(p)
 
     def testReadCluesDoesNotExist(self):
         """If the clue database does not exist then an empty dict is returned."""
@@ -137,6 +138,97 @@ class ClueTestCase(unittest.TestCase):
         result = clue.lookup_clues(files, "word")
         self.assertEqual(result, ["clue, with comma"])
 
+    def testClueIndex(self):
+        """A clue file is loaded from its compiled index once it has been written."""
+        with open(self.LOCATION, 'w') as f:
+            f.write("word,clue\nword,clue2\nOtherword,clue3\nabc,clue4")
+        prefs = [{"path": {"value": self.LOCATION}, "name": {"value": "ClueFile"}}]
+        files = clue.create_clues(prefs)
+        self.assertTrue(os.path.exists(clue.get_clue_index_path(self.LOCATION)))
+        store = clue.open_clue_index(self.LOCATION)
+        self.assertTrue(isinstance(store, clue.ClueStore))
+        self.assertEqual(store, clue.read_clues(self.LOCATION))
+        self.assertEqual(store["word"], ["clue", "clue2"])
+        self.assertEqual(store["otherword"], ["clue3"])
+        self.assertTrue("abc" in store)
+        self.assertTrue("ab" not in store)
+        self.assertTrue("zzz" not in store)
+        self.assertEqual(list(store), ["abc", "otherword", "word"])
+        self.assertEqual(clue.lookup_clues(files, "Word"), ["clue", "clue2"])
+        self.assertEqual(clue.count_n_words(files[0]), 3)
+        self.assertEqual(clue.count_n_clues(files[0]), 4)
+
+    def testClueIndexOutdated(self):
+        """The compiled index is not used when the clue file has changed."""
+        with open(self.LOCATION, 'w') as f:
+            f.write("word,clue")
+        self.assertTrue(clue.write_clue_index(self.LOCATION, clue.read_clues(self.LOCATION)))
+        self.assertEqual(clue.open_clue_index(self.LOCATION2), None)
+        with open(self.LOCATION, 'a') as f:
+            f.write("\nword,clue2")
+        self.assertEqual(clue.open_clue_index(self.LOCATION), None)
+        self.assertEqual(clue.load_clues(self.LOCATION)["word"], ["clue", "clue2"])
+
+    def testClueIndexEmpty(self):
+        """A clue file without clues has an empty compiled index."""
+        with open(self.LOCATION, 'w') as f:
+            f.write("word\n")
+        self.assertEqual(clue.load_clues(self.LOCATION), {})
+        self.assertEqual(len(clue.open_clue_index(self.LOCATION)), 0)
+
+    def testSearchClues(self):
+        """Clues can be searched by the words in the clue, shortest clues first."""
+        with open(self.LOCATION, 'w') as f:
+            f.write("nile,Long African river\nrhine,River in Europe\nriver,Stream\nseine,River, in Paris\nnile,Egypt's river")
+        files = clue.create_clues([{"path": {"value": self.LOCATION}, "name": {"value": "P1"}}])
+        self.assertTrue(isinstance(files[0].data, clue.ClueStore))
+        result = clue.search_clues(files, "River")
+        self.assertEqual(result, [("nile", "Egypt's river"), ("rhine", "River in Europe")
+            , ("seine", "River, in Paris"), ("nile", "Long African river")])
+        self.assertEqual(clue.search_clues(files, "in river"), [("rhine", "River in Europe"), ("seine", "River, in Paris")])
+        self.assertEqual(clue.search_clues(files, "river", limit=1), [("nile", "Egypt's river")])
+        self.assertEqual(clue.search_clues(files, "ocean"), [])
+        self.assertEqual(clue.search_clues(files, ""), [])
+
+    def testSearchCluesPattern(self):
+        """Clues can be searched by a pattern of their words."""
+        with open(self.LOCATION, 'w') as f:
+            f.write("nile,Long African river\nrhine,River in Europe\nriver,Stream\nrhone,River in France")
+        with open(self.LOCATION2, 'w') as f:
+            f.write("rhine,German river\n")
+        p1 = {"path": {"value": self.LOCATION}, "name": {"value": "P1"}}
+        p2 = {"path": {"value": self.LOCATION2}, "name": {"value": "P2"}}
+        files = clue.create_clues([p1, p2])
+        self.assertEqual(clue.search_clues(files, pattern="r*r"), [("river", "Stream")])
+        self.assertEqual(clue.search_clues(files, "river", pattern="rh?ne")
+            , [("rhine", "German river"), ("rhine", "River in Europe"), ("rhone", "River in France")])
+        self.assertEqual(clue.search_clues(files, pattern="*e", limit=2)
+            , [("rhine", "German river"), ("rhine", "River in Europe")])
+
+    def testSearchCluesIndexMatchesFile(self):
+        """The compiled index finds the same clues as the clue file, in the same order."""
+        rnd = random.Random(0)
+        with open(self.LOCATION, 'w') as f:
+            for i in xrange(2000):
+                word = "".join(rnd.choice("abcd") for j in xrange(rnd.randint(3, 5)))
+                clue_words = [rnd.choice(["the", "in", "river", "city", "old"])
+                    for j in xrange(rnd.randint(1, 4))]
+                f.write("%s,%s\n" % (word, " ".join(clue_words)))
+        store = [clue.ClueFile("path", "name", clue.load_clues(self.LOCATION))]
+        self.assertTrue(isinstance(store[0].data, clue.ClueStore))
+        clues = [clue.ClueFile("path", "name", clue.read_clues(self.LOCATION))]
+        for query, pattern in [("the", None), ("in the", None), ("old city in", None)
+            , ("river", "a*"), ("the in", "b?c*"), ("city", "*d")]:
+            for limit in [3, 10 ** 6]:
+                self.assertEqual(clue.search_clues(store, query, pattern, limit)
+                    , clue.search_clues(clues, query, pattern, limit))
+
+    def testSearchCluesWithoutIndex(self):
+        """Clue files without compiled index can be searched too."""
+        files = [clue.ClueFile("path", "name", {"nile": ["Long African river"], "river": ["Stream"]})]
+        self.assertEqual(clue.search_clues(files, "river"), [("nile", "Long African river")])
+        self.assertEqual(clue.search_clues(files, pattern="r*"), [("river", "Stream")])
+
     def testClueIterNext(self):
         """It is possible to cycle forward through a list store."""
         store = gtk.ListStore(str)
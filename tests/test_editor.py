@@ -15,6 +15,8 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import copy
+import random
 import gtk
 import unittest
 
@@ -23,8 +25,22 @@ from palabralib.grid import Grid
 from palabralib.puzzle import Puzzle
 import palabralib.constants as constants
 import palabralib.editor as editor
+import palabralib.transform as transform
 import palabralib.word as word
 
+# klm, nop and qrs fill the rows of a 3x3 grid and knq, lor and mps its columns
+FILL_WORDS = ["aaa", "kiw", "klm", "nop", "qrs", "knq", "lor", "mps", "zzz"]
+
+# a 2x2 grid can be filled with ab/cd for the highest total score and with
+# xy/zw for the highest lowest score
+SCORED_WORDS = [("ab", 10), ("cd", 10), ("ac", 1), ("bd", 1)
+    , ("xy", 5), ("zw", 5), ("xz", 5), ("yw", 5)]
+
+# too many words to fill a 7x7 grid quickly, for the limits of a fill
+_rnd = random.Random(0)
+RANDOM_WORDS = ["".join(_rnd.choice("abcdefghij") for i in xrange(7))
+    for j in xrange(3000)]
+
 class EditorMockWindow:
     def __init__(self):
         self.called = 0
@@ -480,6 +496,291 @@ class EditorTestCase(unittest.TestCase):
         g2 = editor.attempt_fill(g, ["klm", "nop", "qrs", "knq", "lor", "mps"])
         self.assertEqual(g2.count_chars(include_blanks=False), 9)
 
+    def _fill(self, g, words, **options):
+        """
+        Fill the grid with the words and return the fills and the stats.
+        The options override the default fill options with the propagating
+        engine.
+        """
+        clist = word.CWordList(words)
+        fill_options = dict(editor.DEFAULT_FILL_OPTIONS)
+        fill_options[constants.FILL_OPTION_ENGINE] = constants.FILL_ENGINE_PROPAGATE
+        fill_options.update(options)
+        stats = {}
+        results = editor.fill(g, clist.words, fill_options, stats=stats)
+        cPalabra.postprocess()
+        return results, stats
+
+    def _fill_result(self, g, words, **options):
+        results, stats = self._fill(g, words, **options)
+        self.assertEqual(len(results), 1)
+        return sorted(results[0])
+
+    def _assert_words(self, g, result, words):
+        g = copy.deepcopy(g)
+        transform.modify_chars(g, chars=result)
+        for n, x, y, d in g.words(allow_duplicates=True, include_dir=True):
+            self.assertTrue(g.gather_word(x, y, d).lower() in words)
+
+    def testFillPropagating(self):
+        """The propagating engine fills a grid in which every cell is crossed."""
+        g = Grid(3, 3)
+        result = self._fill_result(g, FILL_WORDS, duplicate=constants.FILL_DUPLICATE_TRUE)
+        self.assertEqual(len(result), 9)
+        self._assert_words(g, result, FILL_WORDS)
+        self.assertTrue((1, 1, "O") in result)
+
+    def testFillPropagatingConstraints(self):
+        """The letters in the grid are kept and the words fit around them."""
+        g = Grid(3, 3)
+        g.set_block(1, 1, True)
+        g.set_char(2, 2, 'G')
+        words = ["abc", "ade", "cfg", "ehg", "abx", "adx"]
+        result = self._fill_result(g, words)
+        self.assertEqual(len(result), 7)
+        self.assertTrue((2, 2, "G") not in result)
+        g.set_char(2, 2, 'G')
+        self._assert_words(g, result, words)
+
+    def testFillPropagatingDuplicates(self):
+        """A word is only placed once when duplicates are not allowed."""
+        g = Grid(2, 2)
+        self.assertEqual(len(self._fill_result(g, ["aa"])), 4)
+        result = self._fill_result(g, ["aa"], duplicate=constants.FILL_DUPLICATE_TRUE)
+        self.assertTrue(len(result) < 4)
+        result = self._fill_result(g, ["ab", "ac", "bd", "cd"]
+            , duplicate=constants.FILL_DUPLICATE_TRUE)
+        self.assertEqual(len(result), 4)
+
+    def testFillPropagatingImpossible(self):
+        """Without a complete fill the best partial fill is given."""
+        g = Grid(3, 1)
+        self.assertEqual(self._fill_result(g, ["abcd"]), [])
+        g = Grid(3, 3)
+        g.set_block(1, 1, True)
+        words = ["abc", "cde", "xyz"]
+        self.assertEqual(len(self._fill_result(g, words)), 8)
+        result = self._fill_result(g, words, duplicate=constants.FILL_DUPLICATE_TRUE)
+        self.assertTrue(0 < len(result) < 8)
+        g = Grid(3, 3)
+        for x in xrange(3):
+            g.set_block(x, 1, True)
+        result = self._fill_result(g, ["abc"], duplicate=constants.FILL_DUPLICATE_TRUE)
+        self.assertEqual(len(result), 3)
+
+    def testFillPropagatingBackjump(self):
+        """A dead end jumps back over the slots that did not cause it."""
+        g = Grid(6, 2)
+        g.set_block(2, 0, True)
+        g.set_block(2, 1, True)
+        for x in xrange(3, 6):
+            g.set_block(x, 1, True)
+        clist = word.CWordList(["ab", "ba", "xyz"])
+        options = dict(editor.DEFAULT_FILL_OPTIONS)
+        options[constants.FILL_OPTION_ENGINE] = constants.FILL_ENGINE_PROPAGATE
+        options[constants.FILL_OPTION_DUPLICATE] = constants.FILL_DUPLICATE_TRUE
+        stats = {}
+        results = editor.fill(g, clist.words, options, stats=stats)
+        self.assertEqual(len(results[0]), 5)
+        self.assertTrue((3, 0, "X") in results[0])
+        self.assertEqual(stats["backjumps"], 1)
+        self.assertEqual(stats["skipped"], 1)
+        self.assertEqual(stats["nodes"], 3)
+        self.assertTrue(constants.FILL_OPTION_STATS not in options)
+        cPalabra.postprocess()
+
+    def testFillBudgetNodes(self):
+        """A fill stops after the maximum number of tried words."""
+        for engine in [constants.FILL_ENGINE_GREEDY, constants.FILL_ENGINE_PROPAGATE]:
+            results, stats = self._fill(Grid(7, 7), RANDOM_WORDS
+                , engine=engine, max_nodes=50)
+            self.assertEqual(stats["status"], constants.FILL_STATUS_NODES)
+            self.assertEqual(stats["nodes"], 50)
+            self.assertEqual(len(results), 1)
+
+    def testFillBudgetProgress(self):
+        """A fill reports its progress while it runs."""
+        for engine in [constants.FILL_ENGINE_GREEDY, constants.FILL_ENGINE_PROPAGATE]:
+            infos = []
+            results, stats = self._fill(Grid(7, 7), RANDOM_WORDS
+                , engine=engine, max_nodes=200, progress=infos.append)
+            self.assertEqual(stats["status"], constants.FILL_STATUS_NODES)
+            self.assertTrue(len(infos) > 0)
+            self.assertEqual(sorted(infos[0].keys())
+                , ["fill", "nodes", "nodes_per_second", "slots"])
+            self.assertTrue(0 < infos[-1]["nodes"] <= stats["nodes"])
+            self.assertEqual(len(results), 1)
+
+    def testFillBudgetCancelled(self):
+        """A fill of a superseded generation stops with its best partial fill."""
+        cPalabra.set_fill_generation(2)
+        try:
+            for engine in [constants.FILL_ENGINE_GREEDY, constants.FILL_ENGINE_PROPAGATE]:
+                results, stats = self._fill(Grid(7, 7), RANDOM_WORDS
+                    , engine=engine, generation=1)
+                self.assertEqual(stats["status"], constants.FILL_STATUS_CANCELLED)
+                self.assertEqual(len(results), 1)
+                results, stats = self._fill(Grid(7, 7), RANDOM_WORDS
+                    , engine=engine, generation=2, max_nodes=10)
+                self.assertEqual(stats["status"], constants.FILL_STATUS_NODES)
+        finally:
+            cPalabra.set_fill_generation(0)
+
+    def testFillGreedyIndexChanged(self):
+        """A greedy fill stops when the words of the index are replaced."""
+        # progress may use the index between the attempts of the fill
+        results, stats = self._fill(Grid(7, 7), RANDOM_WORDS
+            , engine=constants.FILL_ENGINE_GREEDY
+            , progress=lambda info: cPalabra.postprocess())
+        self.assertEqual(stats["status"], constants.FILL_STATUS_CHANGED)
+        self.assertEqual(stats["nodes"], 1)
+        self.assertEqual(len(results), 1)
+
+    def testFillBudgetStatus(self):
+        """The status of a fill tells whether the grid was filled."""
+        g = Grid(3, 3)
+        results, stats = self._fill(g, FILL_WORDS, duplicate=constants.FILL_DUPLICATE_TRUE)
+        self.assertEqual(stats["status"], constants.FILL_STATUS_COMPLETE)
+        g.set_char(0, 0, 'X')
+        results, stats = self._fill(g, FILL_WORDS, duplicate=constants.FILL_DUPLICATE_TRUE)
+        self.assertEqual(stats["status"], constants.FILL_STATUS_EXHAUSTED)
+
+    def testFillPropagatingSeed(self):
+        """A seed changes the order of the search but not the outcome."""
+        g = Grid(3, 3)
+        for seed in xrange(1, 6):
+            results, stats = self._fill(g, FILL_WORDS
+                , duplicate=constants.FILL_DUPLICATE_TRUE, seed=seed)
+            self.assertEqual(stats["status"], constants.FILL_STATUS_COMPLETE)
+            self.assertEqual(len(results[0]), 9)
+            self._assert_words(g, results[0], FILL_WORDS)
+
+    def testPortfolioOptions(self):
+        """The workers of a portfolio fill use different heuristics."""
+        options = dict(editor.DEFAULT_FILL_OPTIONS)
+        variants = editor.portfolio_options(options, 4)
+        self.assertEqual(len(variants), 4)
+        self.assertEqual(variants[0][constants.FILL_OPTION_ENGINE], constants.FILL_ENGINE_GREEDY)
+        self.assertEqual(variants[1][constants.FILL_OPTION_ENGINE], constants.FILL_ENGINE_GREEDY)
+        self.assertEqual(variants[1][constants.FILL_OPTION_START], constants.FILL_START_AT_ZERO)
+        for v in variants[2:]:
+            self.assertEqual(v[constants.FILL_OPTION_ENGINE], constants.FILL_ENGINE_PROPAGATE)
+        self.assertEqual([v.get(constants.FILL_OPTION_SEED) for v in variants]
+            , [None, None, 1, 2])
+        for v in variants:
+            self.assertEqual(v[constants.FILL_OPTION_WORKERS], 1)
+        options[constants.FILL_OPTION_ENGINE] = constants.FILL_ENGINE_PROPAGATE
+        variants = editor.portfolio_options(options, 3)
+        self.assertEqual([v.get(constants.FILL_OPTION_SEED) for v in variants]
+            , [None, 1, 2])
+        self.assertEqual(len(editor.portfolio_options(options, 1)), 1)
+
+    def testFillPortfolio(self):
+        """A portfolio fill gives the fill of the worker that completed the grid."""
+        results, stats = self._fill(Grid(7, 7), RANDOM_WORDS, workers=3, max_nodes=100)
+        self.assertEqual(stats["status"], constants.FILL_STATUS_NODES)
+        self.assertTrue(stats["worker"] in range(3))
+        self.assertEqual(len(results), 1)
+        g = Grid(3, 3)
+        results, stats = self._fill(g, FILL_WORDS
+            , duplicate=constants.FILL_DUPLICATE_TRUE, workers=3)
+        self.assertEqual(stats["status"], constants.FILL_STATUS_COMPLETE)
+        self._assert_words(g, results[0], FILL_WORDS)
+
+    def testFillPortfolioCancelled(self):
+        """A superseded portfolio fill terminates its workers."""
+        cPalabra.set_fill_generation(2)
+        try:
+            results, stats = self._fill(Grid(7, 7), RANDOM_WORDS
+                , workers=2, generation=1, max_nodes=10 ** 9)
+            self.assertEqual(stats["status"], constants.FILL_STATUS_CANCELLED)
+            self.assertTrue(len(results) <= 1)
+        finally:
+            cPalabra.set_fill_generation(0)
+
+    def _fill_objective(self, objective, **options):
+        results, stats = self._fill(Grid(2, 2), SCORED_WORDS, objective=objective
+            , duplicate=constants.FILL_DUPLICATE_TRUE, **options)
+        return sorted(results[0]), stats
+
+    def testFillObjective(self):
+        """The fill with the highest total or lowest score is found."""
+        # each fill can also be placed transposed
+        fills_ab = [[(0, 0, "A"), (0, 1, "C"), (1, 0, "B"), (1, 1, "D")]
+            , [(0, 0, "A"), (0, 1, "B"), (1, 0, "C"), (1, 1, "D")]]
+        fills_xy = [[(0, 0, "X"), (0, 1, "Z"), (1, 0, "Y"), (1, 1, "W")]
+            , [(0, 0, "X"), (0, 1, "Y"), (1, 0, "Z"), (1, 1, "W")]]
+        result, stats = self._fill_objective(constants.FILL_OBJECTIVE_TOTAL)
+        self.assertTrue(result in fills_ab)
+        self.assertEqual(stats["score"], 22)
+        self.assertEqual(stats["status"], constants.FILL_STATUS_COMPLETE)
+        result, stats = self._fill_objective(constants.FILL_OBJECTIVE_MINIMUM)
+        self.assertTrue(result in fills_xy)
+        self.assertEqual(stats["score"], 5)
+        self.assertEqual(stats["status"], constants.FILL_STATUS_COMPLETE)
+        result, stats = self._fill_objective(constants.FILL_OBJECTIVE_NONE)
+        self.assertTrue(result in fills_ab)
+        self.assertTrue("score" not in stats)
+
+    def testFillObjectiveBudget(self):
+        """When the budget is spent, the best fill so far is given."""
+        result, stats = self._fill_objective(constants.FILL_OBJECTIVE_MINIMUM, max_nodes=4)
+        self.assertEqual(stats["status"], constants.FILL_STATUS_NODES)
+        self.assertEqual(stats["score"], 1)
+        self.assertEqual(len(result), 4)
+        results, stats = self._fill(Grid(7, 7), RANDOM_WORDS
+            , objective=constants.FILL_OBJECTIVE_TOTAL, max_nodes=10)
+        self.assertEqual(stats["status"], constants.FILL_STATUS_NODES)
+        self.assertEqual(stats["score"], None)
+        self.assertEqual(len(results), 1)
+
+    def testFillObjectivePortfolio(self):
+        """A portfolio fill with an objective gives the best fill of its workers."""
+        result, stats = self._fill_objective(constants.FILL_OBJECTIVE_MINIMUM, workers=3)
+        self.assertEqual(stats["score"], 5)
+        self.assertEqual(stats["status"], constants.FILL_STATUS_COMPLETE)
+        self.assertTrue(stats["worker"] in [0, 1, 2])
+
+    def testFillDoneChangedGrid(self):
+        """A fill is only applied to the unchanged grid it started from."""
+        window = EditorMockWindow()
+        window.puzzle = self.puzzle
+        e = editor.Editor(window)
+        for change, called in [(None, 1), ("grid", 0), ("puzzle", 0)]:
+            window.called = 0
+            e.fill_puzzle = self.puzzle
+            e.fill_grid = copy.deepcopy(self.grid)
+            if change == "grid":
+                self.grid.set_block(0, 0, not self.grid.is_block(0, 0))
+            elif change == "puzzle":
+                window.puzzle = None
+            e._on_fill_done([[(1, 1, "A")]], {})
+            self.assertEqual(window.called, called)
+
+    def testFillWithoutWordLists(self):
+        """Without word lists no fill is started."""
+        window = EditorMockWindow()
+        window.puzzle = self.puzzle
+        window.wordlists = []
+        e = editor.Editor(window)
+        self.assertEqual(e.fill(), False)
+        self.assertEqual(e.fill_puzzle, None)
+
+    def testFillWorkerCancel(self):
+        """A cancelled fill is delivered unless it is abandoned."""
+        done = []
+        worker = editor.FillWorker(None, lambda *args: done.append(args))
+        try:
+            worker.cancel()
+            worker._deliver(worker.cancelled, worker.on_done, [], {})
+            self.assertEqual(len(done), 1)
+            generation = worker.generation
+            worker.cancel(deliver=False)
+            worker._deliver(generation, worker.on_done, [], {})
+            self.assertEqual(len(done), 1)
+        finally:
+            cPalabra.set_fill_generation(0)
+
     def testOnTypingPeriod(self):
         """If the user types a period then a block is placed and selection is moved."""
         actions = editor.on_typing(self.grid, gtk.keysyms.period, (0, 0, "across"))
@@ -35,6 +35,12 @@ from palabralib.word import (
     check_str_for_words,
 )
 
+def remove_wordlist(path):
+    """Remove a word list file and the index that was written for it."""
+    for p in [path, word.get_index_path(path)]:
+        if os.path.exists(p):
+            os.remove(p)
+
 def test_insert(grid, content):
     rows = content.split("\n")
     for i, row in enumerate(rows):
@@ -232,8 +238,7 @@ class WordTestCase(unittest.TestCase):
         self.assertEqual(clist.search(MAX_WORD_LENGTH, []), [])
         self.assertEqual(len(clist.search(MAX_WORD_LENGTH - 1, [])), 1)
         cPalabra.postprocess()
-        if os.path.exists(LOC):
-            os.remove(LOC)
+        remove_wordlist(LOC)
 
     def testInvalidScore(self):
         """Words with an invalid score are ignored."""
@@ -243,8 +248,7 @@ class WordTestCase(unittest.TestCase):
         clist = CWordList(LOC)
         self.assertEqual(clist.words[4], [])
         cPalabra.postprocess()
-        if os.path.exists(LOC):
-            os.remove(LOC)
+        remove_wordlist(LOC)
 
     def testFileDoesNotExist(self):
         """Loading a file that does not exist results in an empty word list."""
@@ -266,6 +270,7 @@ class WordTestCase(unittest.TestCase):
         self.assertTrue(("wordb", 0, True) in result)
         self.assertTrue(("wordc", 100, True) in result)
         cPalabra.postprocess()
+        remove_wordlist(LOC)
 
     def testRankedInput(self):
         """A word can optionally have a score."""
@@ -282,6 +287,7 @@ class WordTestCase(unittest.TestCase):
         self.assertEqual(clist.search(10, []), [("wordspaces", 0, True)])
         self.assertEqual(clist.search(11, []), [])
         cPalabra.postprocess()
+        remove_wordlist(LOC)
 
     def testCompoundTwo(self):
         clist = CWordList(["a a"])
@@ -302,6 +308,7 @@ class WordTestCase(unittest.TestCase):
         expected = [((constants.MAX_WORD_LENGTH - 1) * "a", 0, True)]
         self.assertEqual(result, expected)
         cPalabra.postprocess()
+        remove_wordlist(LOC)
 
     def testCompoundMaxList(self):
         """
@@ -334,6 +341,17 @@ class WordTestCase(unittest.TestCase):
         self.assertEqual(clist.find_by_pattern("w(!@@#$%??"), [("woo", 0)])
         cPalabra.postprocess()
 
+    def testFindPatternIndexReplaced(self):
+        """A word list whose index has been loaded again uses its own words."""
+        c1 = CWordList(["koala", "kiwi"], index=0)
+        self.assertEqual(c1.find_by_pattern("k*"), [("kiwi", 0), ("koala", 0)])
+        c2 = CWordList(["kanga"], index=0)
+        self.assertEqual(sorted(c1.find_by_pattern("k*")), [("kiwi", 0), ("koala", 0)])
+        self.assertEqual(c1.count_words(), 2)
+        self.assertEqual(c2.find_by_pattern("k*"), [("kanga", 0)])
+        self.assertEqual(c2.count_words(), 1)
+        cPalabra.postprocess()
+
     def testSearchWordlistsByPattern(self):
         """Multiple word lists can be searched by pattern."""
         c1 = CWordList(["koala", "kangaroo", "wombat"], name="Australia")
@@ -366,6 +384,49 @@ class WordTestCase(unittest.TestCase):
         self.assertEqual(result, expected)
         cPalabra.postprocess()
 
+    def testWordPattern(self):
+        """A pattern is compiled into lengths and letters at fixed positions."""
+        p = word.WordPattern("W?r**s")
+        self.assertEqual(p.pattern, "w?r*s")
+        self.assertEqual(p.min_length, 4)
+        self.assertEqual(p.max_length, None)
+        self.assertEqual(p.constraints(6), "w.r..s")
+        self.assertEqual(p.regex, None)
+        self.assertTrue(p.match("worms"))
+        self.assertFalse(p.match("word"))
+        p = word.WordPattern("a*b*c")
+        self.assertTrue(p.regex is not None)
+        self.assertEqual(list(p.lengths())[0], 3)
+        self.assertTrue(p.match("axxbyc"))
+        self.assertFalse(p.match("axxyyc"))
+        self.assertEqual(list(word.WordPattern("??").lengths()), [2])
+
+    def testWordPatternNarrows(self):
+        """A pattern narrows another pattern if it matches fewer words."""
+        cases = [("w*d", "w*", True)
+            , ("wo*", "w*", True)
+            , ("w?", "w*", True)
+            , ("w*", "w*", True)
+            , ("w", "w*", True)
+            , ("w*", "wo*", False)
+            , ("wo", "w", False)
+            , ("?o*", "w*", False)
+            , ("w*x", "*?", True)
+        ]
+        for p1, p2, expected in cases:
+            self.assertEqual(word.WordPattern(p1).narrows(word.WordPattern(p2)), expected)
+
+    def testSearchByPatternPrevious(self):
+        """Searching by pattern can narrow down the result of a previous pattern."""
+        c1 = CWordList(["koala", "kangaroo", "wombat", "kiwi"], name="Words")
+        c2 = CWordList(["keel", "kite"], name="More", index=1)
+        first = word.search_wordlists_by_pattern([c1, c2], "k*", sort=0)
+        self.assertEqual(len(first), 5)
+        for pattern in ["k?*", "k*e*", "ki*", "k???"]:
+            result = word.search_wordlists_by_pattern([c1, c2], pattern, sort=0, previous=("k*", first))
+            self.assertEqual(result, word.search_wordlists_by_pattern([c1, c2], pattern, sort=0))
+        cPalabra.postprocess()
+
     def testCreateWordLists(self):
         w1 = {'path': {'value': '/the/path'}, 'name': {'value': 'the name'}}
         w2 = {'path': {'value': '/somewhere/else'}, 'name': {'value': 'the name 2'}}
@@ -452,8 +513,9 @@ class WordTestCase(unittest.TestCase):
         self.assertTrue(("fish", 0, True) in result)
         self.assertTrue(("bear", 0, True) in result)
         self.assertTrue(("lion", 0, True) in result)
-        os.remove(PATH1)
-        os.remove(PATH2)
+        cPalabra.postprocess()
+        remove_wordlist(PATH1)
+        remove_wordlist(PATH2)
 
     def testSearchWordlists(self):
         w1 = CWordList(["worda"], index=0)
@@ -576,6 +638,15 @@ class WordTestCase(unittest.TestCase):
         self.assertEqual(result, [(0, 2), (3, 2)])
         cPalabra.postprocess()
 
+    def testAccidentalOverlapping(self):
+        clist = CWordList(["a", "an", "and", "nd", "dan"])
+        other = CWordList(["an", "ran"], index=1)
+        seq = [(i, 0, c) for i, c in enumerate("RANDAN")]
+        result = word.check_accidental_word([clist, other], seq)
+        self.assertEqual(result, [(0, 3), (1, 1), (1, 2), (1, 3), (2, 2)
+            , (3, 3), (4, 1), (4, 2)])
+        cPalabra.postprocess()
+
     def testAccidentalGrid(self):
         clist = CWordList(["no"])
         # N _ _ _ N
@@ -660,6 +731,7 @@ class WordTestCase(unittest.TestCase):
         for l, words in clist.words.items():
             self.assertEqual(words, [])
         cPalabra.postprocess()
+        remove_wordlist(LOC)
 
     def testAccidentalGridTwo(self):
         clist = CWordList(["no"])
@@ -16,6 +16,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import threading
+import time
 import unittest
 
 import palabralib.cPalabra as cPalabra
@@ -142,6 +144,36 @@ class WordTestCase2(unittest.TestCase):
         self.assertTrue((0, 0, "across", "abcd", 1) in entries["BCD"])
         self.assertTrue((0, 1, "across", "bcde", 0) in entries["BCD"])
 
+    def testSimilarWordsIncremental(self):
+        """The similar words index only changes for entries that have changed."""
+        g = Grid(5, 2)
+        test_insert(g, "ABCDE\nBCD..")
+        index = word.SimilarWords()
+        index.update(g)
+        self.assertEqual(index.result(), word.similar_words(g))
+        g.set_char(1, 1, 'X')
+        index.update(g)
+        self.assertEqual(index.result(), word.similar_words(g))
+        self.assertTrue("BXD" in index.result())
+        self.assertTrue("BCD" in index.result())
+        self.assertTrue("BCD" not in index.result(shared=True))
+        g.set_block(4, 0, True)
+        index.update(g)
+        self.assertEqual(index.result(), word.similar_words(g))
+        self.assertTrue("CDE" not in index.result())
+
+    def testSimilarWordsShared(self):
+        """Shared substrings are found in more than one entry."""
+        g = Grid(5, 2)
+        test_insert(g, "ABCDE\nXBCDY")
+        result = word.SimilarWords().result(shared=True)
+        self.assertEqual(result, {})
+        index = word.SimilarWords()
+        index.update(g)
+        result = index.result(shared=True)
+        self.assertEqual(result.keys(), ["BCD"])
+        self.assertEqual(result["BCD"], [(0, 0, "across", "ABCDE"), (0, 1, "across", "XBCDY")])
+
     def testSearchMultipleListsIntersection(self):
         """Intersection boolean in search result can be due to other word list."""
         w1 = CWordList(["worda"], index=0)
@@ -306,6 +338,19 @@ class WordTestCase2(unittest.TestCase):
         self.assertEqual(result, [("foobar", 30, True)] * 3)
         cPalabra.postprocess()
 
+    def testSearchInsertionOrder(self):
+        """Search results do not depend on the order of the words in the list."""
+        words = [("bbb", 1), ("aaa", 2), ("ccc", 3), ("aaa", 4), ("abc", 5)]
+        w1 = CWordList(words, index=0)
+        w2 = CWordList(list(reversed(words)), index=1)
+        expected = [("aaa", 2, True), ("aaa", 4, True), ("abc", 5, True)
+            , ("bbb", 1, True), ("ccc", 3, True)]
+        self.assertEqual(search_wordlists([w1], 3, "..."), expected)
+        result = search_wordlists([w2], 3, "...")
+        self.assertEqual(sorted(result), expected)
+        self.assertEqual(result[0], ("aaa", 4, True))
+        cPalabra.postprocess()
+
     def testNegativeWordScores(self):
         """Words can have negative scores."""
         w1 = CWordList([("word", -1), ("foobar", -100)])
@@ -430,6 +475,16 @@ class WordTestCase2(unittest.TestCase):
         self.assertTrue(("score", 40, True) in result)
         cPalabra.postprocess()
 
+    def testUpdateScoreAfterRemove(self):
+        """The word list and its index update the same occurrence of a word."""
+        w1 = CWordList([("abc", 1), ("abc", 3), ("xyz", 0), ("abc", 5)])
+        w1.remove_words([("abc", 1)])
+        w1.update_score("abc", 9)
+        expected = sorted(s for w, s in w1.words[3] if w == "abc")
+        result = sorted(s for w, s, valid in search_wordlists([w1], 3, "abc"))
+        self.assertEqual(result, expected)
+        cPalabra.postprocess()
+
     def testWriteWordLists(self):
         """Word lists can be written to file."""
         LOC = "palabralib/tests/test_wordlist.txt"
@@ -494,6 +549,70 @@ class WordTestCase2(unittest.TestCase):
         self.assertEqual(w3.average_word_score(), 5.5)
         cPalabra.postprocess()
 
+    def testWordStatisticsCompiledIndex(self):
+        """The statistics of a word list loaded from its compiled index are counted from the index."""
+        LOC = "palabralib/tests/test_wordlist.txt"
+        with open(LOC, 'w') as f:
+            f.write("koala,10\nkiwis,20\nsteam,10\nwombat,5\n")
+        CWordList(LOC, index=0)
+        w1 = CWordList(LOC, index=0)
+        self.assertEqual(w1.count_words(), 4)
+        self.assertEqual(w1.get_word_counts()[5], 3)
+        self.assertEqual(w1.get_score_counts(), {5: 1, 10: 2, 20: 1})
+        self.assertEqual(w1.average_word_length(), 5.25)
+        self.assertEqual(w1.average_word_score(), 11.25)
+        self.assertEqual(w1._words, None)
+        w1.add_word("palabra", 10)
+        w1.remove_words([("kiwis", 20)])
+        self.assertEqual(w1.get_score_counts(), {5: 1, 10: 3})
+        self.assertEqual(w1.get_word_counts()[7], 1)
+        cPalabra.postprocess()
+        os.remove(LOC)
+        if os.path.exists(word.get_index_path(LOC)):
+            os.remove(word.get_index_path(LOC))
+
+    def testComputeLetterCounts(self):
+        """The letters at each position of the words are counted per length."""
+        words = {2: [("ab", 0), ("ac", 0), ("bc", 0)], 3: [("abc", 0)]}
+        counts = cPalabra.compute_counts(words)
+        self.assertEqual(len(counts), constants.MAX_WORD_LENGTH)
+        self.assertEqual(counts[2][0], {"a": 2, "b": 1})
+        self.assertEqual(counts[2][1], {"b": 1, "c": 2})
+        self.assertEqual(counts[3][2], {"c": 1})
+        self.assertEqual(counts[4][0], {})
+
+    def testLetterRanks(self):
+        """The characters at each position are ranked from most to least frequent."""
+        words = {2: [("ab", 0), ("cb", 0), ("cd", 0), ("ed", 0)], 3: []}
+        ranks = word.compute_letter_ranks(words)
+        self.assertEqual(len(ranks[2]), 2 * 256)
+        self.assertEqual(ranks[2][ord("c")], 0)
+        self.assertEqual(ranks[2][ord("a")], 1)
+        self.assertEqual(ranks[2][ord("e")], 2)
+        self.assertEqual(ranks[2][ord("z")], 3)
+        self.assertEqual(ranks[2][256 + ord("b")], 0)
+        self.assertEqual(ranks[2][256 + ord("d")], 1)
+        self.assertEqual(ranks[2][256 + ord("a")], 2)
+        self.assertEqual(len(ranks[3]), 3 * 256)
+        cs = {(0, 0, "across"): [(0, 2, ""), (1, 2, "")]}
+        result = cPalabra.sort_by_distance([("zz", 0), ("ed", 0), ("cb", 0), ("ab", 0)]
+            , cs, ranks, (0, 0, "across"))
+        self.assertEqual(result, ["cb", "ab", "ed", "zz"])
+
+    def testLetterRanksCached(self):
+        """The letter ranks of a word list are computed again when words change."""
+        w1 = CWordList([("ab", 1), ("cb", 2)])
+        ranks = w1.get_letter_ranks()
+        self.assertTrue(w1.get_letter_ranks() is ranks)
+        w1.update_score("ab", 5)
+        self.assertTrue(w1.get_letter_ranks() is ranks)
+        w1.add_word("cd", 3)
+        self.assertEqual(w1.get_letter_ranks()[2][ord("c")], 0)
+        w1.remove_words([("cb", 2), ("cd", 3)])
+        self.assertEqual(w1.get_letter_ranks()[2][ord("c")], 1)
+        self.assertEqual(w1.get_letter_ranks()[2][ord("a")], 0)
+        cPalabra.postprocess()
+
     def testWriteToFile(self):
         """An individual word list can be written to and read from a file."""
         LOC = "palabralib/tests/test_wordlist.txt"
@@ -559,3 +678,478 @@ class WordTestCase2(unittest.TestCase):
         for w, score in words:
             self.assertTrue((w, score - 4 + 40) in w1.words[len(w)])
         cPalabra.postprocess()
+
+    def testCompiledIndex(self):
+        """A word list file is loaded from its compiled index the second time."""
+        LOC = "palabralib/tests/test_wordlist.txt"
+        with open(LOC, 'w') as f:
+            f.write("koala,10\nwombat,20\nkiwi\nkangaroo,5\nkoel,30")
+        w1 = CWordList(LOC, index=0)
+        self.assertTrue(os.path.exists(word.get_index_path(LOC)))
+        w2 = CWordList(LOC, index=1)
+        self.assertTrue(w2._words is None)
+        for l, cs in [(4, "k..."), (5, "....."), (6, ".o...t"), (8, "........")]:
+            self.assertEqual(search_wordlists([w2], l, cs), search_wordlists([w1], l, cs))
+        self.assertEqual(search_wordlists([w2], 4, "k..."), [("kiwi", 0, True), ("koel", 30, True)])
+        self.assertEqual(w2.words[4], [("kiwi", 0), ("koel", 30)])
+        self.assertEqual(w2.count_words(), 5)
+        cPalabra.postprocess()
+        for path in [LOC, word.get_index_path(LOC)]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def testCompiledIndexOutdated(self):
+        """A compiled index is not used when the word list file has changed."""
+        LOC = "palabralib/tests/test_wordlist.txt"
+        with open(LOC, 'w') as f:
+            f.write("koala")
+        CWordList(LOC, index=0)
+        with open(LOC, 'w') as f:
+            f.write("koala\nkoels")
+        w2 = CWordList(LOC, index=1)
+        self.assertTrue(w2._words is not None)
+        self.assertEqual(len(search_wordlists([w2], 5, ".....")), 2)
+        w3 = CWordList(LOC, index=2, score=10)
+        self.assertTrue(w3._words is not None)
+        self.assertEqual(search_wordlists([w3], 5, "koala"), [("koala", 10, True)])
+        cPalabra.postprocess()
+        for path in [LOC, word.get_index_path(LOC)]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def testCompiledIndexModify(self):
+        """A word list loaded from a compiled index can be modified."""
+        LOC = "palabralib/tests/test_wordlist.txt"
+        with open(LOC, 'w') as f:
+            f.write("koala,10\nkoels,20")
+        CWordList(LOC, index=0)
+        w2 = CWordList(LOC, index=1)
+        w2.update_score("koels", 40)
+        self.assertEqual(search_wordlists([w2], 5, "koels"), [("koels", 40, True)])
+        w2.add_word("kanga", 5)
+        result = search_wordlists([w2], 5, "k....")
+        self.assertEqual(result, [("kanga", 5, True), ("koala", 10, True), ("koels", 40, True)])
+        cPalabra.postprocess()
+        for path in [LOC, word.get_index_path(LOC)]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def testSearchBitsetEngine(self):
+        """The bitset engine gives the same results as the tree engine."""
+        words = [("steam", 5), ("ttttt", 0), ("aaaaa", 10), ("sssss", 0)
+            , ("eeeee", 20), ("mmmmm", 0), ("stems", 3), ("steam", 7)]
+        w1 = CWordList(words, index=0)
+        css = [(0, 5, [(0, 's')])
+            , (0, 5, [(0, 't')])
+            , (0, 5, [(0, 'e')])
+            , (0, 5, [(0, 'a')])
+            , (0, 5, [(0, 'm')])
+        ]
+        tree = {constants.SEARCH_OPTION_ENGINE: constants.SEARCH_ENGINE_TREE}
+        bitset = {constants.SEARCH_OPTION_ENGINE: constants.SEARCH_ENGINE_BITSET}
+        for cs, more in [(".....", None), ("st...", None), ("ste..", css)]:
+            for min_score in [-9999, 0, 5]:
+                tree[constants.SEARCH_OPTION_MIN_SCORE] = min_score
+                bitset[constants.SEARCH_OPTION_MIN_SCORE] = min_score
+                r_tree = search_wordlists([w1], 5, cs, more, options=tree)
+                r_bitset = search_wordlists([w1], 5, cs, more, options=bitset)
+                self.assertEqual(r_tree, r_bitset)
+        del bitset[constants.SEARCH_OPTION_MIN_SCORE]
+        result = search_wordlists([w1], 5, "ste..", css, options=bitset)
+        self.assertTrue(("steam", 5, True) in result)
+        self.assertTrue(("stems", 3, False) in result)
+        cPalabra.postprocess()
+
+    def testSearchBitsetEngineAfterChanges(self):
+        """The bitset engine sees words and scores that have been changed."""
+        bitset = {constants.SEARCH_OPTION_ENGINE: constants.SEARCH_ENGINE_BITSET}
+        w1 = CWordList([("koala", 10)], index=0)
+        self.assertEqual(search_wordlists([w1], 5, "k....", options=bitset), [("koala", 10, True)])
+        w1.update_score("koala", 40)
+        w1.add_word("kanga", 5)
+        result = search_wordlists([w1], 5, "k....", options=bitset)
+        self.assertEqual(result, [("kanga", 5, True), ("koala", 40, True)])
+        self.assertEqual(search_wordlists([w1], 5, "x....", options=bitset), [])
+        cPalabra.postprocess()
+
+    def testSearchMergedLists(self):
+        """Searching several lists gives the results of each list sorted by word."""
+        w1 = CWordList([("koala", 10), ("kanga", 5), ("koala", 20)], index=0)
+        w2 = CWordList([("koala", 1), ("wombat", 3), ("kiwis", 7)], index=1)
+        w3 = CWordList([("kanga", 2), ("kiwis", 0)], index=2)
+        for options in [None, {constants.SEARCH_OPTION_MIN_SCORE: 5}
+            , {constants.SEARCH_OPTION_ENGINE: constants.SEARCH_ENGINE_BITSET}]:
+            for wordlists in [[w1, w2, w3], [w3, w1], [w2, w1]]:
+                for cs in [".....", "k....", "..w..", "x...."]:
+                    expected = []
+                    for wlist in wordlists:
+                        expected.extend(search_wordlists([wlist], 5, cs, options=options))
+                    expected.sort(key=lambda item: item[0])
+                    result = search_wordlists(wordlists, 5, cs, options=options)
+                    self.assertEqual(result, expected)
+        cPalabra.postprocess()
+
+    def testSearchMergedListsChanged(self):
+        """Searching several lists takes changes to these lists into account."""
+        w1 = CWordList([("koala", 10)], index=0)
+        w2 = CWordList([("kanga", 5)], index=1)
+        self.assertEqual(search_wordlists([w1, w2], 5, "k....")
+            , [("kanga", 5, True), ("koala", 10, True)])
+        w1.add_word("kiwis", 3)
+        w2.update_score("kanga", 40)
+        self.assertEqual(search_wordlists([w1, w2], 5, "k....")
+            , [("kanga", 40, True), ("kiwis", 3, True), ("koala", 10, True)])
+        w1 = CWordList([("kudus", 1)], index=0)
+        self.assertEqual(search_wordlists([w1, w2], 5, "k....")
+            , [("kanga", 40, True), ("kudus", 1, True)])
+        cPalabra.unmerge(w1.index)
+        self.assertEqual(search_wordlists([w1, w2], 5, "k....")
+            , [("kanga", 40, True), ("kudus", 1, True)])
+        cPalabra.postprocess()
+
+    def testSearchOrderByScore(self):
+        """Words can be searched by decreasing score."""
+        options = {constants.SEARCH_OPTION_ORDER_BY_SCORE: True}
+        w1 = CWordList([("koala", 10), ("kanga", 5), ("kiwis", 10), ("emu", 50)], index=0)
+        w2 = CWordList([("koala", 20), ("kudus", 5)], index=1)
+        result = search_wordlists([w1], 5, "k....", options=options)
+        self.assertEqual(result, [("kiwis", 10, True), ("koala", 10, True), ("kanga", 5, True)])
+        result = search_wordlists([w1, w2], 5, "k....", options=options)
+        expected = sorted(search_wordlists([w1, w2], 5, "k...."), key=lambda r: r[1], reverse=True)
+        self.assertEqual(result, expected)
+        cPalabra.postprocess()
+
+    def testSearchLimit(self):
+        """The number of words can be limited and the total number is given."""
+        w1 = CWordList([("koala", 10), ("kanga", 5), ("kiwis", 10), ("emu", 50)], index=0)
+        w2 = CWordList([("koala", 20), ("kudus", 5)], index=1)
+        options = {constants.SEARCH_OPTION_LIMIT: 2}
+        result, total = search_wordlists([w1], 5, "k....", options=options)
+        self.assertEqual(result, [("kanga", 5, True), ("kiwis", 10, True)])
+        self.assertEqual(total, 3)
+        result, total = search_wordlists([w1, w2], 5, "k....", options=options)
+        self.assertEqual(result, [("kanga", 5, True), ("kiwis", 10, True)])
+        self.assertEqual(total, 5)
+        options[constants.SEARCH_OPTION_ORDER_BY_SCORE] = True
+        result, total = search_wordlists([w1, w2], 5, "k....", options=options)
+        self.assertEqual(result, [("koala", 20, True), ("kiwis", 10, True)])
+        self.assertEqual(total, 5)
+        options[constants.SEARCH_OPTION_MIN_SCORE] = 10
+        result, total = search_wordlists([w1, w2], 5, ".....", options=options)
+        self.assertEqual(total, 3)
+        options[constants.SEARCH_OPTION_LIMIT] = 0
+        self.assertEqual(search_wordlists([w1], 5, "x....", options=options), ([], 0))
+        cPalabra.postprocess()
+
+    def testSearchLimitIntersection(self):
+        """Words that are found with a limit include the intersection boolean."""
+        w1 = CWordList(["steam", "stems", "ttttt", "aaaaa", "sssss", "eeeee", "mmmmm"])
+        css = [(0, 5, [(0, 's')])
+            , (0, 5, [(0, 't')])
+            , (0, 5, [(0, 'e')])
+            , (0, 5, [(0, 'a')])
+            , (0, 5, [(0, 'm')])
+        ]
+        options = {constants.SEARCH_OPTION_LIMIT: 5}
+        result, total = search_wordlists([w1], 5, "ste..", css, options=options)
+        self.assertEqual(result, search_wordlists([w1], 5, "ste..", css))
+        self.assertEqual(total, 2)
+        cPalabra.postprocess()
+
+    def testSearchCursor(self):
+        """A search can return a cursor that gives the words on access."""
+        options = {constants.SEARCH_OPTION_CURSOR: True}
+        w1 = CWordList([("koala", 10), ("kanga", 5), ("kiwis", 10)], index=0)
+        w2 = CWordList([("koala", 20), ("kudus", 5)], index=1)
+        expected = search_wordlists([w1, w2], 5, "k....")
+        cursor = search_wordlists([w1, w2], 5, "k....", options=options)
+        self.assertEqual(len(cursor), len(expected))
+        self.assertEqual(cursor[0], expected[0])
+        self.assertEqual(cursor[-1], expected[-1])
+        self.assertEqual(cursor[1:3], expected[1:3])
+        self.assertEqual(cursor[3:100], expected[3:100])
+        self.assertEqual(list(cursor), expected)
+        self.assertRaises(IndexError, lambda: cursor[len(expected)])
+        self.assertEqual(len(search_wordlists([w1], 5, "x....", options=options)), 0)
+        cPalabra.postprocess()
+
+    def testVisibleEntriesCursor(self):
+        """The visible words of a cursor are selected and sorted like those of a list."""
+        w1 = CWordList(["steam", "stems", "ttttt", "aaaaa", "sssss", "eeeee", "mmmmm", ("stead", 3)])
+        css = [(0, 5, [(0, 's')])
+            , (0, 5, [(0, 't')])
+            , (0, 5, [(0, 'e')])
+            , (0, 5, [(0, 'a')])
+            , (0, 5, [(0, 'm')])
+        ]
+        options = {constants.SEARCH_OPTION_CURSOR: True}
+        words = search_wordlists([w1], 5, "ste..", css)
+        cursor = search_wordlists([w1], 5, "ste..", css, options=options)
+        grid = Grid(5, 5)
+        for x, c in enumerate("STEMS"):
+            grid.set_char(x, 0, c)
+        for show_used in [True, False]:
+            for show_intersect in [True, False]:
+                for show_order in [0, 1]:
+                    expected = word.visible_entries(words, grid, show_used, show_intersect, show_order)
+                    result = word.visible_entries(cursor, grid, show_used, show_intersect, show_order)
+                    self.assertEqual(list(result), expected)
+        cPalabra.postprocess()
+
+    def testSearchIntersectionAfterChanges(self):
+        """The analysis of intersecting slots takes changes to the word list into account."""
+        w1 = CWordList(["steam", "sssss", "ttttt", "eeeee", "aaaaa"], index=0)
+        w2 = CWordList(["koala"], index=1)
+        css = [(0, 5, [(0, 's')])
+            , (0, 5, [(0, 't')])
+            , (0, 5, [(0, 'e')])
+            , (0, 5, [(0, 'a')])
+            , (0, 5, [(0, 'm')])
+        ]
+        options = {constants.SEARCH_OPTION_MIN_SCORE: 0}
+        for wordlists in [[w1], [w1, w2]]:
+            self.assertEqual(search_wordlists(wordlists, 5, "steam", css, options=options)
+                , [("steam", 0, False)])
+            w1.add_word("mmmmm", 0)
+            self.assertEqual(search_wordlists(wordlists, 5, "steam", css, options=options)
+                , [("steam", 0, True)])
+            w1.update_score("mmmmm", -10)
+            self.assertEqual(search_wordlists(wordlists, 5, "steam", css, options=options)
+                , [("steam", 0, False)])
+            w1.update_score("mmmmm", 10)
+            self.assertEqual(search_wordlists(wordlists, 5, "steam", css, options=options)
+                , [("steam", 0, True)])
+            w1.remove_words([("mmmmm", 10)])
+            self.assertEqual(search_wordlists(wordlists, 5, "steam", css, options=options)
+                , [("steam", 0, False)])
+        cPalabra.postprocess()
+
+    def testSearchSuperseded(self):
+        """A search of an older generation gives no words."""
+        w1 = CWordList(["koala", "kiwis", "steam"], index=0)
+        options = {constants.SEARCH_OPTION_CURSOR: True
+            , constants.SEARCH_OPTION_GENERATION: 3}
+        cPalabra.set_search_generation(4)
+        self.assertEqual(search_wordlists([w1], 5, "k....", options=options), None)
+        cPalabra.set_search_generation(3)
+        self.assertEqual(list(search_wordlists([w1], 5, "k....", options=options))
+            , [("kiwis", 0, True), ("koala", 0, True)])
+        del options[constants.SEARCH_OPTION_GENERATION]
+        cPalabra.set_search_generation(4)
+        self.assertEqual(len(search_wordlists([w1], 5, "k....", options=options)), 2)
+        cPalabra.postprocess()
+
+    def testSearchWorkerAfterError(self):
+        """A search that raises does not stop the searches after it."""
+        w1 = CWordList(["koala", "kiwis", "steam"], index=0)
+        found = []
+        delivered = threading.Event()
+        def callback(words):
+            found.extend(words)
+            delivered.set()
+        class MainLoop(object):
+            def idle_add(self, f, *args):
+                f(*args)
+        glib = word.glib
+        word.glib = MainLoop()
+        try:
+            worker = word.SearchWorker(callback)
+            worker.search([None], 5, "k....")
+            while worker.request is not None:
+                time.sleep(0.01)
+            worker.search([w1], 5, "k....")
+            delivered.wait(5)
+            self.assertEqual(found, [("kiwis", 0, True), ("koala", 0, True)])
+        finally:
+            word.glib = glib
+            cPalabra.set_search_generation(0)
+        cPalabra.postprocess()
+
+    def testSearchInThread(self):
+        """A search in another thread gives the same words."""
+        w1 = CWordList(["steam", "stems", "ttttt", "aaaaa", "sssss", "eeeee", "mmmmm"], index=0)
+        css = [(0, 5, [(0, 's')])
+            , (0, 5, [(0, 't')])
+            , (0, 5, [(0, 'e')])
+            , (0, 5, [(0, 'a')])
+            , (0, 5, [(0, 'm')])
+        ]
+        options = {constants.SEARCH_OPTION_CURSOR: True}
+        expected = search_wordlists([w1], 5, "ste..", css)
+        results = []
+        def run():
+            results.append(list(search_wordlists([w1], 5, "ste..", css, options=options)))
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        self.assertEqual(results, [expected])
+        cPalabra.postprocess()
+
+    def testRemoveWordsIncremental(self):
+        """Removed words are no longer found, the other words remain."""
+        w1 = CWordList([("koala", 10), ("kiwis", 20), ("koala", 30), ("steam", 5)], index=0)
+        self.assertEqual(search_wordlists([w1], 5, "k...."), [("kiwis", 20, True), ("koala", 10, True), ("koala", 30, True)])
+        w1.remove_words([("koala", 30), ("kiwis", 20)])
+        self.assertEqual(search_wordlists([w1], 5, "k...."), [("koala", 10, True)])
+        self.assertEqual(sorted(w1.words[5]), [("koala", 10), ("steam", 5)])
+        w1.update_score("steam", 15)
+        w1.add_word("kiwis", 3)
+        w1.remove_words([("koala", 10), ("koala", 10)])
+        self.assertEqual(search_wordlists([w1], 5, "....."), [("kiwis", 3, True), ("steam", 15, True)])
+        self.assertEqual(sorted(w1.words[5]), [("kiwis", 3), ("steam", 15)])
+        w1.remove_words([("kiwis", 3), ("steam", 15)])
+        self.assertEqual(search_wordlists([w1], 5, "....."), [])
+        self.assertEqual(w1.count_words(), 0)
+        cPalabra.postprocess()
+
+    def testRemoveWordsCompiledIndex(self):
+        """Words can be removed from a word list loaded from its compiled index."""
+        LOC = "palabralib/tests/test_wordlist.txt"
+        with open(LOC, 'w') as f:
+            f.write("koala,10\nkiwis,20\nsteam,5\n")
+        CWordList(LOC, index=0)
+        w1 = CWordList(LOC, index=0)
+        w1.remove_words([("kiwis", 20)])
+        self.assertEqual(search_wordlists([w1], 5, "....."), [("koala", 10, True), ("steam", 5, True)])
+        cPalabra.postprocess()
+        os.remove(LOC)
+        if os.path.exists(word.get_index_path(LOC)):
+            os.remove(word.get_index_path(LOC))
+
+    def testChangeScoresMapping(self):
+        """The scores of words can be changed with a dict of words and scores."""
+        w1 = CWordList([("koala", 10), ("kiwis", 20), ("koala", 30), ("wombat", 5)], index=0)
+        w1.change_scores("map", {"koala": 1, "wombat": 2, "steam": 3})
+        self.assertEqual(sorted(w1.words[5]), [("kiwis", 20), ("koala", 1), ("koala", 1)])
+        self.assertEqual(w1.words[6], [("wombat", 2)])
+        self.assertEqual(search_wordlists([w1], 5, "....."), [("kiwis", 20, True), ("koala", 1, True), ("koala", 1, True)])
+        self.assertEqual(search_wordlists([w1], 6, "......"), [("wombat", 2, True)])
+        cPalabra.postprocess()
+
+    def testChangeScoresCompiledIndex(self):
+        """The scores of a word list loaded from its compiled index can be changed."""
+        LOC = "palabralib/tests/test_wordlist.txt"
+        with open(LOC, 'w') as f:
+            f.write("koala,10\nkiwis,20\nwombat,5\n")
+        CWordList(LOC, index=0)
+        w1 = CWordList(LOC, index=0)
+        w1.change_scores("by", 5)
+        self.assertEqual(search_wordlists([w1], 5, "....."), [("kiwis", 25, True), ("koala", 15, True)])
+        w1.change_scores("map", {"kiwis": 1})
+        self.assertEqual(sorted(w1.words[5]), [("kiwis", 1), ("koala", 15)])
+        self.assertEqual(w1.words[6], [("wombat", 10)])
+        cPalabra.postprocess()
+        os.remove(LOC)
+        if os.path.exists(word.get_index_path(LOC)):
+            os.remove(word.get_index_path(LOC))
+
+    def testFindAnagrams(self):
+        """The words with the same letters as a word can be found."""
+        w1 = CWordList([("listen", 3), ("silent", 5), ("enlist", 1), ("tinsel", 0), ("lister", 2), ("steam", 1)], index=0)
+        w2 = CWordList([("inlets", 7), ("mates", 2)], index=1)
+        result = word.find_anagrams([w1, w2], "listen")
+        self.assertEqual(sorted(result), [("enlist", 1), ("inlets", 7), ("listen", 3), ("silent", 5), ("tinsel", 0)])
+        self.assertEqual(word.find_anagrams([w1, w2], "meats"), [("steam", 1), ("mates", 2)])
+        self.assertEqual(word.find_anagrams([w1, w2], "kiwis"), [])
+        self.assertEqual(word.find_anagrams([w1, w2], ",isten"), [])
+        self.assertEqual(word.find_anagrams([w1, w2], "LISTEN"), word.find_anagrams([w1, w2], "listen"))
+        w1.remove_words([("silent", 5)])
+        self.assertEqual(len(word.find_anagrams([w1], "listen")), 3)
+        cPalabra.postprocess()
+
+    def testGetContainedWords(self):
+        """The words that contain the letters of a word can be found, up to a limit."""
+        w1 = CWordList(["steam", "mates", "stem", "teams", "seam", "master", "tame"], index=0)
+        wordlists = {"a": w1}
+        counts, result = word.get_contained_words(wordlists, "tem")
+        self.assertEqual(sorted(result), ["master", "mates", "steam", "stem", "tame", "teams"])
+        counts, result = word.get_contained_words(wordlists, "tem", limit=3)
+        self.assertEqual(len(result), 3)
+        counts, result = word.get_contained_words(wordlists, "ssm")
+        self.assertEqual(result, [])
+        counts, result = word.get_contained_words(wordlists, "3")
+        self.assertEqual(result, [])
+        counts, result = word.get_contained_words(wordlists, "t-")
+        self.assertEqual(result, [])
+        cPalabra.postprocess()
+
+    def testVerifyContainedWords(self):
+        """Pairs are verified against the words with the same letters, in any number of threads."""
+        w1 = CWordList(["seam", "same", "mesa", "stem", "koala"], index=0)
+        pairs = [("x", "ames"), ("y", "mets"), ("z", "kiwi"), ("w", "")] * 50
+        expected = [("x", "mesa"), ("x", "same"), ("x", "seam"), ("y", "stem")] * 50
+        for n_threads in [1, 2, 7, 500]:
+            result = word.verify_contained_words({"a": w1}, pairs, n_threads)
+            self.assertEqual(sorted(result), sorted(expected))
+        self.assertEqual(word.verify_contained_words({"a": w1}, []), [])
+        items = word.iter_verified_words({"a": w1}, pairs)
+        self.assertEqual(items.next(), ("x", "mesa"))
+        cPalabra.postprocess()
+
+    def testLoadWordListFile(self):
+        """A word list file is read with the same rules as a list of words."""
+        LOC = "palabralib/tests/test_wordlist.txt"
+        with open(LOC, 'w') as f:
+            f.write("koala,10\nkiwis, 20\r\nKiwis,20\nkoala,10\nwom bat\na,b,c\nfoo1,5\nbar,x\nzebra")
+        fractions = []
+        w1 = CWordList(LOC, index=0, score=7, progress=fractions.append)
+        self.assertEqual(w1.words[5], [("kiwis", 20), ("koala", 10), ("zebra", 7)])
+        self.assertEqual(w1.words[6], [("wombat", 7)])
+        self.assertEqual(w1.count_words(), 4)
+        self.assertEqual(fractions[-1], 1.0)
+        self.assertEqual(search_wordlists([w1], 5, "k...."), [("kiwis", 20, True), ("koala", 10, True)])
+        os.remove(word.get_index_path(LOC))
+        def cancel(fraction):
+            raise ValueError
+        self.assertRaises(ValueError, CWordList, LOC, index=1, progress=cancel)
+        os.remove(LOC)
+        w2 = CWordList(LOC, index=1)
+        self.assertEqual(w2.count_words(), 0)
+        cPalabra.postprocess()
+        if os.path.exists(word.get_index_path(LOC)):
+            os.remove(word.get_index_path(LOC))
+
+    def testLoadWordListFileKeepsIndex(self):
+        """A word list file that fails to load leaves the words of the index."""
+        LOC = "palabralib/tests/test_wordlist.txt"
+        with open(LOC, 'w') as f:
+            f.write("koala\nkiwis\n")
+        cPalabra.load_wordlist(LOC, 0, 0)
+        generation = cPalabra.index_generation(0)
+        with open(LOC, 'w') as f:
+            f.write("wombat\n")
+        # progress may use the index while the file is read
+        counts = []
+        def progress(fraction):
+            counts.append(cPalabra.word_counts(0)[5])
+            raise ValueError
+        self.assertRaises(ValueError, cPalabra.load_wordlist, LOC, 0, 0, 1, progress)
+        self.assertEqual(counts, [2])
+        self.assertEqual(cPalabra.index_generation(0), generation)
+        self.assertEqual(cPalabra.word_counts(0)[5], 2)
+        self.assertEqual(cPalabra.word_counts(0)[6], 0)
+        result = cPalabra.load_wordlist(LOC, 0, 0, 1, lambda fraction: cPalabra.word_counts(0))
+        self.assertEqual(result[6], [("wombat", 0)])
+        self.assertNotEqual(cPalabra.index_generation(0), generation)
+        self.assertEqual(cPalabra.word_counts(0)[5], 0)
+        self.assertEqual(cPalabra.word_counts(0)[6], 1)
+        cPalabra.postprocess()
+        os.remove(LOC)
+
+    def testCreateWordListsProgress(self):
+        """The progress of loading word list files is reported over all files."""
+        PATHS = ["palabralib/tests/test_wordlist1.txt", "palabralib/tests/test_wordlist2.txt"]
+        for path in PATHS:
+            with open(path, 'w') as f:
+                f.write("fish\nwhale\n")
+        prefs = [{"path": {"value": p}, "name": {"value": p}} for p in PATHS]
+        fractions = []
+        result = create_wordlists(prefs, progress=fractions.append)
+        self.assertEqual([sorted(w.words[4]) for w in result], [[("fish", 0)]] * 2)
+        self.assertEqual(fractions, sorted(fractions))
+        self.assertEqual(fractions[-1], 1.0)
+        self.assertTrue(0.5 in fractions)
+        cPalabra.postprocess()
+        for path in PATHS:
+            os.remove(path)
+            os.remove(word.get_index_path(path))